@@ -0,0 +1,405 @@
+"""
+Local stand-in for the Indigitall API — replays recorded payloads, pages synthetic lists.
+
+Serves every endpoint the extractors call (scripts/extractors/*, extract_sms_bulk.py)
+so their throughput can be measured without touching am1:
+
+    recorded   /v1/application, dateStats, pushHeatmap, stats/device,
+               /v1/application/stats, /v1/chat/agent/status, /v1/campaign/stats
+               — the JSON in scripts/api_responses/, as captured
+    paged      /v1/chat/contacts, /v1/campaign (pages from 0), /v2/sms/send,
+               /v2/sms/contact (pages from 1; body carries the list "count"),
+               /v1/chat/history/csv (CSV, --history-pages per date window):
+               --pages full pages of whatever `limit` the caller asks for, then
+               one short page. Records are generated from (application, page)
+               only, so a re-run receives byte-identical pages (dedup paths).
+    synthetic  agent conversations, chat channel/configuration/topic/integration,
+               SMS campaigns/stats/topics, sending details
+    404        /v1/email/stats, /v1/inApp/stats (as on am1 for this account)
+
+Every response waits --latency-ms (± --jitter-ms). 429s (with Retry-After) are
+injected at random (--error-rate) and/or whenever requests exceed --quota per
+second. Authentication headers are accepted, not checked. GET /_stats returns
+the counters (requests, 429s, records served, per endpoint).
+
+Usage:
+    python scripts/api_replay_server.py --port 8099
+    python scripts/api_replay_server.py --port 8099 --latency-ms 120 --error-rate 0.02
+    python scripts/api_replay_server.py --port 8099 --pages 40 --quota 10
+
+Then point the extractors at it: INDIGITALL_API_BASE_URL=http://127.0.0.1:8099
+(scripts/benchmark_extractors.py starts it for you).
+"""
+
+import argparse
+import csv
+import io
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+RESPONSES_DIR = Path(__file__).resolve().parent / "api_responses"
+
+HISTORY_COLUMNS = [
+    "messageId", "messageDate", "sendType", "contentType", "status", "profileName",
+    "contactId", "agentConversationId", "agentId", "agentCloseReason", "dfIntentName",
+    "isFallback", "content", "integration", "channel",
+]
+SEND_TYPES = ["input", "operator", "dialogflow", "agent_notification", "template"]
+
+
+def load_recording(name: str) -> dict:
+    return json.loads((RESPONSES_DIR / name).read_text(encoding="utf-8"))
+
+
+def _iso(ts: datetime) -> str:
+    return ts.strftime("%Y-%m-%dT%H:%M:%S.") + f"{ts.microsecond // 1000:03d}Z"
+
+
+def _int(value, default: int) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class ReplayAPI:
+    """Routes, synthetic data and counters; shared by every handler thread."""
+
+    def __init__(self, pages: int = 5, history_pages: int = 2, latency_ms: float = 0,
+                 jitter_ms: float = 0, error_rate: float = 0.0, quota: float = 0,
+                 retry_after: float = 1, seed: int = 7):
+        self.pages = max(0, pages)
+        self.history_pages = max(0, history_pages)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.quota = quota
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        # Synthetic timestamps hang off the start of today: stable for a whole run
+        self.anchor = datetime.combine(date.today(), datetime.min.time(), tzinfo=timezone.utc)
+        self.lock = threading.Lock()
+        self.recent = deque()  # request times inside the last second (--quota)
+        self.counters = Counter()
+        self.by_endpoint = Counter()
+
+        contacts = load_recording("09_chat_contacts.json")["data"]
+        self.contact_template = contacts[0] if contacts else {}
+        self.routes = [
+            (r"/v1/application", self.recorded("02_applications.json")),
+            (r"/v1/application/stats", self.recorded("15_account_stats.json")),
+            (r"/v1/application/\d+/dateStats", self.recorded("04_date_stats.json")),
+            (r"/v1/application/\d+/pushHeatmap", self.recorded("06_push_heatmap.json")),
+            (r"/v1/application/\d+/stats/device", self.recorded("13_device_stats.json")),
+            (r"/v1/chat/agent/status", self.recorded("14_chat_agent_status.json")),
+            (r"/v1/campaign/stats", self.recorded("08_campaign_stats.json")),
+            (r"/v1/campaign", self.paged(self.campaign, first_page=0)),
+            (r"/v1/chat/contacts", self.paged(self.chat_contact, first_page=0)),
+            (r"/v1/chat/history/csv", self.history_csv),
+            (r"/v1/chat/agent/conversations", self.conversations),
+            (r"/v1/chat/channel", self.fixed([
+                {"id": 391, "type": "cloudapi", "name": "WhatsApp", "status": "active"},
+                {"id": 392, "type": "webchat", "name": "Web", "status": "active"},
+            ])),
+            (r"/v1/chat/configuration", self.fixed({"businessHours": None, "queueEnabled": True})),
+            (r"/v1/chat/topic", self.fixed([{"id": 10 + i, "name": f"Tema {i}"} for i in range(5)])),
+            (r"/v1/chat/integration", self.fixed([{"id": 1, "type": "dialogflow"}])),
+            (r"/v1/(email|inApp)/stats", self.not_found),
+            (r"/v2/sms/campaign", self.sms_campaigns),
+            (r"/v2/sms/stats/(campaign|application)", self.fixed([])),
+            (r"/v2/sms/stats/campaign/[^/]+", self.fixed([])),
+            (r"/v2/sms/send", self.paged(self.sms_sending, first_page=1, items_key="sendings")),
+            (r"/v2/sms/send/[^/]+", self.sms_sending_detail),
+            (r"/v2/sms/contact", self.paged(self.sms_contact, first_page=1, items_key="contacts")),
+            (r"/v2/sms/topic", self.fixed([])),
+        ]
+        self.routes = [(re.compile(pattern + "$"), handler) for pattern, handler in self.routes]
+
+    # ------------------------------------------------------------------
+    # Throttling / latency
+    # ------------------------------------------------------------------
+
+    def rate_limited(self) -> bool:
+        """Record one request; True when it gets a 429 (random or over --quota)."""
+        now = time.monotonic()
+        with self.lock:
+            self.counters["requests"] += 1
+            if self.error_rate and self.rng.random() < self.error_rate:
+                return True
+            if self.quota:
+                while self.recent and now - self.recent[0] >= 1:
+                    self.recent.popleft()
+                if len(self.recent) >= self.quota:
+                    return True
+                self.recent.append(now)
+        return False
+
+    def delay(self):
+        if self.latency_ms or self.jitter_ms:
+            with self.lock:
+                jitter = self.rng.uniform(-self.jitter_ms, self.jitter_ms)
+            time.sleep(max(0.0, self.latency_ms + jitter) / 1000)
+
+    # ------------------------------------------------------------------
+    # Dispatch
+    # ------------------------------------------------------------------
+
+    def handle(self, method: str, target: str) -> tuple[int, str, bytes, dict]:
+        """(status, content type, body, extra headers) for one request."""
+        url = urlsplit(target)
+        path = url.path.rstrip("/") or "/"
+        params = {k: v[-1] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+
+        if path == "/_stats":
+            with self.lock:
+                stats = {**self.counters, "endpoints": dict(self.by_endpoint)}
+            return 200, "application/json", json.dumps(stats).encode(), {}
+
+        throttled = self.rate_limited()
+        self.delay()
+        if throttled:
+            with self.lock:
+                self.counters["throttled"] += 1
+            body = {"statusCode": 429, "message": "Too many requests"}
+            return 429, "application/json", json.dumps(body).encode(), {
+                "Retry-After": f"{self.retry_after:g}"}
+
+        if method == "POST" and path == "/v1/auth":
+            return 200, "application/json", json.dumps({"token": "replay"}).encode(), {}
+
+        for pattern, handler in self.routes:
+            if method == "GET" and pattern.match(path):
+                status, payload, records = handler(path, params)
+                with self.lock:
+                    self.counters["records"] += records
+                    self.by_endpoint[pattern.pattern.rstrip("$")] += 1
+                if isinstance(payload, str):
+                    return status, "text/csv; charset=utf-8", payload.encode("utf-8"), {}
+                return status, "application/json", json.dumps(payload).encode("utf-8"), {}
+
+        with self.lock:
+            self.counters["unknown"] += 1
+        return self.json_404()
+
+    @staticmethod
+    def json_404() -> tuple[int, str, bytes, dict]:
+        body = {"statusCode": 404, "message": "not found", "data": None}
+        return 404, "application/json", json.dumps(body).encode(), {}
+
+    # ------------------------------------------------------------------
+    # Response builders — each returns (status, payload, records served)
+    # ------------------------------------------------------------------
+
+    def recorded(self, name: str):
+        payload = load_recording(name)
+
+        def handler(path, params):
+            data = payload.get("data")
+            return payload.get("statusCode", 200), payload, len(data) if isinstance(data, list) else 0
+        return handler
+
+    def fixed(self, data):
+        def handler(path, params):
+            count = len(data) if isinstance(data, list) else 1
+            return 200, {"statusCode": 200, "message": "OK", "count": count, "data": data}, 0
+        return handler
+
+    def not_found(self, path, params):
+        return 404, {"statusCode": 404, "message": "not found", "data": None}, 0
+
+    def page_items(self, params: dict, first_page: int, pages: int) -> tuple[list[int], int]:
+        """(record indexes on the requested page, list total): `pages` full pages, then a short one."""
+        limit = max(1, _int(params.get("limit"), 100))
+        page = _int(params.get("page"), first_page) - first_page
+        total = pages * limit + limit // 2 if pages else 0
+        start = page * limit
+        return list(range(max(0, start), min(total, start + limit))), total
+
+    def paged(self, make_item, first_page: int, items_key: str | None = None):
+        def handler(path, params):
+            app_id = params.get("applicationId", "")
+            indexes, total = self.page_items(params, first_page, self.pages)
+            items = [make_item(app_id, i) for i in indexes]
+            data = {items_key: items} if items_key else items
+            return 200, {"statusCode": 200, "message": "OK", "count": total, "data": data}, len(items)
+        return handler
+
+    def chat_contact(self, app_id: str, i: int) -> dict:
+        created = self.anchor - timedelta(minutes=7 * i + 1)
+        return {
+            **self.contact_template,
+            "contactId": str(573000000000 + i),
+            "id": 8900000 + i,
+            "profileName": f"Contacto {i}",
+            "createdAt": _iso(created),
+            "updatedAt": _iso(created + timedelta(hours=i % 48)),
+            "lastInputMessage": _iso(created + timedelta(hours=i % 48)),
+        }
+
+    def campaign(self, app_id: str, i: int) -> dict:
+        begin = self.anchor.date() - timedelta(days=i % 90)
+        sent = 100 + (i * 7919) % 50000
+        return {
+            "id": str(90000 + i), "applicationId": app_id, "name": f"Campana {i}",
+            "channel": ("push", "sms", "email")[i % 3],
+            "status": ("finished", "sending", "draft")[i % 3],
+            "sent": sent, "delivered": int(sent * 0.9), "clicked": int(sent * 0.03),
+            "opened": int(sent * 0.2), "startDate": begin.isoformat(),
+            "endDate": (begin + timedelta(days=1 + i % 9)).isoformat(),
+        }
+
+    def sms_sending(self, app_id: str, i: int) -> dict:
+        # newest first, like the live listing
+        return {
+            "id": f"{app_id}-{i:09d}", "applicationId": app_id,
+            "campaignId": str(5000 + i % 3), "estimatedChunks": 1 + i % 2,
+            "type": "campaign", "mode": "standard", "flash": False,
+            "sentAt": _iso(self.anchor - timedelta(seconds=30 * i)),
+        }
+
+    def sms_sending_detail(self, path, params):
+        sid = path.rsplit("/", 1)[-1]
+        return 200, {"statusCode": 200, "message": "OK", "data": {
+            "id": sid, "campaignSnapshot": {"id": "5000", "name": "Campana SMS 0"},
+        }}, 1
+
+    def sms_contact(self, app_id: str, i: int) -> dict:
+        created = self.anchor - timedelta(minutes=11 * i + 1)
+        return {
+            "id": f"{app_id}-c{i:09d}", "phone": str(573100000000 + i), "countryCode": "57",
+            "externalCode": None, "enabled": i % 17 != 0, "createdAt": _iso(created),
+            "updatedAt": _iso(created + timedelta(days=i % 30)), "unsubscriptionUrl": None,
+        }
+
+    def sms_campaigns(self, path, params):
+        campaigns = [{"id": str(5000 + i), "name": f"Campana SMS {i}", "status": "finished"}
+                     for i in range(3)]
+        return 200, {"statusCode": 200, "message": "OK", "count": len(campaigns),
+                     "data": {"campaigns": campaigns}}, len(campaigns)
+
+    def conversations(self, path, params):
+        n = self.pages * 100
+        rows = []
+        for i in range(n):
+            queued = self.anchor - timedelta(minutes=13 * i + 5)
+            rows.append({
+                "agentSessionId": 700000 + i, "conversationSessionId": 300000 + i // 2,
+                "contactId": str(573000000000 + i % 500), "agentId": 4000 + i % 25,
+                "email": f"agente{i % 25}@coop.co", "channel": "cloudapi",
+                "queuedAt": _iso(queued), "assignedAt": _iso(queued + timedelta(seconds=90)),
+                "closedAt": _iso(queued + timedelta(minutes=20)),
+                "initialAgentSession": 700000 + i if i % 3 else None,
+            })
+        return 200, {"statusCode": 200, "message": "OK", "count": n, "data": rows}, n
+
+    def history_csv(self, path, params):
+        """CSV page of a date window; message ids depend on the window and position only."""
+        try:
+            start = date.fromisoformat(params.get("dateFrom", ""))
+        except ValueError:
+            return 400, {"statusCode": 400, "message": "One or both dates are invalid"}, 0
+        indexes, _ = self.page_items(params, 0, self.history_pages)
+        window = start.toordinal()
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(HISTORY_COLUMNS)
+        for i in indexes:
+            ts = datetime.combine(start, datetime.min.time(), tzinfo=timezone.utc) + \
+                timedelta(seconds=(i * 97) % (7 * 86400))
+            send_type = SEND_TYPES[i % len(SEND_TYPES)]
+            is_agent = send_type == "operator"
+            writer.writerow([
+                f"wamid.{window}.{i:08d}", _iso(ts), send_type, "text",
+                ("read", "delivered", "sent")[i % 3], f"Contacto {i % 500}",
+                str(573000000000 + i % 500), str(700000 + i % 1000) if is_agent else "",
+                str(4000 + i % 25) if is_agent else "", "", "", "No",
+                "Hola, quisiera consultar el saldo de mi cuenta", "df", "cloudapi",
+            ])
+        return 200, out.getvalue(), len(indexes)
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like am1
+    api: ReplayAPI = None
+    verbose = False
+
+    def _respond(self, method: str):
+        length = _int(self.headers.get("Content-Length"), 0)
+        if length:
+            self.rfile.read(length)
+        status, content_type, body, headers = self.api.handle(method, self.path)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._respond("GET")
+
+    def do_POST(self):
+        self._respond("POST")
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(api: ReplayAPI, host: str = "127.0.0.1", port: int = 8099,
+                verbose: bool = False) -> ThreadingHTTPServer:
+    handler = type("Handler", (ReplayHandler,), {"api": api, "verbose": verbose})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Indigitall API replay server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--pages", type=int, default=5,
+                        help="Full pages per paged list, then one short page (default: 5)")
+    parser.add_argument("--history-pages", type=int, default=2,
+                        help="Full chat history CSV pages per date window (default: 2)")
+    parser.add_argument("--latency-ms", type=float, default=0,
+                        help="Delay before every response (default: 0)")
+    parser.add_argument("--jitter-ms", type=float, default=0,
+                        help="Uniform ± jitter on the delay (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Share of requests answered 429 at random (default: 0)")
+    parser.add_argument("--quota", type=float, default=0,
+                        help="Requests per second served before answering 429 (default: unlimited)")
+    parser.add_argument("--retry-after", type=float, default=1,
+                        help="Retry-After seconds sent with every 429 (default: 1)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    api = ReplayAPI(pages=args.pages, history_pages=args.history_pages,
+                    latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                    error_rate=args.error_rate, quota=args.quota,
+                    retry_after=args.retry_after, seed=args.seed)
+    server = make_server(api, args.host, args.port, args.verbose)
+    print(f"  Indigitall replay API on http://{args.host}:{server.server_port} "
+          f"(pages={args.pages}, latency={args.latency_ms:g}ms, 429 rate={args.error_rate:g}, "
+          f"quota={args.quota or 'none'})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Benchmark — extractor throughput against the local API replay server.
+
+Starts scripts/api_replay_server.py in a subprocess (its latency sleeps stay
+out of the measurements), points the extraction settings at it and runs, one
+after the other:
+
+    orchestrator   scripts.extractors.orchestrator.main() for one tenant
+                   (--full-refresh, --max-workers 1: in this process)
+    sms_bulk       scripts/extract_sms_bulk.py main() for the same tenant (--full)
+
+For each phase it reports wall time, requests/s and records/s (as counted by
+the server), 429s, and where the client threads spent their time:
+
+    network   inside requests.Session.send (request out → response read)
+    pacing    sleeping in TokenBucket.acquire() for the request quota
+    backoff   every other sleep — 429 / error retries
+
+Both are summed over threads, so with concurrency they can exceed the wall time;
+"in flight" is network seconds / wall seconds, the average requests outstanding.
+The server pages are deterministic, so after the first run the extractors take
+their dedup path (unchanged payloads are not stored again).
+
+Usage:
+    python scripts/benchmark_extractors.py
+    python scripts/benchmark_extractors.py --latency-ms 150 --rps 20 --concurrency 8
+    python scripts/benchmark_extractors.py --error-rate 0.05 --only sms_bulk --workers 8
+
+Point DATABASE_URL (and DB_HOST / POSTGRES_PASSWORD for extract_sms_bulk) at a
+scratch database: both phases write raw.* / public.sms_* rows and cursors.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.models.database import engine
+from scripts.extractors.config import extraction_settings as cfg
+
+SERVER_SCRIPT = Path(__file__).resolve().parent / "api_replay_server.py"
+PHASES = ["orchestrator", "sms_bulk"]
+
+
+class ClientMeter:
+    """Thread-safe totals of network and sleep seconds across every client thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.network = 0.0
+        self.pacing = 0.0
+        self.backoff = 0.0
+
+    def add(self, field: str, seconds: float, requests: int = 0):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + seconds)
+            self.requests += requests
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"requests": self.requests, "network": self.network,
+                    "pacing": self.pacing, "backoff": self.backoff}
+
+
+@contextlib.contextmanager
+def metered(meter: ClientMeter):
+    """Time Session.send and time.sleep for as long as the block runs."""
+    send, sleep = requests.Session.send, time.sleep
+
+    def timed_send(session, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            return send(session, request, **kwargs)
+        finally:
+            meter.add("network", time.perf_counter() - start, requests=1)
+
+    def timed_sleep(seconds):
+        # TokenBucket.acquire is the only pacing sleep; the rest are retries
+        field = "pacing" if sys._getframe(1).f_code.co_name == "acquire" else "backoff"
+        start = time.perf_counter()
+        try:
+            sleep(seconds)
+        finally:
+            meter.add(field, time.perf_counter() - start)
+
+    requests.Session.send, time.sleep = timed_send, timed_sleep
+    try:
+        yield meter
+    finally:
+        requests.Session.send, time.sleep = send, sleep
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def server_stats(base_url: str) -> dict:
+    with urllib.request.urlopen(f"{base_url}/_stats", timeout=5) as resp:
+        return json.loads(resp.read())
+
+
+def start_server(args, port: int) -> subprocess.Popen:
+    cmd = [sys.executable, str(SERVER_SCRIPT), "--port", str(port),
+           "--pages", str(args.pages), "--history-pages", str(args.history_pages),
+           "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+           "--error-rate", str(args.error_rate), "--quota", str(args.quota),
+           "--retry-after", str(args.retry_after)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            server_stats(base_url)
+            return proc
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError(f"replay server exited with {proc.returncode}")
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("replay server did not start")
+
+
+def run_orchestrator(args, base_url: str):
+    from scripts.extractors import orchestrator
+
+    cfg.INDIGITALL_API_BASE_URL = base_url
+    cfg.INDIGITALL_SERVER_KEY = cfg.INDIGITALL_SERVER_KEY or "replay"
+    if args.rps:
+        cfg.API_REQUESTS_PER_SECOND = args.rps
+    argv = ["orchestrator", "--tenants", args.tenant, "--max-workers", "1", "--full-refresh"]
+    if args.concurrency:
+        argv += ["--concurrency", str(args.concurrency)]
+    sys.argv = argv
+    orchestrator.main()
+
+
+def run_sms_bulk(args, base_url: str):
+    # extract_sms_bulk reads its CLI flags and .env at import time
+    sys.argv = ["extract_sms_bulk.py", "--tenants", args.tenant, "--max-workers", "1",
+                "--full", "--workers", str(args.workers)]
+    from scripts import extract_sms_bulk as bulk
+    from scripts.extractors.rate_limiter import TokenBucket
+
+    bulk.API_BASE = base_url
+    if args.rps:
+        bulk.REQUESTS_PER_SECOND = args.rps
+        bulk.limiter = TokenBucket(args.rps, burst=bulk.WORKERS)
+    # Without DB_HOST in .env, connect where DATABASE_URL points
+    if not bulk.env.get("DB_HOST"):
+        bulk.DB_HOST = engine.url.host or engine.url.query.get("host") or bulk.DB_HOST
+        bulk.DB_PASS = bulk.DB_PASS or engine.url.password or ""
+    bulk.main()
+
+
+RUNNERS = {"orchestrator": run_orchestrator, "sms_bulk": run_sms_bulk}
+
+
+def run_phase(name: str, args, base_url: str) -> dict:
+    before = server_stats(base_url)
+    meter = ClientMeter()
+    output = io.StringIO()
+    start = time.perf_counter()
+    error = None
+    with metered(meter):
+        try:
+            with contextlib.redirect_stdout(sys.stdout if args.verbose else output):
+                RUNNERS[name](args, base_url)
+        except Exception as exc:
+            error = exc
+    wall = time.perf_counter() - start
+    after = server_stats(base_url)
+
+    if error is not None:
+        print(output.getvalue()[-2000:])
+        print(f"  [ERROR] {name}: {error}")
+    served = {k: after.get(k, 0) - before.get(k, 0) for k in ("requests", "throttled", "records")}
+    return {"phase": name, "wall": wall, "error": error, **served,
+            "client": meter.snapshot()}
+
+
+def print_report(results: list[dict], args):
+    print("\n" + "=" * 72)
+    print("  Extractor throughput — local replay API")
+    print(f"  latency={args.latency_ms:g}ms ±{args.jitter_ms:g}  429 rate={args.error_rate:g}  "
+          f"quota={args.quota or 'none'}  pages={args.pages}  history pages={args.history_pages}")
+    print("=" * 72)
+    print(f"  {'Phase':<13s} {'Wall':>7s} {'Reqs':>6s} {'req/s':>7s} {'Records':>8s} "
+          f"{'rec/s':>8s} {'429s':>5s}")
+    print(f"  {'─' * 13} {'─' * 7} {'─' * 6} {'─' * 7} {'─' * 8} {'─' * 8} {'─' * 5}")
+    for r in results:
+        wall = r["wall"] or 1e-9
+        print(f"  {r['phase']:<13s} {r['wall']:>6.1f}s {r['requests']:>6,d} "
+              f"{r['requests'] / wall:>7.1f} {r['records']:>8,d} {r['records'] / wall:>8,.0f} "
+              f"{r['throttled']:>5,d}")
+
+    print(f"\n  {'Phase':<13s} {'Network':>9s} {'Pacing':>9s} {'Backoff':>9s} {'In flight':>10s}"
+          f"   (thread-seconds)")
+    print(f"  {'─' * 13} {'─' * 9} {'─' * 9} {'─' * 9} {'─' * 10}")
+    for r in results:
+        c, wall = r["client"], r["wall"] or 1e-9
+        print(f"  {r['phase']:<13s} {c['network']:>8.1f}s {c['pacing']:>8.1f}s "
+              f"{c['backoff']:>8.1f}s {c['network'] / wall:>10.2f}")
+    failed = [r["phase"] for r in results if r["error"] is not None]
+    if failed:
+        print(f"\n  [ERROR] failed: {', '.join(failed)} — rerun with --verbose")
+    print("=" * 72)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark extractors against the local replay API")
+    parser.add_argument("--only", choices=PHASES, help="Run a single phase")
+    parser.add_argument("--tenant", default="visionamos")
+    parser.add_argument("--pages", type=int, default=5,
+                        help="Full pages per paged list served (default: 5)")
+    parser.add_argument("--history-pages", type=int, default=2,
+                        help="Full chat history pages per 7-day window (default: 2)")
+    parser.add_argument("--latency-ms", type=float, default=50,
+                        help="Server delay per response (default: 50)")
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Share of requests answered 429 at random (default: 0)")
+    parser.add_argument("--quota", type=float, default=0,
+                        help="Server-side requests/s before 429 (default: unlimited)")
+    parser.add_argument("--retry-after", type=float, default=1)
+    parser.add_argument("--rps", type=float, default=0,
+                        help="Client request rate (default: API_REQUESTS_PER_SECOND settings)")
+    parser.add_argument("--concurrency", type=int, default=0,
+                        help="orchestrator --concurrency (default: EXTRACTION_CONCURRENCY)")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="extract_sms_bulk --workers (default: 4)")
+    parser.add_argument("--verbose", action="store_true", help="Show the extractors' own output")
+    args = parser.parse_args()
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    print("=" * 72)
+    print(f"  Extractor benchmark — replay API on {base_url}")
+    print("=" * 72, flush=True)
+
+    server = start_server(args, port)
+    argv = sys.argv
+    results = []
+    try:
+        for name in [args.only] if args.only else PHASES:
+            print(f"\n  Running {name}...", flush=True)
+            results.append(run_phase(name, args, base_url))
+    finally:
+        sys.argv = argv
+        server.terminate()
+        server.wait()
+    print_report(results, args)
+    return 1 if any(r["error"] is not None for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
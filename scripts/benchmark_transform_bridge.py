@@ -0,0 +1,319 @@
+"""
+Benchmark — transform_bridge per-row upserts vs set-based INSERT ... SELECT.
+
+Seeds a synthetic raw.* dataset (chat history pages, agent conversations,
+contacts, push dateStats/pushHeatmap, campaigns, channels, topics) and times
+every transform twice inside one transaction that is rolled back at the end:
+
+    before  fetchall() the flatten query, one parameterised upsert per row
+    after   the single server-side statement transform_bridge runs today
+
+Usage:
+    python scripts/benchmark_transform_bridge.py
+    python scripts/benchmark_transform_bridge.py --messages 200000 --conversations 40000
+
+Point DATABASE_URL at a scratch database: the flatten queries read every
+raw.* row, so any data already stored there is included in the timings.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+from sqlalchemy import text
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.models.database import engine
+from scripts import transform_bridge as tb
+from scripts.land_chat_rows import LANDINGS
+
+# (entity, flatten SELECT, set-based upsert) — same order as the pipeline
+BENCH_ENTITIES = [
+    ("contacts",           tb.CONTACTS_SQL,      tb.CONTACTS_UPSERT),
+    ("daily_stats",        tb.DAILY_STATS_SQL,   tb.DAILY_STATS_UPSERT),
+    ("toques_daily",       tb.TOQUES_DAILY_SQL,  tb.TOQUES_DAILY_UPSERT),
+    ("toques_heatmap",     tb.HEATMAP_SQL,       tb.HEATMAP_UPSERT),
+    ("campaigns",          tb.CAMPAIGNS_SQL,     tb.CAMPAIGNS_UPSERT),
+    ("chat_conversations", tb.CONVERSATIONS_SQL, tb.CONVERSATIONS_UPSERT),
+    ("chat_channels",      tb.CHANNELS_SQL,      tb.CHANNELS_UPSERT),
+    ("chat_topics",        tb.TOPICS_SQL,        tb.TOPICS_UPSERT),
+    ("messages",           tb.MESSAGES_SQL,      tb.MESSAGES_UPSERT),
+]
+
+HISTORY_PAGE_SIZE = 500
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+
+# ---------------------------------------------------------------------------
+# Synthetic raw dataset
+# ---------------------------------------------------------------------------
+
+def _iso(ts: datetime) -> str:
+    return ts.strftime("%Y-%m-%dT%H:%M:%S.") + f"{ts.microsecond // 1000:03d}Z"
+
+
+def _insert_pages(conn, table: str, endpoint: str, payloads: list[dict],
+                  loaded_at: datetime, date_from: date, date_to: date):
+    """Store payloads the way BaseExtractor._store_raw does (tenant_id NULL)."""
+    if not payloads:
+        return
+    conn.execute(
+        text(f"""
+            INSERT INTO {table}
+                (application_id, tenant_id, endpoint, loaded_at, date_from, date_to, source_data)
+            VALUES
+                (:app_id, NULL, :endpoint, :loaded_at, :dfrom, :dto, :data)
+        """),
+        [
+            {
+                "app_id": tb.APP_ID,
+                "endpoint": endpoint,
+                "loaded_at": loaded_at + timedelta(milliseconds=i),
+                "dfrom": date_from,
+                "dto": date_to,
+                "data": json.dumps(p),
+            }
+            for i, p in enumerate(payloads)
+        ],
+    )
+
+
+def seed_raw(conn, n_messages: int, n_conversations: int, n_contacts: int,
+             days: int, n_campaigns: int, reload_ratio: float = 0.1, seed: int = 7):
+    """Insert a synthetic raw.* dataset shaped like real extractor output.
+
+    A `reload_ratio` share of pages is stored twice (later loaded_at), like the
+    chat extractor's one-day overlap, so the dedup windows have work to do.
+    """
+    rng = random.Random(seed)
+    date_to = date.today()
+    date_from = date_to - timedelta(days=days)
+    start = datetime.combine(date_from, datetime.min.time(), tzinfo=timezone.utc)
+    first_load = datetime.now(timezone.utc) - timedelta(days=1)
+    second_load = first_load + timedelta(hours=12)
+
+    contacts = [str(573000000000 + i) for i in range(n_contacts)]
+    agents = [str(4000 + i) for i in range(25)]
+
+    def pages(rows, size):
+        return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+    def store(table, endpoint, payloads):
+        _insert_pages(conn, table, endpoint, payloads, first_load, date_from, date_to)
+        # Re-fetched pages carry a marker: byte-identical payloads would be
+        # skipped by the raw tables' payload_hash unique index.
+        reloaded = [{**p, "reloaded": True} for p in payloads if rng.random() < reload_ratio]
+        _insert_pages(conn, table, endpoint, reloaded, second_load, date_from, date_to)
+
+    # contacts (/v1/chat/contacts)
+    contact_rows = []
+    for cid in contacts:
+        created = start + timedelta(minutes=rng.randrange(days * 1440))
+        contact_rows.append({
+            "contactId": cid,
+            "profileName": f"Contacto {cid[-5:]}",
+            "createdAt": _iso(created),
+            "updatedAt": _iso(created + timedelta(hours=rng.randrange(200))),
+            "channel": "cloudapi",
+        })
+    store("raw.raw_contacts_api", "/v1/chat/contacts",
+          [{"statusCode": 200, "data": p} for p in pages(contact_rows, 100)])
+
+    # push dateStats + pushHeatmap
+    stats_rows = []
+    for d in range(days + 1):
+        for platform in ("android", "ios", "web"):
+            sent = rng.randrange(0, 5000)
+            ok = int(sent * rng.uniform(0.8, 1.0))
+            stats_rows.append({
+                "platformGroup": platform,
+                "statsDate": (date_from + timedelta(days=d)).isoformat(),
+                "numDevicesSent": sent,
+                "numDevicesSuccess": ok,
+                "numDevicesReceived": int(ok * rng.uniform(0.1, 0.6)),
+                "numDevicesClicked": int(ok * rng.uniform(0.0, 0.1)),
+            })
+    store("raw.raw_push_stats", f"/v1/application/{tb.APP_ID}/dateStats",
+          [{"statusCode": 200, "data": stats_rows}])
+    heatmap = {day: {str(h): round(rng.uniform(0, 0.1), 4) for h in range(8, 23)}
+               for day in WEEKDAYS}
+    store("raw.raw_push_stats", f"/v1/application/{tb.APP_ID}/pushHeatmap",
+          [{"statusCode": 200, "data": {"heatmap": "general", "weekday-hour": heatmap}}])
+
+    # campaigns (/v1/campaign)
+    campaign_rows = []
+    for i in range(n_campaigns):
+        begin = date_from + timedelta(days=rng.randrange(days))
+        sent = rng.randrange(100, 50000)
+        campaign_rows.append({
+            "id": str(90000 + i),
+            "name": f"Campana {i}",
+            "channel": rng.choice(["push", "sms", "email"]),
+            "status": rng.choice(["finished", "sending", "draft"]),
+            "sent": sent,
+            "delivered": int(sent * 0.9),
+            "clicked": int(sent * 0.03),
+            "opened": int(sent * 0.2),
+            "startDate": begin.isoformat(),
+            "endDate": (begin + timedelta(days=rng.randrange(1, 10))).isoformat(),
+        })
+    store("raw.raw_campaigns_api", "/v1/campaign",
+          [{"statusCode": 200, "data": p} for p in pages(campaign_rows, 100)])
+
+    # channels + topics
+    store("raw.raw_chat_stats", "/v1/chat/channel", [{"statusCode": 200, "count": 2, "data": [
+        {"id": 391, "type": "cloudapi", "name": "WhatsApp", "phoneNumber": "573000000000",
+         "status": "active"},
+        {"id": 392, "type": "webchat", "name": "Web", "status": "active"},
+    ]}])
+    store("raw.raw_chat_stats", "/v1/chat/topic", [{"statusCode": 200, "count": 5, "data": [
+        {"id": 10 + i, "name": f"Tema {i}", "description": None, "isActive": i != 4}
+        for i in range(5)
+    ]}])
+
+    # agent conversations (/v1/chat/agent/conversations)
+    conv_rows = []
+    for i in range(n_conversations):
+        queued = start + timedelta(minutes=rng.randrange(days * 1440))
+        assigned = queued + timedelta(seconds=rng.randrange(0, 900)) if rng.random() < 0.9 else None
+        closed = (assigned + timedelta(seconds=rng.randrange(60, 3600))) if assigned else None
+        conv_rows.append({
+            "agentSessionId": 700000 + i,
+            "conversationSessionId": 300000 + i // 2,
+            "contactId": rng.choice(contacts),
+            "agentId": int(rng.choice(agents)),
+            "email": f"agente{rng.randrange(25)}@coop.co",
+            "channel": "cloudapi",
+            "queuedAt": _iso(queued),
+            "assignedAt": _iso(assigned) if assigned else None,
+            "closedAt": _iso(closed) if closed else None,
+            "initialAgentSession": 700000 + i if i % 3 else None,
+        })
+    store("raw.raw_chat_stats", "/v1/chat/agent/conversations",
+          [{"statusCode": 200, "data": conv_rows}])
+
+    # chat history CSV pages (/v1/chat/history/csv), columnar like ChatExtractor
+    # stores them — every value is a string
+    send_types = ["input", "operator", "dialogflow", "agent_notification", "template"]
+    msg_rows = []
+    for i in range(n_messages):
+        ts = start + timedelta(seconds=rng.randrange(days * 86400))
+        send_type = rng.choice(send_types)
+        is_agent = send_type == "operator"
+        msg_rows.append({
+            "messageId": f"wamid.{i:012d}",
+            "messageDate": _iso(ts),
+            "sendType": send_type,
+            "contentType": rng.choice(["text", "image", "interactive"]),
+            "status": rng.choice(["read", "delivered", "sent", ""]),
+            "profileName": "Contacto",
+            "contactId": rng.choice(contacts),
+            "agentConversationId": str(700000 + rng.randrange(n_conversations)) if is_agent else "",
+            "agentId": rng.choice(agents) if is_agent else "",
+            "agentCloseReason": "",
+            "dfIntentName": rng.choice(["", "Saldo", "Default Fallback Intent"]),
+            "isFallback": rng.choice(["Yes", "No", "No", "No"]),
+            "content": "Hola, quisiera consultar el saldo de mi cuenta " * rng.randrange(1, 4),
+            "integration": rng.choice(["df", "agent", ""]),
+            "channel": "cloudapi",
+        })
+    msg_rows.sort(key=lambda r: r["messageDate"])
+    columns = list(msg_rows[0]) if msg_rows else []
+    store("raw.raw_chat_stats", "/v1/chat/history/csv", [
+        {"page": n, "count": len(p), "format": "columnar", "columns": columns,
+         "rows": [[row[c] for c in columns] for row in p]}
+        for n, p in enumerate(pages(msg_rows, HISTORY_PAGE_SIZE))
+    ])
+
+
+# ---------------------------------------------------------------------------
+# Timed runs
+# ---------------------------------------------------------------------------
+
+def _per_row(conn, select_sql: str, upsert_sql: str, params: dict) -> int:
+    """The pre-set-based pattern: fetchall() + one upsert round trip per row."""
+    rows = conn.execute(text(select_sql), params).mappings().fetchall()
+    if not rows:
+        return 0
+    values = "VALUES (" + ", ".join(f":{col}" for col in rows[0].keys()) + ")"
+    stmt = text(upsert_sql.replace("SELECT * FROM src", values))
+    for r in rows:
+        conn.execute(stmt, {k: json.dumps(v) if isinstance(v, (dict, list)) else v
+                            for k, v in r.items()})
+    return len(rows)
+
+
+def _set_based(conn, select_sql: str, upsert_sql: str, params: dict) -> int:
+    counts = tb.run_upsert(conn, select_sql, upsert_sql, params)
+    return counts["inserted"] + counts["updated"] + counts["unchanged"]
+
+
+def _timed(conn, fn, *args) -> tuple[int, float]:
+    savepoint = conn.begin_nested()
+    start = time.perf_counter()
+    try:
+        count = fn(conn, *args)
+        return count, time.perf_counter() - start
+    finally:
+        savepoint.rollback()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark transform_bridge upserts")
+    parser.add_argument("--messages", type=int, default=50_000)
+    parser.add_argument("--conversations", type=int, default=10_000)
+    parser.add_argument("--contacts", type=int, default=5_000)
+    parser.add_argument("--campaigns", type=int, default=300)
+    parser.add_argument("--days", type=int, default=90)
+    args = parser.parse_args()
+
+    print("=" * 72)
+    print("  Transform Bridge Benchmark — per-row vs set-based upserts")
+    print("=" * 72)
+
+    params = {"tid": tb.TENANT_ID, "default_tid": tb.TENANT_ID, "app_id": tb.APP_ID,
+              "since": tb.FULL_REBUILD_SINCE, "until": datetime.now(timezone.utc)}
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            start = time.perf_counter()
+            seed_raw(conn, args.messages, args.conversations, args.contacts,
+                     args.days, args.campaigns)
+            # chat messages/conversations are read from the typed landing
+            # tables, which ChatExtractor fills alongside the archive
+            for _, _, land_sql in LANDINGS:
+                conn.execute(text(land_sql), params)
+            print(f"\n  Seeded synthetic raw.* dataset in {time.perf_counter() - start:.1f}s")
+            print(f"    messages={args.messages:,}  conversations={args.conversations:,}  "
+                  f"contacts={args.contacts:,}  days={args.days}")
+
+            print(f"\n  {'Entity':<20s} {'Rows':>8s} {'Before':>9s} {'rows/s':>9s} "
+                  f"{'After':>9s} {'rows/s':>9s} {'Speedup':>8s}")
+            print(f"  {'─' * 20} {'─' * 8} {'─' * 9} {'─' * 9} {'─' * 9} {'─' * 9} {'─' * 8}")
+
+            total_before = total_after = 0.0
+            for entity, select_sql, upsert_sql in BENCH_ENTITIES:
+                conn.execute(text(f"SELECT count(*) FROM ({select_sql}) warm"), params)
+                rows, before = _timed(conn, _per_row, select_sql, upsert_sql, params)
+                _, after = _timed(conn, _set_based, select_sql, upsert_sql, params)
+                total_before += before
+                total_after += after
+                print(f"  {entity:<20s} {rows:>8,d} {before:>8.2f}s {rows / before if before else 0:>9,.0f} "
+                      f"{after:>8.2f}s {rows / after if after else 0:>9,.0f} "
+                      f"{before / after if after else 0:>7.1f}x")
+
+            print(f"\n  Total: {total_before:.1f}s before, {total_after:.1f}s after "
+                  f"({total_before / total_after if total_after else 0:.1f}x)")
+        finally:
+            trans.rollback()
+            print("  Rolled back — database unchanged")
+    print("=" * 72)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Bulk loader — COPY rows into an UNLOGGED staging table, then merge into public.*.
+
+Replaces per-row / execute_values upserts for large loads: rows stream into
+staging.<table>_<backend pid> with COPY FROM STDIN (no WAL, no index
+maintenance), then one INSERT ... SELECT ... ON CONFLICT applies them to the
+target. The target is only locked for that single merge statement.
+
+Works on any psycopg2 cursor, including one taken from a SQLAlchemy
+connection (conn.connection.cursor()).
+
+Usage:
+    from scripts.bulk_loader import create_staging_table, copy_rows, merge_staging
+
+    staging = create_staging_table(cur, "public.sms_envios", COLUMNS)
+    copy_rows(cur, staging, COLUMNS, rows)
+    merge_staging(cur, staging, "public.sms_envios", COLUMNS,
+                  key_columns=["tenant_id", "sending_id"])
+    drop_staging_table(cur, staging)
+"""
+
+import io
+import json
+from datetime import date, datetime
+
+STAGING_SCHEMA = "staging"
+
+
+def staging_name(cur, target: str) -> str:
+    """staging.<table>_<pid> — unique per database session, so concurrent loaders never collide."""
+    cur.execute("SELECT pg_backend_pid()")
+    pid = cur.fetchone()[0]
+    return f"{STAGING_SCHEMA}.{target.split('.')[-1]}_{pid}"
+
+
+def create_staging_table(cur, target: str, columns: list[str]) -> str:
+    """(Re)create an empty UNLOGGED staging table with the target's column types.
+
+    A `_seq` identity column records load order so the newest copy of a key
+    wins the merge.
+    """
+    staging = staging_name(cur, target)
+    cur.execute(f"CREATE SCHEMA IF NOT EXISTS {STAGING_SCHEMA}")
+    cur.execute(f"DROP TABLE IF EXISTS {staging}")
+    cur.execute(f"""
+        CREATE UNLOGGED TABLE {staging} AS
+        SELECT {', '.join(columns)} FROM {target} WITH NO DATA
+    """)
+    cur.execute(f"ALTER TABLE {staging} ADD COLUMN _seq bigint GENERATED ALWAYS AS IDENTITY")
+    return staging
+
+
+def drop_staging_table(cur, staging: str):
+    cur.execute(f"DROP TABLE IF EXISTS {staging}")
+
+
+# ---------------------------------------------------------------------------
+# COPY
+# ---------------------------------------------------------------------------
+
+def _copy_value(value) -> str:
+    """Encode one value for COPY ... FROM STDIN (text format)."""
+    if value is None:
+        return r"\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    elif isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    else:
+        value = str(value)
+    return (value.replace("\\", "\\\\")
+                 .replace("\t", "\\t")
+                 .replace("\n", "\\n")
+                 .replace("\r", "\\r"))
+
+
+def copy_rows(cur, staging: str, columns: list[str], rows) -> int:
+    """COPY an iterable of tuples (in `columns` order) into the staging table."""
+    buf = io.StringIO()
+    count = 0
+    for row in rows:
+        buf.write("\t".join(_copy_value(v) for v in row))
+        buf.write("\n")
+        count += 1
+    if count:
+        buf.seek(0)
+        cur.copy_expert(f"COPY {staging} ({', '.join(columns)}) FROM STDIN", buf)
+    return count
+
+
+# ---------------------------------------------------------------------------
+# Merge
+# ---------------------------------------------------------------------------
+
+def merge_sql(staging: str, target: str, columns: list[str], key_columns: list[str],
+              update_columns: list[str] | None = None) -> str:
+    """INSERT ... SELECT ... ON CONFLICT applying staging rows to the target.
+
+    update_columns=None updates every non-key column; [] means DO NOTHING.
+    """
+    if update_columns is None:
+        update_columns = [c for c in columns if c not in key_columns]
+    keys = ", ".join(key_columns)
+    if update_columns:
+        action = "DO UPDATE SET\n    " + ",\n    ".join(
+            f"{c} = EXCLUDED.{c}" for c in update_columns
+        )
+    else:
+        action = "DO NOTHING"
+    return f"""
+INSERT INTO {target} ({', '.join(columns)})
+SELECT DISTINCT ON ({keys}) {', '.join(columns)}
+FROM {staging}
+ORDER BY {keys}, _seq DESC
+ON CONFLICT ({keys}) {action}
+"""
+
+
+def merge_staging(cur, staging: str, target: str, columns: list[str],
+                  key_columns: list[str], update_columns: list[str] | None = None,
+                  truncate: bool = True) -> int:
+    """Merge staging into target in one statement. Returns rows inserted/updated."""
+    cur.execute(merge_sql(staging, target, columns, key_columns, update_columns))
+    merged = cur.rowcount
+    if truncate:
+        cur.execute(f"TRUNCATE {staging}")
+    return merged
@@ -1,11 +1,17 @@
 """
 Create the 'raw' schema and landing tables for Indigitall API extraction.
 
+The page tables (PAGE_TABLES) are partitioned by month of loaded_at; this
+also creates the partitions for the current month and the next
+PARTITION_MONTHS_AHEAD. scripts/raw_maintenance.py keeps creating them and
+handles compaction and retention.
+
 Usage:
     docker compose exec app python scripts/create_raw_schema.py
 """
 
 import sys
+from datetime import date, datetime, time, timedelta, timezone
 from pathlib import Path
 
 from sqlalchemy import text
@@ -20,6 +26,41 @@ from app.models.database import engine
 
 CREATE_SCHEMA = "CREATE SCHEMA IF NOT EXISTS raw"
 
+# Landing tables written by BaseExtractor._store_raw, one row per API page.
+# Range-partitioned by month of loaded_at (raw.<table>_pYYYYMM, plus a DEFAULT
+# partition for months nobody created yet), so retention drops whole months.
+PAGE_TABLES = [
+    "raw_push_stats",
+    "raw_chat_stats",
+    "raw_sms_stats",
+    "raw_email_stats",
+    "raw_inapp_stats",
+    "raw_campaigns_api",
+    "raw_contacts_api",
+]
+
+# window_key/page: the page's position in a paged listing (NULL for single
+# responses); scripts/raw_maintenance.py --compact keeps the newest payload of each.
+PAGE_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS raw.{table} (
+        id              SERIAL,
+        application_id  VARCHAR(100),
+        tenant_id       VARCHAR(50),
+        endpoint        VARCHAR(200),
+        loaded_at       TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        date_from       DATE,
+        date_to         DATE,
+        window_key      VARCHAR(50),
+        page            INTEGER,
+        source_data     JSONB NOT NULL,
+        payload_hash    UUID GENERATED ALWAYS AS (md5(source_data::text)::uuid) STORED,
+        PRIMARY KEY (id, loaded_at)
+    ) PARTITION BY RANGE (loaded_at)
+"""
+
+# Months ahead of the current one that get their partition in advance
+PARTITION_MONTHS_AHEAD = 2
+
 RAW_TABLES = {
     "extraction_log": """
         CREATE TABLE IF NOT EXISTS raw.extraction_log (
@@ -46,88 +87,91 @@ RAW_TABLES = {
             source_data     JSONB NOT NULL
         )
     """,
-    "raw_push_stats": """
-        CREATE TABLE IF NOT EXISTS raw.raw_push_stats (
-            id              SERIAL PRIMARY KEY,
-            application_id  VARCHAR(100),
-            tenant_id       VARCHAR(50),
-            endpoint        VARCHAR(200),
-            loaded_at       TIMESTAMPTZ DEFAULT NOW(),
-            date_from       DATE,
-            date_to         DATE,
-            source_data     JSONB NOT NULL
-        )
-    """,
-    "raw_chat_stats": """
-        CREATE TABLE IF NOT EXISTS raw.raw_chat_stats (
-            id              SERIAL PRIMARY KEY,
-            application_id  VARCHAR(100),
-            tenant_id       VARCHAR(50),
-            endpoint        VARCHAR(200),
-            loaded_at       TIMESTAMPTZ DEFAULT NOW(),
-            date_from       DATE,
-            date_to         DATE,
-            source_data     JSONB NOT NULL
-        )
-    """,
-    "raw_sms_stats": """
-        CREATE TABLE IF NOT EXISTS raw.raw_sms_stats (
-            id              SERIAL PRIMARY KEY,
-            application_id  VARCHAR(100),
-            tenant_id       VARCHAR(50),
-            endpoint        VARCHAR(200),
-            loaded_at       TIMESTAMPTZ DEFAULT NOW(),
-            date_from       DATE,
-            date_to         DATE,
-            source_data     JSONB NOT NULL
+    **{table: PAGE_TABLE_DDL.format(table=table) for table in PAGE_TABLES},
+    "campaign_state": """
+        CREATE TABLE IF NOT EXISTS raw.campaign_state (
+            tenant_id       VARCHAR(50) NOT NULL,
+            application_id  VARCHAR(100) NOT NULL,
+            channel         VARCHAR(20) NOT NULL,
+            campaign_id     VARCHAR(100) NOT NULL,
+            status          VARCHAR(50),
+            campaign_hash   VARCHAR(32),
+            stats_hash      VARCHAR(32),
+            last_changed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            last_checked_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (tenant_id, application_id, channel, campaign_id)
         )
     """,
-    "raw_email_stats": """
-        CREATE TABLE IF NOT EXISTS raw.raw_email_stats (
-            id              SERIAL PRIMARY KEY,
-            application_id  VARCHAR(100),
-            tenant_id       VARCHAR(50),
-            endpoint        VARCHAR(200),
-            loaded_at       TIMESTAMPTZ DEFAULT NOW(),
-            date_from       DATE,
-            date_to         DATE,
-            source_data     JSONB NOT NULL
+    "page_checkpoints": """
+        CREATE TABLE IF NOT EXISTS raw.page_checkpoints (
+            tenant_id       VARCHAR(50) NOT NULL,
+            application_id  VARCHAR(100) NOT NULL,
+            endpoint        VARCHAR(200) NOT NULL,
+            window_key      VARCHAR(50) NOT NULL DEFAULT '',
+            next_page       INTEGER NOT NULL,
+            updated_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (tenant_id, application_id, endpoint, window_key)
         )
     """,
-    "raw_inapp_stats": """
-        CREATE TABLE IF NOT EXISTS raw.raw_inapp_stats (
-            id              SERIAL PRIMARY KEY,
-            application_id  VARCHAR(100),
-            tenant_id       VARCHAR(50),
-            endpoint        VARCHAR(200),
-            loaded_at       TIMESTAMPTZ DEFAULT NOW(),
-            date_from       DATE,
-            date_to         DATE,
-            source_data     JSONB NOT NULL
+    "backfill_units": """
+        CREATE TABLE IF NOT EXISTS raw.backfill_units (
+            id              BIGSERIAL PRIMARY KEY,
+            tenant_id       VARCHAR(50) NOT NULL,
+            application_id  VARCHAR(100) NOT NULL,
+            endpoint        VARCHAR(50) NOT NULL,
+            window_from     DATE NOT NULL,
+            window_to       DATE NOT NULL,
+            status          VARCHAR(10) NOT NULL DEFAULT 'pending',
+            attempts        INTEGER NOT NULL DEFAULT 0,
+            records         INTEGER,
+            error           TEXT,
+            planned_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            started_at      TIMESTAMPTZ,
+            finished_at     TIMESTAMPTZ,
+            UNIQUE (tenant_id, application_id, endpoint, window_from, window_to)
         )
     """,
-    "raw_campaigns_api": """
-        CREATE TABLE IF NOT EXISTS raw.raw_campaigns_api (
-            id              SERIAL PRIMARY KEY,
+    # Typed landing rows, upserted by id at extraction time (chat history CSV
+    # and agent conversations); transform_bridge reads these, not the JSONB.
+    "chat_message_rows": """
+        CREATE TABLE IF NOT EXISTS raw.chat_message_rows (
+            tenant_id       VARCHAR(50) NOT NULL,
             application_id  VARCHAR(100),
-            tenant_id       VARCHAR(50),
-            endpoint        VARCHAR(200),
-            loaded_at       TIMESTAMPTZ DEFAULT NOW(),
-            date_from       DATE,
-            date_to         DATE,
-            source_data     JSONB NOT NULL
+            message_id      VARCHAR(100) NOT NULL,
+            message_at      TIMESTAMPTZ,
+            send_type       VARCHAR(50),
+            content_type    VARCHAR(50),
+            status          VARCHAR(50),
+            profile_name    TEXT,
+            contact_id      VARCHAR(100),
+            conversation_id VARCHAR(100),
+            agent_id        VARCHAR(100),
+            close_reason    TEXT,
+            intent          TEXT,
+            is_fallback     BOOLEAN NOT NULL DEFAULT FALSE,
+            message_body    TEXT,
+            integration     VARCHAR(50),
+            channel         VARCHAR(50),
+            loaded_at       TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (tenant_id, message_id)
         )
     """,
-    "raw_contacts_api": """
-        CREATE TABLE IF NOT EXISTS raw.raw_contacts_api (
-            id              SERIAL PRIMARY KEY,
-            application_id  VARCHAR(100),
-            tenant_id       VARCHAR(50),
-            endpoint        VARCHAR(200),
-            loaded_at       TIMESTAMPTZ DEFAULT NOW(),
-            date_from       DATE,
-            date_to         DATE,
-            source_data     JSONB NOT NULL
+    "chat_conversation_rows": """
+        CREATE TABLE IF NOT EXISTS raw.chat_conversation_rows (
+            tenant_id               VARCHAR(50) NOT NULL,
+            application_id          VARCHAR(100),
+            session_id              VARCHAR(100) NOT NULL,
+            conversation_session_id VARCHAR(100),
+            contact_id              VARCHAR(100),
+            agent_id                VARCHAR(100),
+            agent_email             VARCHAR(255),
+            channel                 VARCHAR(50),
+            queued_at               TIMESTAMPTZ,
+            assigned_at             TIMESTAMPTZ,
+            closed_at               TIMESTAMPTZ,
+            initial_session_id      VARCHAR(100),
+            loaded_at               TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (tenant_id, session_id)
         )
     """,
 }
@@ -143,8 +187,167 @@ INDICES = [
     "CREATE INDEX IF NOT EXISTS idx_raw_inapp_stats_app ON raw.raw_inapp_stats (application_id)",
     "CREATE INDEX IF NOT EXISTS idx_raw_campaigns_api_app ON raw.raw_campaigns_api (application_id)",
     "CREATE INDEX IF NOT EXISTS idx_raw_contacts_api_app ON raw.raw_contacts_api (application_id)",
+    # loaded_at windows for the incremental transform_bridge watermarks
+    "CREATE INDEX IF NOT EXISTS idx_raw_chat_stats_endpoint_loaded ON raw.raw_chat_stats (endpoint, loaded_at)",
+    "CREATE INDEX IF NOT EXISTS idx_raw_chat_stats_loaded ON raw.raw_chat_stats (loaded_at)",
+    "CREATE INDEX IF NOT EXISTS idx_raw_push_stats_loaded ON raw.raw_push_stats (loaded_at)",
+    "CREATE INDEX IF NOT EXISTS idx_raw_sms_stats_loaded ON raw.raw_sms_stats (loaded_at)",
+    "CREATE INDEX IF NOT EXISTS idx_raw_email_stats_loaded ON raw.raw_email_stats (loaded_at)",
+    "CREATE INDEX IF NOT EXISTS idx_raw_inapp_stats_loaded ON raw.raw_inapp_stats (loaded_at)",
+    "CREATE INDEX IF NOT EXISTS idx_raw_campaigns_api_loaded ON raw.raw_campaigns_api (loaded_at)",
+    "CREATE INDEX IF NOT EXISTS idx_raw_contacts_api_loaded ON raw.raw_contacts_api (loaded_at)",
+    # landing rows: transform_bridge watermark windows
+    "CREATE INDEX IF NOT EXISTS idx_chat_message_rows_loaded ON raw.chat_message_rows (tenant_id, loaded_at)",
+    "CREATE INDEX IF NOT EXISTS idx_chat_conversation_rows_loaded ON raw.chat_conversation_rows (tenant_id, loaded_at)",
+    # backfill queue: claim order within a tenant
+    "CREATE INDEX IF NOT EXISTS idx_backfill_units_claim ON raw.backfill_units (tenant_id, status, window_from DESC)",
+]
+
+# payload_hash lets BaseExtractor._store_raw skip payloads already stored for
+# the same (application_id, endpoint): it looks them up on idx_<table>_payload
+# at insert time. A partitioned table cannot carry a unique index without
+# loaded_at, so the lookup is a plain index. Duplicates stored before the hash
+# existed are removed when it is added (the newest copy is kept, so "newest
+# page wins" transforms are unchanged). Tables created before partitioning are
+# converted by scripts/raw_maintenance.py --partition.
+ADD_PAGE_COLUMNS = """
+    ALTER TABLE raw.{table}
+        ADD COLUMN IF NOT EXISTS window_key VARCHAR(50),
+        ADD COLUMN IF NOT EXISTS page INTEGER
+"""
+
+ADD_PAYLOAD_HASH = """
+    ALTER TABLE raw.{table} ADD COLUMN IF NOT EXISTS payload_hash UUID
+        GENERATED ALWAYS AS (md5(source_data::text)::uuid) STORED
+"""
+
+DELETE_DUPLICATE_PAYLOADS = """
+    DELETE FROM raw.{table} r
+    USING raw.{table} newer
+    WHERE newer.application_id IS NOT DISTINCT FROM r.application_id
+      AND newer.endpoint IS NOT DISTINCT FROM r.endpoint
+      AND newer.payload_hash = r.payload_hash
+      AND (newer.loaded_at, newer.id) > (r.loaded_at, r.id)
+"""
+
+DEDUP_INDICES = [
+    "CREATE INDEX IF NOT EXISTS idx_{table}_payload ON raw.{table} (payload_hash)",
+    # "is there a newer page on this endpoint" check of the insert's dedup
+    "CREATE INDEX IF NOT EXISTS idx_{table}_app_endpoint_loaded ON raw.{table} "
+    "(application_id, endpoint, loaded_at)",
 ]
 
+# ---------------------------------------------------------------------------
+# Monthly partitions
+# ---------------------------------------------------------------------------
+
+IS_PARTITIONED_SQL = """
+SELECT c.relkind = 'p' FROM pg_class c
+WHERE c.oid = to_regclass(:table)
+"""
+
+DEFAULT_PARTITION_MONTHS_SQL = """
+SELECT DISTINCT date_trunc('month', loaded_at AT TIME ZONE 'UTC')::date
+FROM raw.{table}_default
+"""
+
+# Columns copied when rows change partition or table (payload_hash is generated)
+PAGE_COLUMNS = ("id, application_id, tenant_id, endpoint, loaded_at, "
+                "date_from, date_to, window_key, page, source_data")
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(month: date) -> date:
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def is_partitioned(conn, table: str) -> bool:
+    return bool(conn.execute(text(IS_PARTITIONED_SQL), {"table": f"raw.{table}"}).scalar())
+
+
+def ensure_partitions(conn, table: str, months: list[date]) -> list[str]:
+    """Create the monthly partitions of raw.<table> missing for months (UTC), and its DEFAULT.
+
+    Rows that landed in the DEFAULT partition for a month without its own
+    partition (the job did not run in time) are moved into the new partition.
+    Returns the partitions created.
+    """
+    if not is_partitioned(conn, table):
+        return []
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS raw.{table}_default PARTITION OF raw.{table} DEFAULT"))
+    stranded = set(conn.execute(text(DEFAULT_PARTITION_MONTHS_SQL.format(table=table))).scalars().all())
+    wanted = sorted(set(months) | stranded)
+    missing = [m for m in wanted
+               if conn.execute(text("SELECT to_regclass(:p)"),
+                               {"p": f"raw.{partition_name(table, m)}"}).scalar() is None]
+    if not missing:
+        return []
+
+    moving = [m for m in missing if m in stranded]
+    if moving:
+        conn.execute(text(f"ALTER TABLE raw.{table} DETACH PARTITION raw.{table}_default"))
+    for month in missing:
+        conn.execute(text(
+            f"CREATE TABLE raw.{partition_name(table, month)} PARTITION OF raw.{table} "
+            f"FOR VALUES FROM ('{month.isoformat()} 00:00+00') TO ('{next_month(month).isoformat()} 00:00+00')"
+        ))
+    if moving:
+        for month in moving:
+            window = {"lo": datetime.combine(month, time(), timezone.utc),
+                      "hi": datetime.combine(next_month(month), time(), timezone.utc)}
+            conn.execute(text(f"""
+                INSERT INTO raw.{table} ({PAGE_COLUMNS})
+                SELECT {PAGE_COLUMNS} FROM raw.{table}_default
+                WHERE loaded_at >= :lo AND loaded_at < :hi
+            """), window)
+            conn.execute(text(f"DELETE FROM raw.{table}_default WHERE loaded_at >= :lo AND loaded_at < :hi"),
+                         window)
+        conn.execute(text(f"ALTER TABLE raw.{table} ATTACH PARTITION raw.{table}_default DEFAULT"))
+    return [partition_name(table, m) for m in missing]
+
+
+def upcoming_months(today: date | None = None, ahead: int = PARTITION_MONTHS_AHEAD) -> list[date]:
+    """The current month (UTC) and the next `ahead` ones."""
+    month = month_start(today or datetime.now(timezone.utc).date())
+    months = [month]
+    for _ in range(ahead):
+        months.append(next_month(months[-1]))
+    return months
+
+
+def add_payload_dedup(conn):
+    """Add the page columns, payload_hash and the dedup indices to every PAGE_TABLES table (idempotent)."""
+    for table in PAGE_TABLES:
+        conn.execute(text(ADD_PAGE_COLUMNS.format(table=table)))
+        has_hash = conn.execute(text("""
+            SELECT EXISTS (SELECT 1 FROM information_schema.columns
+                           WHERE table_schema = 'raw' AND table_name = :table
+                             AND column_name = 'payload_hash')
+        """), {"table": table}).scalar()
+        if not has_hash:
+            conn.execute(text(ADD_PAYLOAD_HASH.format(table=table)))
+            removed = conn.execute(text(DELETE_DUPLICATE_PAYLOADS.format(table=table))).rowcount
+            print(f"  raw.{table}: payload_hash added, {removed} duplicate payload(s) removed")
+        for idx_sql in DEDUP_INDICES:
+            conn.execute(text(idx_sql.format(table=table)))
+
+
+def create_indices(conn, tables: list[str] | None = None) -> int:
+    """Run the INDICES / DEDUP_INDICES statements (only those of `tables` if given)."""
+    statements = [sql for sql in INDICES
+                  if tables is None or any(f"raw.{t} " in sql for t in tables)]
+    statements += [sql.format(table=t) for t in (tables or PAGE_TABLES) for sql in DEDUP_INDICES]
+    for sql in statements:
+        conn.execute(text(sql))
+    return len(statements)
+
 
 def main():
     print("=== Creating raw schema and tables ===\n")
@@ -159,10 +362,18 @@ def main():
             conn.execute(text(ddl))
             print(f"  Table raw.{table_name} created")
 
-        # Indices
-        for idx_sql in INDICES:
-            conn.execute(text(idx_sql))
-        print(f"\n  {len(INDICES)} indices created")
+        # Payload dedup columns, then indices
+        add_payload_dedup(conn)
+        print(f"\n  {create_indices(conn)} indices created")
+
+        # Monthly partitions (tables created before partitioning: see raw_maintenance.py)
+        for table in PAGE_TABLES:
+            created = ensure_partitions(conn, table, upcoming_months())
+            if created:
+                print(f"  raw.{table}: partitions {', '.join(created)} created")
+            elif not is_partitioned(conn, table):
+                print(f"  [WARN] raw.{table} is not partitioned — "
+                      f"run scripts/raw_maintenance.py --partition")
 
     print("\n=== Raw schema setup complete ===")
 
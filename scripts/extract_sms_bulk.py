@@ -3,20 +3,58 @@
 Writes directly to public.sms_envios (sendings) and public.sms_contacts (contacts).
 Target: 4M+ records.
 
+Pages are fetched by --workers threads at once (default 4), paced by one
+token bucket at API_REQUESTS_PER_SECOND (split between tenant processes; halved
+on every 429). The main thread is the single writer: it consumes pages in order
+and bulk-loads every FLUSH_ROWS rows — COPY into an UNLOGGED staging table, then
+one merge into the public table (scripts/bulk_loader.py). Throughput and ETA are
+printed every PROGRESS_SECONDS.
+
+Tenants come from --tenants (or every tenant in public.sync_state); each one
+is extracted in its own worker process, at most --max-workers at once, for the
+application ids EXTRACTION_TENANT_APPS maps it to in .env (JSON, e.g.
+{"coovimag": ["100301"]}). The default tenant falls back to APP_ID.
+
+Sendings are incremental: the max sent_at stored per application (sync_state
+entity sms_envios:<app>) is a high-watermark. The API lists newest sendings
+first, so paging stops at the first page that lies entirely before the
+watermark minus SMS_OVERLAP_HOURS (late arrivals). The watermark only moves
+after a run that reached that point or the end of the list; --full ignores it.
+
+Both lists are resumable: every flush commits, with its rows, the next page to
+fetch in raw.page_checkpoints. A run that crashed or stopped at --limit
+continues from there instead of page 1; the checkpoint is removed once the list
+(or the watermark) is reached. Rows are merged on their natural keys, so a page
+read twice (the list shifted under new sendings) changes nothing.
+
 Usage:
     python scripts/extract_sms_bulk.py                   # extract both
     python scripts/extract_sms_bulk.py --sendings-only   # only sendings
     python scripts/extract_sms_bulk.py --contacts-only   # only contacts
     python scripts/extract_sms_bulk.py --limit 4000000   # cap at 4M sendings
+    python scripts/extract_sms_bulk.py --tenants visionamos,coovimag --max-workers 2
+    python scripts/extract_sms_bulk.py --workers 8       # 8 concurrent page fetches
+    python scripts/extract_sms_bulk.py --sendings-only --full   # ignore the sent_at watermark
 """
 import sys
 import time
 import json
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
 
 import psycopg2
-import psycopg2.extras
 import requests
 from dotenv import dotenv_values
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from scripts.bulk_loader import (
+    copy_rows, create_staging_table, drop_staging_table, merge_staging,
+)
+from scripts.extractors.rate_limiter import TokenBucket
 
 # ── Config ──
 env = dotenv_values(".env")
@@ -26,14 +64,42 @@ DB_PASS = env.get("POSTGRES_PASSWORD", "")
 DB_HOST = env.get("DB_HOST", "localhost")
 TENANT_ID = "visionamos"
 APP_ID = "100274"
+TENANT_APPS = {TENANT_ID: [APP_ID], **json.loads(env.get("EXTRACTION_TENANT_APPS") or "{}")}
+FLUSH_ROWS = 10_000  # rows buffered before each COPY + merge
+PAGE_SIZE = 500
+PROGRESS_SECONDS = 10
+# Account-wide quota, same rule as the orchestrator: API_REQUESTS_PER_SECOND, else 1 / delay
+REQUESTS_PER_SECOND = (float(env.get("API_REQUESTS_PER_SECOND") or 0)
+                       or 1 / max(float(env.get("API_REQUEST_DELAY_SECONDS") or 0.5), 0.001))
+MIN_REQUESTS_PER_SECOND = float(env.get("API_MIN_REQUESTS_PER_SECOND") or 0.2)  # 429 slow-down floor
+SMS_OVERLAP_HOURS = float(env.get("EXTRACTION_SMS_OVERLAP_HOURS") or 6)  # re-read before the watermark
+
+SENDINGS_COLUMNS = [
+    "tenant_id", "sending_id", "application_id", "campaign_id",
+    "total_chunks", "sending_type", "is_flash", "sent_at",
+]
+CONTACTS_COLUMNS = [
+    "tenant_id", "contact_id", "phone", "country_code", "external_code",
+    "enabled", "created_at", "updated_at", "unsubscription_url",
+]
 
 # ── CLI args ──
 SENDINGS_ONLY = "--sendings-only" in sys.argv
 CONTACTS_ONLY = "--contacts-only" in sys.argv
-MAX_SENDINGS = 4_500_000  # default target
+FULL = "--full" in sys.argv
+MAX_SENDINGS = 4_500_000  # default target, per tenant application
+TENANTS = []  # empty = discover from sync_state
+MAX_WORKERS = 4
+WORKERS = 4  # concurrent page fetches per tenant
 for i, arg in enumerate(sys.argv):
     if arg == "--limit" and i + 1 < len(sys.argv):
         MAX_SENDINGS = int(sys.argv[i + 1])
+    if arg == "--tenants" and i + 1 < len(sys.argv):
+        TENANTS = [t.strip() for t in sys.argv[i + 1].split(",") if t.strip()]
+    if arg == "--max-workers" and i + 1 < len(sys.argv):
+        MAX_WORKERS = max(1, int(sys.argv[i + 1]))
+    if arg == "--workers" and i + 1 < len(sys.argv):
+        WORKERS = max(1, int(sys.argv[i + 1]))
 
 # ── API session ──
 session = requests.Session()
@@ -41,6 +107,9 @@ session.headers.update({
     "Authorization": f"ServerKey {SERVER_KEY}",
     "Accept": "application/json",
 })
+session.mount("https://", HTTPAdapter(pool_maxsize=WORKERS, pool_block=True))
+session.mount("http://", HTTPAdapter(pool_maxsize=WORKERS, pool_block=True))
+limiter = TokenBucket(REQUESTS_PER_SECOND, burst=WORKERS, min_rate=MIN_REQUESTS_PER_SECOND)
 
 
 def get_db():
@@ -94,254 +163,466 @@ def ensure_tables(conn):
         ON public.sms_contacts (tenant_id, phone)
     """)
 
+    cur.execute("CREATE SCHEMA IF NOT EXISTS raw")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS raw.page_checkpoints (
+            tenant_id       VARCHAR(50) NOT NULL,
+            application_id  VARCHAR(100) NOT NULL,
+            endpoint        VARCHAR(200) NOT NULL,
+            window_key      VARCHAR(50) NOT NULL DEFAULT '',
+            next_page       INTEGER NOT NULL,
+            updated_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (tenant_id, application_id, endpoint, window_key)
+        )
+    """)
+
     conn.commit()
     cur.close()
 
 
-def extract_sendings(conn):
-    """Extract SMS sendings from /v2/sms/send — paginated, batch upsert."""
-    cur = conn.cursor()
+def parse_ts(value):
+    """API timestamp (ISO 8601, 'Z' suffix) -> aware datetime, or None."""
+    if not value:
+        return None
+    try:
+        ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
 
-    # Get current count to resume
-    cur.execute("SELECT count(*) FROM public.sms_envios WHERE tenant_id = %s", (TENANT_ID,))
-    existing = cur.fetchone()[0]
-    print(f"\n{'='*60}")
-    print(f"  EXTRACCION SMS SENDINGS")
-    print(f"  Existentes en BD: {existing:,}")
-    print(f"  Objetivo: {MAX_SENDINGS:,}")
-    print(f"{'='*60}\n")
 
-    page_size = 500
-    page = 1
-    total_fetched = 0
-    api_total = None
-    start_time = time.time()
-    errors = 0
+def get_watermark(cur, tenant_id, app_id):
+    """Stored max sent_at for an application's sendings (None = never completed)."""
+    cur.execute(
+        "SELECT last_cursor FROM public.sync_state WHERE tenant_id = %s AND entity = %s",
+        (tenant_id, f"sms_envios:{app_id}"),
+    )
+    row = cur.fetchone()
+    return parse_ts(row[0]) if row else None
 
-    while True:
-        if total_fetched >= MAX_SENDINGS:
-            print(f"\n  Objetivo alcanzado: {total_fetched:,}")
-            break
 
+def save_watermark(cur, tenant_id, app_id, records):
+    """Advance the watermark to the max sent_at now stored for the application."""
+    cur.execute("""
+        INSERT INTO public.sync_state (tenant_id, entity, last_cursor, last_sync_at, records_synced, status)
+        SELECT %s, %s, max(sent_at)::text, now(), %s, 'success'
+        FROM public.sms_envios
+        WHERE tenant_id = %s AND application_id = %s
+        HAVING max(sent_at) IS NOT NULL
+        ON CONFLICT (tenant_id, entity) DO UPDATE SET
+            last_cursor    = EXCLUDED.last_cursor,
+            last_sync_at   = EXCLUDED.last_sync_at,
+            records_synced = EXCLUDED.records_synced,
+            status         = EXCLUDED.status
+    """, (tenant_id, f"sms_envios:{app_id}", records, tenant_id, app_id))
+
+
+# Page numbers depend on the page size; keep them apart from the extractors' checkpoints.
+CHECKPOINT_WINDOW = f"limit={PAGE_SIZE}"
+
+
+def get_checkpoint(cur, tenant_id, app_id, endpoint):
+    """Next page an interrupted run left for this list (None = start at page 1)."""
+    cur.execute("""
+        SELECT next_page FROM raw.page_checkpoints
+        WHERE tenant_id = %s AND application_id = %s AND endpoint = %s AND window_key = %s
+    """, (tenant_id, app_id, endpoint, CHECKPOINT_WINDOW))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def save_checkpoint(cur, checkpoint):
+    """Store (tenant_id, app_id, endpoint, next_page); next_page None drops it. Caller commits."""
+    tenant_id, app_id, endpoint, next_page = checkpoint
+    if next_page is None:
+        cur.execute("""
+            DELETE FROM raw.page_checkpoints
+            WHERE tenant_id = %s AND application_id = %s AND endpoint = %s AND window_key = %s
+        """, (tenant_id, app_id, endpoint, CHECKPOINT_WINDOW))
+        return
+    cur.execute("""
+        INSERT INTO raw.page_checkpoints (tenant_id, application_id, endpoint, window_key, next_page)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (tenant_id, application_id, endpoint, window_key) DO UPDATE SET
+            next_page  = EXCLUDED.next_page,
+            updated_at = now()
+    """, (tenant_id, app_id, endpoint, CHECKPOINT_WINDOW, next_page))
+
+
+def flush_sendings(conn, cur, staging, rows, checkpoint) -> int:
+    """COPY buffered sendings into staging and merge (existing sendings are kept).
+
+    The page checkpoint commits in the same transaction as the rows.
+    """
+    copy_rows(cur, staging, SENDINGS_COLUMNS, rows)
+    merged = merge_staging(cur, staging, "public.sms_envios", SENDINGS_COLUMNS,
+                           key_columns=["tenant_id", "sending_id"], update_columns=[])
+    save_checkpoint(cur, checkpoint)
+    conn.commit()
+    rows.clear()
+    return merged
+
+
+def flush_contacts(conn, cur, staging, rows, checkpoint) -> int:
+    """COPY buffered contacts into staging and merge (refreshes updated_at/enabled).
+
+    The page checkpoint commits in the same transaction as the rows.
+    """
+    copy_rows(cur, staging, CONTACTS_COLUMNS, rows)
+    merged = merge_staging(cur, staging, "public.sms_contacts", CONTACTS_COLUMNS,
+                           key_columns=["tenant_id", "contact_id"],
+                           update_columns=["updated_at", "enabled"])
+    save_checkpoint(cur, checkpoint)
+    conn.commit()
+    rows.clear()
+    return merged
+
+
+class Progress:
+    """Live throughput / ETA line, printed at most every PROGRESS_SECONDS."""
+
+    def __init__(self, label, target):
+        self.label = label
+        self.target = target
+        self.start = time.time()
+        self.last_print = 0.0
+        self.fetched = 0
+        self.pages = 0
+
+    def update(self, page, n, force=False):
+        self.fetched += n
+        self.pages += 1 if n else 0
+        now = time.time()
+        if not force and now - self.last_print < PROGRESS_SECONDS:
+            return
+        self.last_print = now
+        elapsed = now - self.start
+        rate = self.fetched / elapsed if elapsed > 0 else 0
+        target = self.target or 0
+        pct = (self.fetched / target * 100) if target else 0
+        eta_min = ((target - self.fetched) / rate / 60) if rate > 0 and target > self.fetched else 0
+        print(
+            f"  [{self.label}] Page {page:,} | {self.fetched:,}/{target:,} ({pct:.1f}%) | "
+            f"{rate:,.0f} rec/s | {self.pages / elapsed if elapsed > 0 else 0:.1f} pages/s | "
+            f"ETA: {eta_min:.0f}min",
+            flush=True,
+        )
+
+
+def fetch_page(endpoint, app_id, page):
+    """GET one page; retries errors and 429s through the shared limiter. Returns the JSON body."""
+    errors = 0
+    while True:
+        limiter.acquire()
         try:
             resp = session.get(
-                f"{API_BASE}/v2/sms/send",
-                params={"applicationId": APP_ID, "limit": page_size, "page": page},
+                f"{API_BASE}{endpoint}",
+                params={"applicationId": app_id, "limit": PAGE_SIZE, "page": page},
                 timeout=60,
             )
         except requests.RequestException as exc:
             errors += 1
-            print(f"  [ERROR] Page {page}: {exc}")
+            print(f"  [ERROR] {endpoint} page {page}: {exc}")
             if errors >= 10:
-                print("  10 errores, deteniendo.")
-                break
+                raise RuntimeError(f"{endpoint} page {page}: 10 errores") from exc
             time.sleep(2 ** min(errors, 5))
             continue
 
         if resp.status_code == 429:
-            print(f"  [RATE LIMITED] Page {page}, esperando 15s...")
-            time.sleep(15)
+            limiter.throttle(resp.headers.get("Retry-After"))
+            print(f"  [RATE LIMITED] {endpoint} page {page}, ritmo bajado a {limiter.rate:.1f} req/s")
             continue
 
         if not resp.ok:
             errors += 1
-            print(f"  [HTTP {resp.status_code}] Page {page}")
+            print(f"  [HTTP {resp.status_code}] {endpoint} page {page}")
             if errors >= 10:
-                break
+                raise RuntimeError(f"{endpoint} page {page}: HTTP {resp.status_code}")
             time.sleep(2)
             continue
 
-        errors = 0
+        limiter.recover()
         resp.encoding = "utf-8"
-        data = resp.json()
-
-        if api_total is None:
-            api_total = data.get("count", 0)
-            print(f"  API total: {api_total:,} sendings\n")
-
-        sendings = data.get("data", {}).get("sendings", [])
-        if not sendings:
-            print(f"\n  Fin: pagina {page} vacia")
-            break
-
-        # Batch upsert
-        rows = []
-        for s in sendings:
-            sid = s.get("id")
-            if not sid:
-                continue
-            rows.append((
-                TENANT_ID,
-                str(sid),
-                str(s.get("applicationId", APP_ID)),
-                str(s.get("campaignId", "")) if s.get("campaignId") else None,
-                s.get("estimatedChunks") or 1,
-                f"{s.get('type', '')}_{s.get('mode', '')}".strip("_") or None,
-                s.get("flash", False),
-                s.get("sentAt"),
-            ))
-
-        if rows:
-            insert_sql = """
-                INSERT INTO public.sms_envios (
-                    tenant_id, sending_id, application_id, campaign_id,
-                    total_chunks, sending_type, is_flash, sent_at
-                ) VALUES %s
-                ON CONFLICT (tenant_id, sending_id) DO NOTHING
-            """
-            psycopg2.extras.execute_values(cur, insert_sql, rows, page_size=500)
-            conn.commit()
-
-        total_fetched += len(sendings)
-        elapsed = time.time() - start_time
-        rate = total_fetched / elapsed if elapsed > 0 else 0
-        pct = (total_fetched / api_total * 100) if api_total else 0
-
-        if page % 50 == 0 or page <= 3:
-            eta_min = ((api_total - total_fetched) / rate / 60) if rate > 0 and api_total else 0
-            print(
-                f"  Page {page:,} | {total_fetched:,}/{min(api_total or 0, MAX_SENDINGS):,} "
-                f"({pct:.1f}%) | {rate:.0f} rec/s | ETA: {eta_min:.0f}min"
-            )
+        return resp.json()
+
+
+def fetch_pages(endpoint, app_id, items_key, first_page=1):
+    """Yield (page, body, items) in page order while WORKERS threads fetch ahead.
+
+    Page 1 is fetched first: its API total bounds the page range (one page past
+    it confirms the end; no total = unbounded). Up to 2 * WORKERS pages are in
+    flight after that. Stop early with closing() — in-flight pages are dropped.
+    """
+    body = fetch_page(endpoint, app_id, first_page)
+    yield first_page, body, body.get("data", {}).get(items_key, [])
+    total = body.get("count")
+    stop_page = first_page + max(1, -(-total // PAGE_SIZE) - first_page + 1) if total else None
+
+    pool = ThreadPoolExecutor(max_workers=WORKERS)
+    pending = {}
+    page = next_page = first_page + 1
+    try:
+        while stop_page is None or page <= stop_page:
+            while (stop_page is None or next_page <= stop_page) and len(pending) < 2 * WORKERS:
+                pending[next_page] = pool.submit(fetch_page, endpoint, app_id, next_page)
+                next_page += 1
+            body = pending.pop(page).result()
+            yield page, body, body.get("data", {}).get(items_key, [])
+            page += 1
+    finally:
+        for future in pending.values():
+            future.cancel()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def extract_sendings(conn, tenant_id, app_id):
+    """Extract SMS sendings from /v2/sms/send — pages fetched in parallel, COPY + merge every FLUSH_ROWS."""
+    cur = conn.cursor()
+    staging = create_staging_table(cur, "public.sms_envios", SENDINGS_COLUMNS)
+    conn.commit()
+    rows = []
 
-        page += 1
-        if len(sendings) < page_size:
-            print(f"\n  Fin: ultima pagina con {len(sendings)} rows")
-            break
-        time.sleep(0.2)
+    # Get current count to resume
+    cur.execute("SELECT count(*) FROM public.sms_envios WHERE tenant_id = %s", (tenant_id,))
+    existing = cur.fetchone()[0]
+    print(f"\n{'='*60}")
+    print(f"  EXTRACCION SMS SENDINGS — {tenant_id} (app {app_id})")
+    print(f"  Existentes en BD: {existing:,}")
+    print(f"  Objetivo: {MAX_SENDINGS:,} | {WORKERS} workers, {limiter.rate:.1f} req/s")
+    watermark = None if FULL else get_watermark(cur, tenant_id, app_id)
+    cutoff = watermark - timedelta(hours=SMS_OVERLAP_HOURS) if watermark else None
+    if cutoff:
+        print(f"  Incremental: sent_at >= {cutoff.isoformat()} (watermark {watermark.isoformat()})")
+    first_page = get_checkpoint(cur, tenant_id, app_id, "/v2/sms/send") or 1
+    if first_page > 1:
+        print(f"  Reanudando en pagina {first_page:,} (checkpoint)")
+    print(f"{'='*60}\n")
+
+    progress = None
+    complete = False  # reached the end of the list or the watermark
+    next_page = first_page  # every page before it is buffered in rows or merged
+
+    try:
+        with closing(fetch_pages("/v2/sms/send", app_id, "sendings", first_page)) as pages:
+            for page, data, sendings in pages:
+                if progress is None:
+                    api_total = data.get("count", 0)
+                    print(f"  API total: {api_total:,} sendings\n")
+                    progress = Progress(tenant_id, min(api_total, MAX_SENDINGS))
+
+                if not sendings:
+                    print(f"\n  Fin: pagina {page} vacia")
+                    complete = True
+                    break
+
+                sent = [ts for ts in (parse_ts(s.get("sentAt")) for s in sendings) if ts]
+                if cutoff and page == 1 and len(sent) > 1 and sent[0] < sent[-1]:
+                    print("  [WARN] La API no devuelve sendings por sentAt descendente — "
+                          "modo incremental desactivado para esta ejecucion")
+                    cutoff = None
+
+                for s in sendings:
+                    sid = s.get("id")
+                    if not sid:
+                        continue
+                    rows.append((
+                        tenant_id,
+                        str(sid),
+                        str(s.get("applicationId", app_id)),
+                        str(s.get("campaignId", "")) if s.get("campaignId") else None,
+                        s.get("estimatedChunks") or 1,
+                        f"{s.get('type', '')}_{s.get('mode', '')}".strip("_") or None,
+                        s.get("flash", False),
+                        s.get("sentAt"),
+                    ))
+
+                next_page = page + 1
+                if len(rows) >= FLUSH_ROWS:
+                    flush_sendings(conn, cur, staging, rows,
+                                   (tenant_id, app_id, "/v2/sms/send", next_page))
+
+                progress.update(page, len(sendings))
+                if cutoff and sent and len(sent) == len(sendings) and max(sent) < cutoff:
+                    print(f"\n  Fin: pagina {page} anterior al watermark")
+                    complete = True
+                    break
+                if progress.fetched >= MAX_SENDINGS:
+                    print(f"\n  Objetivo alcanzado: {progress.fetched:,}")
+                    break
+                if len(sendings) < PAGE_SIZE:
+                    print(f"\n  Fin: ultima pagina con {len(sendings)} rows")
+                    complete = True
+                    break
+    except RuntimeError as exc:
+        print(f"  [ERROR] {exc} — deteniendo")
+
+    checkpoint = (tenant_id, app_id, "/v2/sms/send", None if complete else next_page)
+    if rows:
+        flush_sendings(conn, cur, staging, rows, checkpoint)
+    else:
+        save_checkpoint(cur, checkpoint)
+    drop_staging_table(cur, staging)
+    if complete:
+        save_watermark(cur, tenant_id, app_id, progress.fetched)
+    conn.commit()
 
-    elapsed = time.time() - start_time
-    cur.execute("SELECT count(*) FROM public.sms_envios WHERE tenant_id = %s", (TENANT_ID,))
+    fetched = progress.fetched if progress else 0
+    if progress:
+        progress.update(page, 0, force=True)
+    elapsed = time.time() - (progress.start if progress else time.time())
+    cur.execute("SELECT count(*) FROM public.sms_envios WHERE tenant_id = %s", (tenant_id,))
     final_count = cur.fetchone()[0]
-    print(f"\n  Sendings: {total_fetched:,} fetched | {final_count:,} en BD | {elapsed/60:.1f}min")
+    print(f"\n  Sendings: {fetched:,} fetched | {final_count:,} en BD | {elapsed/60:.1f}min")
     cur.close()
-    return total_fetched
+    return fetched
 
 
-def extract_contacts(conn):
-    """Extract SMS contacts from /v2/sms/contact — paginated, batch upsert."""
+def extract_contacts(conn, tenant_id, app_id):
+    """Extract SMS contacts from /v2/sms/contact — pages fetched in parallel, COPY + merge every FLUSH_ROWS."""
     cur = conn.cursor()
+    staging = create_staging_table(cur, "public.sms_contacts", CONTACTS_COLUMNS)
+    conn.commit()
+    rows = []
 
-    cur.execute("SELECT count(*) FROM public.sms_contacts WHERE tenant_id = %s", (TENANT_ID,))
+    cur.execute("SELECT count(*) FROM public.sms_contacts WHERE tenant_id = %s", (tenant_id,))
     existing = cur.fetchone()[0]
     print(f"\n{'='*60}")
-    print(f"  EXTRACCION SMS CONTACTS")
-    print(f"  Existentes en BD: {existing:,}")
+    print(f"  EXTRACCION SMS CONTACTS — {tenant_id} (app {app_id})")
+    print(f"  Existentes en BD: {existing:,} | {WORKERS} workers, {limiter.rate:.1f} req/s")
+    first_page = get_checkpoint(cur, tenant_id, app_id, "/v2/sms/contact") or 1
+    if first_page > 1:
+        print(f"  Reanudando en pagina {first_page:,} (checkpoint)")
     print(f"{'='*60}\n")
 
-    page_size = 500
-    page = 1
-    total_fetched = 0
-    api_total = None
-    start_time = time.time()
-    errors = 0
-
-    while True:
-        try:
-            resp = session.get(
-                f"{API_BASE}/v2/sms/contact",
-                params={"applicationId": APP_ID, "limit": page_size, "page": page},
-                timeout=60,
-            )
-        except requests.RequestException as exc:
-            errors += 1
-            print(f"  [ERROR] Page {page}: {exc}")
-            if errors >= 10:
-                break
-            time.sleep(2 ** min(errors, 5))
-            continue
+    progress = None
+    complete = False
+    next_page = first_page
+
+    try:
+        with closing(fetch_pages("/v2/sms/contact", app_id, "contacts", first_page)) as pages:
+            for page, data, contacts in pages:
+                if progress is None:
+                    api_total = data.get("count", 0)
+                    print(f"  API total: {api_total:,} contacts\n")
+                    progress = Progress(tenant_id, api_total)
+
+                if not contacts:
+                    print(f"\n  Fin: pagina {page} vacia")
+                    complete = True
+                    break
+
+                for c in contacts:
+                    cid = c.get("id")
+                    if not cid:
+                        continue
+                    rows.append((
+                        tenant_id,
+                        str(cid),
+                        c.get("phone", ""),
+                        c.get("countryCode"),
+                        c.get("externalCode"),
+                        c.get("enabled", True),
+                        c.get("createdAt"),
+                        c.get("updatedAt"),
+                        c.get("unsubscriptionUrl"),
+                    ))
+
+                next_page = page + 1
+                if len(rows) >= FLUSH_ROWS:
+                    flush_contacts(conn, cur, staging, rows,
+                                   (tenant_id, app_id, "/v2/sms/contact", next_page))
+
+                progress.update(page, len(contacts))
+                if len(contacts) < PAGE_SIZE:
+                    complete = True
+                    break
+    except RuntimeError as exc:
+        print(f"  [ERROR] {exc} — deteniendo")
+
+    checkpoint = (tenant_id, app_id, "/v2/sms/contact", None if complete else next_page)
+    if rows:
+        flush_contacts(conn, cur, staging, rows, checkpoint)
+    else:
+        save_checkpoint(cur, checkpoint)
+    drop_staging_table(cur, staging)
+    conn.commit()
 
-        if resp.status_code == 429:
-            print(f"  [RATE LIMITED] Page {page}, esperando 15s...")
-            time.sleep(15)
-            continue
+    fetched = progress.fetched if progress else 0
+    if progress:
+        progress.update(page, 0, force=True)
+    elapsed = time.time() - (progress.start if progress else time.time())
+    cur.execute("SELECT count(*) FROM public.sms_contacts WHERE tenant_id = %s", (tenant_id,))
+    final = cur.fetchone()[0]
+    print(f"\n  Contacts: {fetched:,} fetched | {final:,} en BD | {elapsed/60:.1f}min")
+    cur.close()
+    return fetched
 
-        if not resp.ok:
-            errors += 1
-            if errors >= 10:
-                break
-            time.sleep(2)
-            continue
 
-        errors = 0
-        resp.encoding = "utf-8"
-        data = resp.json()
-
-        if api_total is None:
-            api_total = data.get("count", 0)
-            print(f"  API total: {api_total:,} contacts\n")
-
-        contacts = data.get("data", {}).get("contacts", [])
-        if not contacts:
-            print(f"\n  Fin: pagina {page} vacia")
-            break
-
-        rows = []
-        for c in contacts:
-            cid = c.get("id")
-            if not cid:
-                continue
-            rows.append((
-                TENANT_ID,
-                str(cid),
-                c.get("phone", ""),
-                c.get("countryCode"),
-                c.get("externalCode"),
-                c.get("enabled", True),
-                c.get("createdAt"),
-                c.get("updatedAt"),
-                c.get("unsubscriptionUrl"),
-            ))
-
-        if rows:
-            insert_sql = """
-                INSERT INTO public.sms_contacts (
-                    tenant_id, contact_id, phone, country_code, external_code,
-                    enabled, created_at, updated_at, unsubscription_url
-                ) VALUES %s
-                ON CONFLICT (tenant_id, contact_id) DO UPDATE SET
-                    updated_at = EXCLUDED.updated_at,
-                    enabled = EXCLUDED.enabled
-            """
-            psycopg2.extras.execute_values(cur, insert_sql, rows, page_size=500)
-            conn.commit()
-
-        total_fetched += len(contacts)
-        elapsed = time.time() - start_time
-        rate = total_fetched / elapsed if elapsed > 0 else 0
-
-        if page % 100 == 0 or page <= 3:
-            pct = (total_fetched / api_total * 100) if api_total else 0
-            print(f"  Page {page:,} | {total_fetched:,}/{api_total:,} ({pct:.1f}%) | {rate:.0f} rec/s")
-
-        page += 1
-        if len(contacts) < page_size:
-            break
-        time.sleep(0.2)
-
-    elapsed = time.time() - start_time
-    cur.execute("SELECT count(*) FROM public.sms_contacts WHERE tenant_id = %s", (TENANT_ID,))
-    final = cur.fetchone()[0]
-    print(f"\n  Contacts: {total_fetched:,} fetched | {final:,} en BD | {elapsed/60:.1f}min")
+def discover_tenants(conn):
+    """Tenants with sync_state rows or an EXTRACTION_TENANT_APPS entry."""
+    cur = conn.cursor()
+    cur.execute("SELECT DISTINCT tenant_id FROM public.sync_state")
+    tenants = {row[0] for row in cur.fetchall()}
     cur.close()
-    return total_fetched
+    return sorted(tenants | TENANT_APPS.keys())
+
+
+def extract_tenant(tenant_id, share=1):
+    """Extract every application of one tenant on its own DB connection.
+
+    share: tenant processes running at once — each paces its fetches at
+    1/share of the quota.
+    """
+    global limiter
+    if share > 1:
+        limiter = TokenBucket(REQUESTS_PER_SECOND / share, burst=WORKERS,
+                              min_rate=MIN_REQUESTS_PER_SECOND / share)
+    conn = get_db()
+    conn.autocommit = False
+    total = 0
+    try:
+        for app_id in TENANT_APPS[tenant_id]:
+            if not CONTACTS_ONLY:
+                total += extract_sendings(conn, tenant_id, app_id)
+            if not SENDINGS_ONLY:
+                total += extract_contacts(conn, tenant_id, app_id)
+    finally:
+        conn.close()
+    return total
 
 
 def main():
     conn = get_db()
     conn.autocommit = False
     ensure_tables(conn)
+    tenants = TENANTS or discover_tenants(conn)
+    conn.close()
 
-    total = 0
-    if not CONTACTS_ONLY:
-        total += extract_sendings(conn)
-    if not SENDINGS_ONLY:
-        total += extract_contacts(conn)
+    for tenant_id in [t for t in tenants if not TENANT_APPS.get(t)]:
+        print(f"  [WARN] No SMS applications for tenant {tenant_id} in EXTRACTION_TENANT_APPS — skipping")
+    tenants = [t for t in tenants if TENANT_APPS.get(t)]
+
+    totals = {}
+    workers = min(MAX_WORKERS, len(tenants))
+    if workers <= 1:
+        for tenant_id in tenants:
+            totals[tenant_id] = extract_tenant(tenant_id)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(extract_tenant, t, workers): t for t in tenants}
+            for future in as_completed(futures):
+                tenant_id = futures[future]
+                try:
+                    totals[tenant_id] = future.result()
+                except Exception as exc:
+                    print(f"  [ERROR] Tenant {tenant_id}: {exc}")
+                    totals[tenant_id] = 0
 
     print(f"\n{'='*60}")
-    print(f"  TOTAL EXTRAIDO: {total:,} registros")
+    for tenant_id in tenants:
+        print(f"  {tenant_id}: {totals[tenant_id]:,} registros")
+    print(f"  TOTAL EXTRAIDO: {sum(totals.values()):,} registros")
     print(f"{'='*60}")
-    conn.close()
 
 
 if __name__ == "__main__":
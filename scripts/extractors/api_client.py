@@ -1,12 +1,29 @@
 """HTTP client for the Indigitall API with ServerKey/JWT auth, retry, rate-limit, and logging."""
 
+import json
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
 import requests
-from sqlalchemy import text
+from requests.adapters import HTTPAdapter
 
 from scripts.extractors.config import extraction_settings as cfg
+from scripts.extractors.log_buffer import ExtractionLogBuffer, shared_log_buffer
+from scripts.extractors.rate_limiter import TokenBucket
+from scripts.extractors.response_cache import ResponseCache, cache_key
+
+
+def default_limiter(share: int = 1) -> TokenBucket:
+    """Token bucket sized from settings (API_REQUESTS_PER_SECOND, else 1 / API_REQUEST_DELAY_SECONDS).
+
+    share splits the quota between that many processes calling the API at once.
+    """
+    rate = cfg.API_REQUESTS_PER_SECOND or 1 / max(cfg.API_REQUEST_DELAY_SECONDS, 0.001)
+    share = max(1, share)
+    return TokenBucket(rate / share, burst=max(1, cfg.API_RATE_BURST // share),
+                       min_rate=cfg.API_MIN_REQUESTS_PER_SECOND / share)
 
 
 class IndigitallAPIClient:
@@ -15,14 +32,54 @@ class IndigitallAPIClient:
     Supports two auth modes (auto-detected from .env):
       1. ServerKey + AppToken  (server-to-server, preferred)
       2. Email/Password → JWT  (user-based, legacy)
+
+    Thread-safe: requests are paced by a shared token bucket (pass `limiter`
+    to share one across clients) instead of a fixed sleep — a 429 lowers its
+    rate and the retry waits in acquire() like any other call — and map_concurrent()
+    runs calls on up to API_MAX_CONCURRENCY threads over pooled keep-alive
+    connections. extraction_log rows are buffered and written in batches
+    (see log_buffer.py); call flush_log() before a worker process exits.
+
+    With a `cache` (response_cache.py), GETs made with cache=True — endpoints
+    more than one extractor requests with the same params — are sent once per
+    run; other GETs (paged listings, date windows) and POSTs bypass it.
     """
 
-    def __init__(self, engine):
+    def __init__(self, engine, tenant_id: str | None = None,
+                 limiter: TokenBucket | None = None,
+                 log_buffer: ExtractionLogBuffer | None = None,
+                 cache: ResponseCache | None = None):
         self.engine = engine
+        self.tenant_id = tenant_id
         self.base_url = cfg.INDIGITALL_API_BASE_URL.rstrip("/")
+        self.limiter = limiter or default_limiter()
+        self.log_buffer = log_buffer or shared_log_buffer(engine)
+        self.cache = cache
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=cfg.API_MAX_CONCURRENCY,
+                              pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
         self.auth_mode: str | None = None  # "server_key" or "jwt"
         self.token: str | None = None
+        self._auth_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Concurrency
+    # ------------------------------------------------------------------
+
+    def map_concurrent(self, fn, items) -> list:
+        """Run fn(item) for every item on up to API_MAX_CONCURRENCY threads.
+
+        Results come back in item order; the first exception is re-raised.
+        Every call still goes through the shared limiter.
+        """
+        items = list(items)
+        if cfg.API_MAX_CONCURRENCY <= 1 or len(items) <= 1:
+            return [fn(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(cfg.API_MAX_CONCURRENCY, len(items))) as pool:
+            return list(pool.map(fn, items))
 
     # ------------------------------------------------------------------
     # Authentication
@@ -82,23 +139,52 @@ class IndigitallAPIClient:
         self.session.headers["Authorization"] = f"Bearer {self.token}"
         print(f"  Auth mode: JWT (email: {cfg.INDIGITALL_EMAIL})")
 
-    def _re_authenticate(self):
-        """Re-authenticate on 401. Only applicable for JWT mode."""
+    def _re_authenticate(self, stale_token: str | None = None):
+        """Re-authenticate on 401. Only applicable for JWT mode.
+
+        Concurrent callers that hit 401 with the same expired token refresh it
+        once; the others just retry with the new one.
+        """
         if self.auth_mode == "jwt":
-            self._auth_jwt()
+            with self._auth_lock:
+                if self.token == stale_token:
+                    self._auth_jwt()
         # ServerKey doesn't need re-auth — 401 means bad credentials
 
     # ------------------------------------------------------------------
-    # HTTP GET with retry / rate-limit
+    # HTTP GET with retry / rate-limit, through the run's response cache
     # ------------------------------------------------------------------
 
     def get(self, endpoint: str, params: dict | None = None,
-            application_id: str | None = None) -> dict | list | None:
-        """GET with automatic retry on 401 (re-auth) and 429 (exponential backoff)."""
+            application_id: str | None = None, cache: bool = False) -> dict | list | None:
+        """GET a JSON endpoint (retries, pacing and caching as in _get_body)."""
+        body = self._get_body(endpoint, params, application_id, cache)
+        return json.loads(body) if body is not None else None
+
+    def get_text(self, endpoint: str, params: dict | None = None,
+                 application_id: str | None = None, cache: bool = False) -> str | None:
+        """GET that returns raw text (CSV) instead of parsed JSON."""
+        return self._get_body(endpoint, params, application_id, cache)
+
+    def _get_body(self, endpoint: str, params: dict | None,
+                  application_id: str | None, cache: bool) -> str | None:
+        """Body of a GET; with cache, an identical cached GET earlier in the run answers it."""
+        if not cache or self.cache is None:
+            return self._send_get(endpoint, params, application_id)
+        return self.cache.fetch(cache_key(endpoint, params),
+                                lambda: self._send_get(endpoint, params, application_id))
+
+    def _send_get(self, endpoint: str, params: dict | None,
+                  application_id: str | None) -> str | None:
+        """GET with automatic retry on 401 (re-auth) and 429 (paced by the limiter).
+
+        Returns the body text (None on a failed request).
+        """
         url = f"{self.base_url}{endpoint}"
 
         for attempt in range(1, cfg.API_MAX_RETRIES + 1):
-            time.sleep(cfg.API_REQUEST_DELAY_SECONDS)
+            self.limiter.acquire()
+            token = self.token
 
             start = time.time()
             try:
@@ -128,19 +214,20 @@ class IndigitallAPIClient:
                     error_message="Token expired — re-authenticating",
                     application_id=application_id,
                 )
-                self._re_authenticate()
+                self._re_authenticate(token)
                 continue
 
-            # 429 → exponential backoff
+            # 429 → the limiter halves the rate and holds every caller for
+            # Retry-After; the retry waits its turn in acquire() like any call
             if resp.status_code == 429:
                 self._log_call(
                     endpoint=endpoint,
                     http_status=429,
                     duration_ms=duration_ms,
-                    error_message="Rate limited — backing off",
+                    error_message="Rate limited — rate lowered",
                     application_id=application_id,
                 )
-                time.sleep(2 ** attempt)
+                self.limiter.throttle(resp.headers.get("Retry-After"))
                 continue
 
             # Log and return
@@ -156,65 +243,10 @@ class IndigitallAPIClient:
                 print(f"    [WARN] {endpoint} returned {resp.status_code}")
                 return None
 
-            # Force UTF-8 before JSON decoding to prevent double-encoding
-            resp.encoding = "utf-8"
-            return resp.json()
-
-        return None
-
-    # ------------------------------------------------------------------
-    # GET (raw text) — for CSV endpoints like chat/history/csv
-    # ------------------------------------------------------------------
+            self.limiter.recover()
 
-    def get_text(self, endpoint: str, params: dict | None = None,
-                 application_id: str | None = None) -> str | None:
-        """GET that returns raw text (CSV) instead of parsed JSON."""
-        url = f"{self.base_url}{endpoint}"
-
-        for attempt in range(1, cfg.API_MAX_RETRIES + 1):
-            time.sleep(cfg.API_REQUEST_DELAY_SECONDS)
-
-            start = time.time()
-            try:
-                resp = self.session.get(url, params=params, timeout=cfg.API_TIMEOUT_SECONDS)
-            except requests.RequestException as exc:
-                duration_ms = int((time.time() - start) * 1000)
-                self._log_call(
-                    endpoint=endpoint, http_status=0,
-                    duration_ms=duration_ms,
-                    error_message=str(exc)[:500],
-                    application_id=application_id,
-                )
-                if attempt == cfg.API_MAX_RETRIES:
-                    raise
-                time.sleep(2 ** attempt)
-                continue
-
-            duration_ms = int((time.time() - start) * 1000)
-
-            if resp.status_code == 429:
-                self._log_call(
-                    endpoint=endpoint, http_status=429,
-                    duration_ms=duration_ms,
-                    error_message="Rate limited — backing off",
-                    application_id=application_id,
-                )
-                time.sleep(2 ** attempt)
-                continue
-
-            self._log_call(
-                endpoint=endpoint, http_status=resp.status_code,
-                duration_ms=duration_ms,
-                error_message=None if resp.ok else resp.text[:500],
-                application_id=application_id,
-            )
-
-            if not resp.ok:
-                print(f"    [WARN] {endpoint} returned {resp.status_code}")
-                return None
-
-            # Force UTF-8 decoding — requests defaults to Latin-1 when
-            # the server omits charset, which double-encodes accented chars.
+            # Force UTF-8 decoding — requests defaults to Latin-1 when the
+            # server omits charset, which double-encodes accented chars.
             resp.encoding = "utf-8"
             return resp.text
 
@@ -231,7 +263,8 @@ class IndigitallAPIClient:
         url = f"{self.base_url}{endpoint}"
 
         for attempt in range(1, cfg.API_MAX_RETRIES + 1):
-            time.sleep(cfg.API_REQUEST_DELAY_SECONDS)
+            self.limiter.acquire()
+            token = self.token
 
             start = time.time()
             try:
@@ -261,17 +294,17 @@ class IndigitallAPIClient:
                     error_message="Token expired — re-authenticating",
                     application_id=application_id,
                 )
-                self._re_authenticate()
+                self._re_authenticate(token)
                 continue
 
             if resp.status_code == 429:
                 self._log_call(
                     endpoint=endpoint, http_status=429,
                     duration_ms=duration_ms,
-                    error_message="Rate limited — backing off",
+                    error_message="Rate limited — rate lowered",
                     application_id=application_id,
                 )
-                time.sleep(2 ** attempt)
+                self.limiter.throttle(resp.headers.get("Retry-After"))
                 continue
 
             self._log_call(
@@ -285,6 +318,8 @@ class IndigitallAPIClient:
                 print(f"    [WARN] {endpoint} returned {resp.status_code}")
                 return None
 
+            self.limiter.recover()
+
             resp.encoding = "utf-8"
             return resp.json()
 
@@ -297,27 +332,19 @@ class IndigitallAPIClient:
     def _log_call(self, endpoint: str, http_status: int, duration_ms: int,
                   error_message: str | None = None,
                   application_id: str | None = None):
-        """Insert a row into raw.extraction_log."""
-        now = datetime.now(timezone.utc)
-        try:
-            with self.engine.begin() as conn:
-                conn.execute(
-                    text("""
-                        INSERT INTO raw.extraction_log
-                            (application_id, endpoint, http_status, duration_ms,
-                             error_message, started_at, finished_at)
-                        VALUES
-                            (:app_id, :endpoint, :status, :dur, :err, :started, :finished)
-                    """),
-                    {
-                        "app_id": application_id,
-                        "endpoint": endpoint,
-                        "status": http_status,
-                        "dur": duration_ms,
-                        "err": error_message,
-                        "started": now,
-                        "finished": now,
-                    },
-                )
-        except Exception as exc:
-            print(f"    [WARN] Could not log API call: {exc}")
+        """Queue a raw.extraction_log row; the log buffer inserts them in batches."""
+        now = datetime.now(timezone.utc).isoformat()
+        self.log_buffer.append({
+            "application_id": application_id,
+            "tenant_id": self.tenant_id,
+            "endpoint": endpoint,
+            "http_status": http_status,
+            "duration_ms": duration_ms,
+            "error_message": error_message,
+            "started_at": now,
+            "finished_at": now,
+        })
+
+    def flush_log(self) -> int:
+        """Write buffered extraction_log rows now. Returns rows written."""
+        return self.log_buffer.flush()
@@ -0,0 +1,349 @@
+"""
+Backfill — extract a long history range as a queue of resumable work units.
+
+The range is planned once into raw.backfill_units: one row per (application,
+endpoint, window), each window no longer than the endpoint accepts (7 days for
+the chat history CSV, 99 for SMS stats). Re-planning the same range adds only
+the units that are missing, so a plan can be extended.
+
+Units are then claimed by --workers threads with FOR UPDATE SKIP LOCKED,
+newest window first, so several backfill processes can share one queue. A
+unit is 'pending', 'running', 'done' or 'failed'; failed units are retried up
+to --max-attempts times, and a 'running' unit whose worker died is claimed
+again once its lease (--lease-minutes) expires. An interrupted backfill is
+resumed by running the same command again. Progress and the projected
+completion time (from the units finished in this run) are printed every
+PROGRESS_SECONDS.
+
+Usage:
+    python -m scripts.extractors.backfill --tenant coovimag --since 2024-10-01
+    python -m scripts.extractors.backfill --tenant coovimag --since 2024-10-01 --plan-only
+    python -m scripts.extractors.backfill --tenant coovimag --status
+    python -m scripts.extractors.backfill --tenant coovimag --since 2024-10-01 \\
+        --endpoints chat_history,sms_app_stats --workers 8
+"""
+
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+from sqlalchemy import text
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+
+from app.models.database import engine
+from scripts.extractors.config import extraction_settings as cfg
+from scripts.extractors.api_client import IndigitallAPIClient
+from scripts.extractors.base_extractor import TENANT_ID
+from scripts.extractors.chat_extractor import ChatExtractor
+from scripts.extractors.discovery import discover_applications
+from scripts.extractors.push_extractor import PushExtractor
+from scripts.extractors.sms_extractor import MAX_STATS_WINDOW_DAYS, SMSExtractor
+
+PROGRESS_SECONDS = 30
+
+# Backfillable endpoints: extractor, window length, whether the window's dateTo
+# is the next window's dateFrom (chat CSV) or the day before it, and the call
+# that fetches and stores one window, returning the number of API rows — or, for
+# "paged" windows, (rows, whether the window was read to its last page).
+BACKFILL_ENDPOINTS = {
+    "chat_history": {
+        "extractor": ChatExtractor,
+        "days": ChatExtractor.HISTORY_MAX_DAYS,
+        "shared_edge": True,
+        "run": lambda ex, app_id, start, end: ex._extract_history_window(
+            app_id, start.isoformat(), end.isoformat()),
+        "paged": True,
+    },
+    "sms_campaign_stats": {
+        "extractor": SMSExtractor,
+        "days": MAX_STATS_WINDOW_DAYS,
+        "shared_edge": False,
+        "run": lambda ex, app_id, start, end: len(
+            ex._extract_stats_window(app_id, "/v2/sms/stats/campaign", start, end) or []),
+    },
+    "sms_app_stats": {
+        "extractor": SMSExtractor,
+        "days": MAX_STATS_WINDOW_DAYS,
+        "shared_edge": False,
+        "run": lambda ex, app_id, start, end: len(
+            ex._extract_stats_window(app_id, "/v2/sms/stats/application", start, end) or []),
+    },
+    "push_date_stats": {
+        "extractor": PushExtractor,
+        "days": cfg.EXTRACTION_DAYS_BACK,
+        "shared_edge": False,
+        "run": lambda ex, app_id, start, end: ex._extract_date_stats_window(
+            app_id, start.isoformat(), end.isoformat()),
+    },
+}
+
+PLAN_UNITS_SQL = """
+INSERT INTO raw.backfill_units (tenant_id, application_id, endpoint, window_from, window_to)
+SELECT :tid, u.application_id, u.endpoint, u.window_from, u.window_to
+FROM unnest(
+    CAST(:app_id AS varchar[]), CAST(:endpoint AS varchar[]),
+    CAST(:window_from AS date[]), CAST(:window_to AS date[])
+) AS u(application_id, endpoint, window_from, window_to)
+ON CONFLICT (tenant_id, application_id, endpoint, window_from, window_to) DO NOTHING
+"""
+
+# Pending units, failed ones with attempts left and running ones whose lease
+# expired (their worker died). SKIP LOCKED lets concurrent claimers pass each other.
+CLAIM_UNIT_SQL = """
+UPDATE raw.backfill_units u SET
+    status = 'running',
+    attempts = u.attempts + 1,
+    started_at = now(),
+    finished_at = NULL
+WHERE u.id = (
+    SELECT id FROM raw.backfill_units
+    WHERE tenant_id = :tid
+      AND endpoint = ANY(CAST(:endpoints AS varchar[]))
+      AND (status = 'pending'
+           OR (status = 'failed' AND attempts < :max_attempts)
+           OR (status = 'running' AND started_at < now() - make_interval(mins => :lease_minutes)))
+    ORDER BY window_from DESC, id
+    FOR UPDATE SKIP LOCKED
+    LIMIT 1
+)
+RETURNING u.id, u.application_id, u.endpoint, u.window_from, u.window_to
+"""
+
+FINISH_UNIT_SQL = """
+UPDATE raw.backfill_units SET
+    status = :status,
+    records = :records,
+    error = :error,
+    finished_at = now()
+WHERE id = :id
+"""
+
+STATUS_SQL = """
+SELECT endpoint,
+       count(*) AS units,
+       count(*) FILTER (WHERE status = 'done') AS done,
+       count(*) FILTER (WHERE status = 'running') AS running,
+       count(*) FILTER (WHERE status = 'failed') AS failed,
+       count(*) FILTER (WHERE status = 'failed' AND attempts >= :max_attempts) AS exhausted,
+       coalesce(sum(records), 0) AS records
+FROM raw.backfill_units
+WHERE tenant_id = :tid AND endpoint = ANY(CAST(:endpoints AS varchar[]))
+GROUP BY endpoint
+ORDER BY endpoint
+"""
+
+
+def plan_windows(since: date, until: date, days: int, shared_edge: bool) -> list[tuple[date, date]]:
+    """Split [since, until] into windows of at most `days` days."""
+    windows = []
+    start = since
+    while start < until:
+        if shared_edge:
+            end = min(start + timedelta(days=days), until)
+            windows.append((start, end))
+            start = end
+        else:
+            end = min(start + timedelta(days=days - 1), until)
+            windows.append((start, end))
+            start = end + timedelta(days=1)
+    return windows
+
+
+def plan_units(tenant_id: str, app_ids: list[str], endpoints: list[str],
+               since: date, until: date) -> int:
+    """Insert the units of the range that are not planned yet. Returns units added."""
+    units = [
+        (app_id, endpoint, start, end)
+        for endpoint in endpoints
+        for app_id in app_ids
+        for start, end in plan_windows(since, until, BACKFILL_ENDPOINTS[endpoint]["days"],
+                                       BACKFILL_ENDPOINTS[endpoint]["shared_edge"])
+    ]
+    if not units:
+        return 0
+    with engine.begin() as conn:
+        return conn.execute(text(PLAN_UNITS_SQL), {
+            "tid": tenant_id,
+            "app_id": [u[0] for u in units],
+            "endpoint": [u[1] for u in units],
+            "window_from": [u[2] for u in units],
+            "window_to": [u[3] for u in units],
+        }).rowcount
+
+
+def queue_status(tenant_id: str, endpoints: list[str], max_attempts: int) -> list:
+    with engine.connect() as conn:
+        return conn.execute(text(STATUS_SQL), {
+            "tid": tenant_id, "endpoints": endpoints, "max_attempts": max_attempts,
+        }).fetchall()
+
+
+def run_unit(client, tenant_id: str, app_id: str, endpoint: str, start: date, end: date) -> int:
+    """Fetch and store one unit. Returns API rows; raises if the window was not read completely."""
+    spec = BACKFILL_ENDPOINTS[endpoint]
+    extractor = spec["extractor"](client, engine, full_refresh=True, tenant_id=tenant_id)
+    # Raw rows record the unit's window as their date range
+    extractor.date_from, extractor.date_to = start, end
+    records = spec["run"](extractor, app_id, start, end)
+    extractor.flush_raw()
+
+    # Paged windows swallow page errors and keep their page checkpoint: retry the unit
+    if spec.get("paged"):
+        records, complete = records
+        if not complete:
+            raise RuntimeError(f"stopped after {records} rows, page checkpoint kept")
+    return records
+
+
+class Progress:
+    """Units finished by this run, for the throughput and projected completion."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.units = 0
+        self.records = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def add(self, records: int, failed: bool):
+        with self.lock:
+            self.units += 1
+            self.records += records
+            self.failed += failed
+
+
+def work(client, tenant_id: str, endpoints: list[str], args, progress: Progress, stop: threading.Event):
+    """Claim and run units until the queue has none left for this worker."""
+    params = {"tid": tenant_id, "endpoints": endpoints,
+              "max_attempts": args.max_attempts, "lease_minutes": args.lease_minutes}
+    while not stop.is_set():
+        with engine.begin() as conn:
+            unit = conn.execute(text(CLAIM_UNIT_SQL), params).fetchone()
+        if unit is None:
+            return
+        unit_id, app_id, endpoint, start, end = unit
+        try:
+            records = run_unit(client, tenant_id, app_id, endpoint, start, end)
+            status, error = "done", None
+        except Exception as exc:
+            records, status, error = 0, "failed", str(exc)[:500]
+            print(f"    [ERROR] {endpoint} {app_id} {start}..{end}: {exc}", flush=True)
+        with engine.begin() as conn:
+            conn.execute(text(FINISH_UNIT_SQL), {
+                "id": unit_id, "status": status, "records": records, "error": error,
+            })
+        progress.add(records, status == "failed")
+
+
+def print_progress(tenant_id: str, endpoints: list[str], args, progress: Progress):
+    rows = queue_status(tenant_id, endpoints, args.max_attempts)
+    total = sum(r.units for r in rows)
+    done = sum(r.done for r in rows)
+    remaining = total - done - sum(r.exhausted for r in rows)
+    elapsed = time.time() - progress.start
+    rate = progress.units / elapsed if elapsed > 0 else 0  # units/s in this run
+    line = (f"  [{tenant_id}] {done:,}/{total:,} units done ({done / max(total, 1):.1%}) | "
+            f"{progress.records:,} rows | {rate * 60:.1f} units/min")
+    if rate > 0 and remaining > 0:
+        eta = datetime.now(timezone.utc) + timedelta(seconds=remaining / rate)
+        line += f" | ETA {remaining / rate / 60:.0f}min ({eta:%Y-%m-%d %H:%M} UTC)"
+    print(line, flush=True)
+
+
+def tenant_app_ids(client, tenant_id: str) -> list[str]:
+    """EXTRACTION_TENANT_APPS entry, else the tenant's apps as the orchestrator assigns them."""
+    if tenant_id in cfg.EXTRACTION_TENANT_APPS:
+        return [str(a) for a in cfg.EXTRACTION_TENANT_APPS[tenant_id]]
+    from scripts.extractors.orchestrator import _app_id, tenant_apps
+
+    all_apps = discover_applications(client, engine)
+    return [_app_id(a) for a in tenant_apps(tenant_id, all_apps, [tenant_id])]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill a history range as resumable work units")
+    parser.add_argument("--tenant", default=TENANT_ID, help=f"Tenant id (default: {TENANT_ID})")
+    parser.add_argument("--since", type=date.fromisoformat,
+                        help="First day of the range (YYYY-MM-DD); required to plan")
+    parser.add_argument("--until", type=date.fromisoformat, default=date.today(),
+                        help="Last day of the range (default: today)")
+    parser.add_argument("--endpoints", default=",".join(BACKFILL_ENDPOINTS),
+                        help=f"Comma-separated subset of: {', '.join(BACKFILL_ENDPOINTS)}")
+    parser.add_argument("--apps", default="",
+                        help="Comma-separated application ids (default: the tenant's apps)")
+    parser.add_argument("--workers", type=int, default=cfg.EXTRACTION_CONCURRENCY,
+                        help=f"Units run at once (default: {cfg.EXTRACTION_CONCURRENCY})")
+    parser.add_argument("--max-attempts", type=int, default=3,
+                        help="Failed units are retried until they reach this many attempts (default: 3)")
+    parser.add_argument("--lease-minutes", type=int, default=30,
+                        help="A running unit not finished after this long is claimed again (default: 30)")
+    parser.add_argument("--plan-only", action="store_true", help="Plan the units, do not run them")
+    parser.add_argument("--status", action="store_true", help="Print the queue status and exit")
+    args = parser.parse_args()
+
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = [e for e in endpoints if e not in BACKFILL_ENDPOINTS]
+    if unknown:
+        parser.error(f"unknown endpoint(s): {', '.join(unknown)}")
+    tenant_id = args.tenant
+
+    print("=" * 60)
+    print(f"  Backfill — {tenant_id}: {', '.join(endpoints)}")
+    print("=" * 60)
+
+    if not args.status:
+        client = IndigitallAPIClient(engine, tenant_id=tenant_id)
+        client.authenticate()
+
+        if args.since:
+            app_ids = ([a.strip() for a in args.apps.split(",") if a.strip()]
+                       or tenant_app_ids(client, tenant_id))
+            if not app_ids:
+                print(f"  [FATAL] No applications for tenant {tenant_id}")
+                return 1
+            added = plan_units(tenant_id, app_ids, endpoints, args.since, args.until)
+            print(f"  Planned {args.since}..{args.until} for app(s) {', '.join(app_ids)}: "
+                  f"{added:,} new unit(s)")
+
+        if not args.plan_only:
+            progress = Progress()
+            stop = threading.Event()
+            print(f"  Running with {args.workers} worker(s)...\n", flush=True)
+            pool = ThreadPoolExecutor(max_workers=max(1, args.workers))
+            futures = [pool.submit(work, client, tenant_id, endpoints, args, progress, stop)
+                       for _ in range(max(1, args.workers))]
+            try:
+                pending = futures
+                while pending:
+                    finished, pending = wait(pending, timeout=PROGRESS_SECONDS,
+                                             return_when=FIRST_EXCEPTION)
+                    for future in finished:
+                        future.result()  # a database error stops the run; the units stay claimable
+                    print_progress(tenant_id, endpoints, args, progress)
+            finally:
+                stop.set()
+                pool.shutdown(wait=True)
+                client.flush_log()
+            print(f"\n  This run: {progress.units:,} unit(s), {progress.failed:,} failed, "
+                  f"{progress.records:,} rows in {(time.time() - progress.start) / 60:.1f}min")
+
+    rows = queue_status(tenant_id, endpoints, args.max_attempts)
+    print(f"\n{'=' * 60}")
+    print("  Backfill Queue")
+    print(f"{'=' * 60}")
+    for r in rows:
+        print(f"    {r.endpoint:<20s} {r.done:>6,d}/{r.units:<6,d} done  {r.running:>4,d} running  "
+              f"{r.failed:>4,d} failed ({r.exhausted} exhausted)  {r.records:>10,d} rows")
+    if not rows:
+        print("    (no units planned — pass --since)")
+    print(f"{'=' * 60}")
+    return 0 if all(r.exhausted == 0 for r in rows) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,8 @@
 """Base extractor — common logic for all channel extractors."""
 
+import hashlib
 import json
+import threading
 from abc import ABC, abstractmethod
 from datetime import date, timedelta
 
@@ -9,8 +11,148 @@ from sqlalchemy import text
 from scripts.extractors.config import extraction_settings as cfg
 from scripts.extractors.api_client import IndigitallAPIClient
 
+# Default tenant — raw rows stored before extraction was tenant-aware have a
+# NULL tenant_id and belong to it.
 TENANT_ID = "visionamos"
 
+# One statement per batch: each column travels as an array and unnest() zips
+# them back into rows. A payload already stored for the same (tenant_id,
+# application_id, endpoint) — same payload_hash, generated from source_data and
+# looked up on idx_<table>_payload — is skipped. The exception is a payload that
+# reappears after a newer one on the same page of the endpoint (same window_key
+# and page: a setting changed and then changed back): its row gets a fresh
+# loaded_at (moving it to the current month's partition) so the transforms'
+# "newest page wins" still picks it. Returns the rows inserted and the payloads
+# re-stamped. The raw tables are partitioned by loaded_at, which rules out a
+# unique index on the hash and so ON CONFLICT; two flushes racing on the same
+# payload can both insert it, and raw_maintenance.py --compact removes such copies.
+INSERT_RAW_SQL = """
+WITH batch AS (
+    SELECT DISTINCT ON (application_id, endpoint, payload_hash) *
+    FROM (
+        SELECT b.*, md5(b.source_data::text)::uuid AS payload_hash
+        FROM unnest(
+            CAST(:app_id AS varchar[]), CAST(:tenant AS varchar[]), CAST(:endpoint AS varchar[]),
+            CAST(:dfrom AS date[]), CAST(:dto AS date[]), CAST(:window_key AS varchar[]),
+            CAST(:page AS int[]), CAST(:data AS jsonb[])
+        ) AS b(application_id, tenant_id, endpoint, date_from, date_to, window_key, page, source_data)
+    ) b
+),
+stored AS (
+    SELECT t.id, t.loaded_at, t.application_id, t.tenant_id, t.endpoint, t.payload_hash,
+           b.date_from, b.date_to, b.window_key, b.page
+    FROM batch b
+    JOIN {table} t
+      ON t.payload_hash = b.payload_hash
+     AND t.endpoint = b.endpoint
+     AND t.application_id IS NOT DISTINCT FROM b.application_id
+     AND t.tenant_id IS NOT DISTINCT FROM b.tenant_id
+),
+refreshed AS (
+    UPDATE {table} t SET
+        loaded_at = now(),
+        date_from = s.date_from,
+        date_to = s.date_to,
+        window_key = s.window_key,
+        page = s.page
+    FROM stored s
+    WHERE t.id = s.id AND t.loaded_at = s.loaded_at
+      AND EXISTS (
+          SELECT 1 FROM {table} n
+          WHERE n.application_id = s.application_id
+            AND n.endpoint = s.endpoint
+            AND n.tenant_id IS NOT DISTINCT FROM s.tenant_id
+            AND n.window_key IS NOT DISTINCT FROM s.window_key
+            AND n.page IS NOT DISTINCT FROM s.page
+            AND n.loaded_at > s.loaded_at
+      )
+    RETURNING t.application_id, t.endpoint, t.payload_hash
+),
+inserted AS (
+    INSERT INTO {table}
+        (application_id, tenant_id, endpoint, date_from, date_to, window_key, page, source_data)
+    SELECT application_id, tenant_id, endpoint, date_from, date_to, window_key, page, source_data
+    FROM batch b
+    WHERE NOT EXISTS (
+        SELECT 1 FROM stored s
+        WHERE s.payload_hash = b.payload_hash
+          AND s.endpoint = b.endpoint
+          AND s.application_id IS NOT DISTINCT FROM b.application_id
+    )
+    RETURNING 1
+)
+SELECT (SELECT count(*) FROM inserted) AS inserted,
+       (SELECT count(DISTINCT (application_id, endpoint, payload_hash)) FROM refreshed) AS refreshed
+"""
+
+# raw.campaign_state: one row per campaign and channel. last_changed_at moves
+# only when the campaign's list entry or its stats payload hash changes.
+CAMPAIGN_STATES_SQL = """
+SELECT campaign_id, campaign_hash, stats_hash,
+       last_changed_at < now() - make_interval(days => :settled_days) AS settled
+FROM raw.campaign_state
+WHERE tenant_id = :tid AND application_id = :app_id AND channel = :channel
+"""
+
+SAVE_CAMPAIGN_STATES_SQL = """
+INSERT INTO raw.campaign_state AS s
+    (tenant_id, application_id, channel, campaign_id, status,
+     campaign_hash, stats_hash, last_changed_at, last_checked_at)
+SELECT :tid, :app_id, :channel, c.campaign_id, c.status,
+       c.campaign_hash, c.stats_hash, now(), now()
+FROM unnest(
+    CAST(:campaign_id AS varchar[]), CAST(:status AS varchar[]),
+    CAST(:campaign_hash AS varchar[]), CAST(:stats_hash AS varchar[])
+) AS c(campaign_id, status, campaign_hash, stats_hash)
+ON CONFLICT (tenant_id, application_id, channel, campaign_id) DO UPDATE SET
+    status = EXCLUDED.status,
+    campaign_hash = EXCLUDED.campaign_hash,
+    stats_hash = EXCLUDED.stats_hash,
+    last_changed_at = CASE
+        WHEN (s.campaign_hash, s.stats_hash) IS DISTINCT FROM (EXCLUDED.campaign_hash, EXCLUDED.stats_hash)
+        THEN now() ELSE s.last_changed_at END,
+    last_checked_at = now()
+"""
+
+# raw.page_checkpoints: the next page to fetch of an unfinished paged listing.
+# Written in the same transaction as the raw rows of the pages before it, so it
+# is kept per raw table ("<RAW_TABLE>:<endpoint>"): two extractors paging the
+# same endpoint into different tables each resume from their own position.
+SAVE_CHECKPOINTS_SQL = """
+INSERT INTO raw.page_checkpoints AS p
+    (tenant_id, application_id, endpoint, window_key, next_page, updated_at)
+SELECT :tid, c.application_id, c.endpoint, c.window_key, c.next_page, now()
+FROM unnest(
+    CAST(:app_id AS varchar[]), CAST(:endpoint AS varchar[]),
+    CAST(:window_key AS varchar[]), CAST(:next_page AS int[])
+) AS c(application_id, endpoint, window_key, next_page)
+ON CONFLICT (tenant_id, application_id, endpoint, window_key) DO UPDATE SET
+    next_page = EXCLUDED.next_page,
+    updated_at = now()
+"""
+
+DELETE_CHECKPOINTS_SQL = """
+DELETE FROM raw.page_checkpoints p
+USING unnest(
+    CAST(:app_id AS varchar[]), CAST(:endpoint AS varchar[]), CAST(:window_key AS varchar[])
+) AS c(application_id, endpoint, window_key)
+WHERE p.tenant_id = :tid
+  AND p.application_id = c.application_id
+  AND p.endpoint = c.endpoint
+  AND p.window_key = c.window_key
+"""
+
+CHECKPOINT_SQL = """
+SELECT next_page FROM raw.page_checkpoints
+WHERE tenant_id = :tid AND application_id = :app_id
+  AND endpoint = :endpoint AND window_key = :window_key
+"""
+
+
+def payload_hash(data) -> str:
+    """Stable hash of a JSON-serialisable value (key order does not matter)."""
+    return hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
 
 class BaseExtractor(ABC):
     """Abstract base class for channel-specific extractors."""
@@ -19,29 +161,56 @@ class BaseExtractor(ABC):
     RAW_TABLE: str = "raw.raw_applications"  # override in subclass
 
     def __init__(self, client: IndigitallAPIClient, engine,
-                 full_refresh: bool = False):
+                 full_refresh: bool = False, tenant_id: str = TENANT_ID,
+                 refresh_campaigns: bool = False):
         self.client = client
         self.engine = engine
         self.full_refresh = full_refresh
+        self.refresh_campaigns = refresh_campaigns or full_refresh
+        self.tenant_id = tenant_id
         self.date_to = date.today()
         self.date_from = self.date_to - timedelta(days=cfg.EXTRACTION_DAYS_BACK)
         self.records_stored = 0
+        self.records_deduped = 0
+        self.records_refreshed = 0
+        self.failures: list[tuple[str, str]] = []
+        self._count_lock = threading.Lock()  # _store_raw may run on client worker threads
+        self._raw_rows: list[dict] = []
+        self._raw_bytes = 0
+        self._checkpoints: dict[tuple[str, str, str], int | None] = {}
+        self._landing: dict[tuple[str, str, str], list[dict]] = {}
+        self._landing_pages = 0
+        self._raw_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
 
     # ------------------------------------------------------------------
     # Public
     # ------------------------------------------------------------------
 
     def extract(self, applications: list[dict]) -> int:
-        """Run extraction for all given applications. Returns total records stored."""
+        """Run extraction for all given applications. Returns total records stored.
+
+        Apps that raise are recorded in self.failures as (app_id, error).
+        """
         self.records_stored = 0
+        self.records_deduped = 0
+        self.records_refreshed = 0
+        self.failures = []
         for app in applications:
             app_id = app.get("id") or app.get("appKey") or app.get("applicationId", "unknown")
             app_name = app.get("name", "unknown")
             print(f"  [{self.CHANNEL_NAME}] App {app_name} ({app_id})")
             try:
                 self._extract_for_app(str(app_id), app)
+                self.flush_raw()
             except Exception as exc:
                 print(f"    [ERROR] {self.CHANNEL_NAME} failed for {app_id}: {exc}")
+                self.failures.append((str(app_id), str(exc)))
+        try:
+            self.flush_raw()  # pages an app stored before it failed
+        except Exception as exc:
+            print(f"    [ERROR] {self.CHANNEL_NAME} could not store raw pages: {exc}")
+            self.failures.append(("raw", str(exc)))
         return self.records_stored
 
     # ------------------------------------------------------------------
@@ -54,32 +223,162 @@ class BaseExtractor(ABC):
         ...
 
     # ------------------------------------------------------------------
-    # Storage helper
+    # Storage helper (write-behind)
     # ------------------------------------------------------------------
 
     def _store_raw(self, app_id: str, endpoint: str, data,
-                   tenant_id: str | None = None):
-        """Insert one JSONB row into the channel's raw table."""
+                   tenant_id: str | None = None, checkpoint: tuple[str, int] | None = None,
+                   page: tuple[str, int] | None = None):
+        """Queue one JSONB row for the channel's raw table (tenant_id defaults to self.tenant_id).
+
+        Rows are written in batches by flush_raw(): when EXTRACTION_RAW_BATCH_PAGES
+        rows or EXTRACTION_RAW_BATCH_BYTES of payload are pending, before any
+        cursor update and at the end of every app. A paged listing passes
+        checkpoint=(window, next_page) to save its position along with the row,
+        and page=(window, page) when a newer copy of the same page supersedes
+        this one (raw_maintenance.py --compact then keeps only the newest).
+        """
         if data is None:
             return
-        with self.engine.begin() as conn:
-            conn.execute(
-                text(f"""
-                    INSERT INTO {self.RAW_TABLE}
-                        (application_id, tenant_id, endpoint, date_from, date_to, source_data)
-                    VALUES
-                        (:app_id, :tenant, :endpoint, :dfrom, :dto, :data)
-                """),
-                {
-                    "app_id": app_id,
-                    "tenant": tenant_id,
-                    "endpoint": endpoint,
-                    "dfrom": self.date_from,
-                    "dto": self.date_to,
-                    "data": json.dumps(data) if not isinstance(data, str) else data,
-                },
-            )
-        self.records_stored += 1
+        payload = json.dumps(data) if not isinstance(data, str) else data
+        with self._raw_lock:
+            self._raw_rows.append({
+                "app_id": app_id,
+                "tenant": tenant_id or self.tenant_id,
+                "endpoint": endpoint,
+                "dfrom": self.date_from,
+                "dto": self.date_to,
+                "window_key": page[0] if page else None,
+                "page": page[1] if page else None,
+                "data": payload,
+            })
+            self._raw_bytes += len(payload)
+            if checkpoint is not None:
+                self._checkpoints[(app_id, endpoint, checkpoint[0])] = checkpoint[1]
+            due = self._flush_due()
+        if due:
+            self.flush_raw()
+
+    def _store_rows(self, app_id: str, upsert_sql: str, rows: list[dict],
+                    checkpoint: tuple[str, str, int] | None = None):
+        """Queue records of one page for a typed landing table, written by flush_raw().
+
+        upsert_sql takes :tenant, :app_id and :rows (a JSON array of the
+        records) and upserts by id. A paged listing passes
+        checkpoint=(endpoint, window, next_page) here when this is the last
+        thing it queues for the page. Counts as one page towards the batch size.
+        """
+        with self._raw_lock:
+            if rows:
+                self._landing.setdefault((upsert_sql, app_id, self.tenant_id), []).extend(rows)
+                self._landing_pages += 1
+            if checkpoint is not None:
+                self._checkpoints[(app_id, checkpoint[0], checkpoint[1])] = checkpoint[2]
+            due = self._flush_due()
+        if due:
+            self.flush_raw()
+
+    def _flush_due(self) -> bool:
+        """Caller holds self._raw_lock."""
+        return (len(self._raw_rows) + self._landing_pages >= cfg.EXTRACTION_RAW_BATCH_PAGES
+                or self._raw_bytes >= cfg.EXTRACTION_RAW_BATCH_BYTES)
+
+    def flush_raw(self) -> int:
+        """Insert every queued raw row in one transaction. Returns rows written.
+
+        Payloads already stored are not written again; they are counted in
+        self.records_deduped instead of self.records_stored, or in
+        self.records_refreshed when their row was re-stamped (see INSERT_RAW_SQL). Queued landing
+        rows and page checkpoints are saved in the same transaction.
+
+        Holds the flush lock through the commit, so a caller returning from
+        flush_raw() knows every row queued before the call is durable — even
+        those another thread was already flushing. On error the rows stay
+        queued and the exception propagates (no cursor advances past them).
+        """
+        with self._flush_lock:
+            with self._raw_lock:
+                rows, self._raw_rows, self._raw_bytes = self._raw_rows, [], 0
+                checkpoints, self._checkpoints = self._checkpoints, {}
+                landing, self._landing = self._landing, {}
+                landing_pages, self._landing_pages = self._landing_pages, 0
+            if not rows and not checkpoints and not landing:
+                return 0
+            written = refreshed = 0
+            try:
+                with self.engine.begin() as conn:
+                    if rows:
+                        written, refreshed = conn.execute(
+                            text(INSERT_RAW_SQL.format(table=self.RAW_TABLE)),
+                            {key: [row[key] for row in rows] for key in rows[0]},
+                        ).one()
+                    for (upsert_sql, app_id, tenant), records in landing.items():
+                        conn.execute(text(upsert_sql), {
+                            "tenant": tenant, "app_id": app_id, "rows": json.dumps(records),
+                        })
+                    self._write_checkpoints(conn, checkpoints)
+            except Exception:
+                with self._raw_lock:
+                    self._raw_rows = rows + self._raw_rows
+                    self._raw_bytes += sum(len(row["data"]) for row in rows)
+                    self._checkpoints = {**checkpoints, **self._checkpoints}
+                    for key, records in landing.items():
+                        self._landing[key] = records + self._landing.get(key, [])
+                    self._landing_pages += landing_pages
+                raise
+        with self._count_lock:
+            self.records_stored += written
+            self.records_refreshed += refreshed
+            self.records_deduped += len(rows) - written - refreshed
+        return written
+
+    def _write_checkpoints(self, conn, checkpoints: dict):
+        saved = [(key, page) for key, page in checkpoints.items() if page is not None]
+        done = [key for key, page in checkpoints.items() if page is None]
+        if saved:
+            conn.execute(text(SAVE_CHECKPOINTS_SQL), {
+                "tid": self.tenant_id,
+                "app_id": [key[0] for key, _ in saved],
+                "endpoint": [self._checkpoint_endpoint(key[1]) for key, _ in saved],
+                "window_key": [key[2] for key, _ in saved],
+                "next_page": [page for _, page in saved],
+            })
+        if done:
+            conn.execute(text(DELETE_CHECKPOINTS_SQL), {
+                "tid": self.tenant_id,
+                "app_id": [key[0] for key in done],
+                "endpoint": [self._checkpoint_endpoint(key[1]) for key in done],
+                "window_key": [key[2] for key in done],
+            })
+
+    # ------------------------------------------------------------------
+    # Page checkpoints (resumable pagination)
+    # ------------------------------------------------------------------
+
+    def _checkpoint_endpoint(self, endpoint: str) -> str:
+        return f"{self.RAW_TABLE}:{endpoint}"
+
+    def _resume_page(self, app_id: str, endpoint: str, window: str = "",
+                     first_page: int = 0) -> int:
+        """Page to start a paged listing at: where an interrupted run stopped, else first_page.
+
+        Pages before the checkpoint were committed by that run; re-reading one
+        (the list shifted) is harmless, raw payloads are deduplicated.
+        """
+        with self.engine.connect() as conn:
+            row = conn.execute(text(CHECKPOINT_SQL), {
+                "tid": self.tenant_id, "app_id": app_id,
+                "endpoint": self._checkpoint_endpoint(endpoint), "window_key": window,
+            }).fetchone()
+        if row and row[0] > first_page:
+            print(f"    {endpoint}{' ' + window if window else ''}: resuming at page {row[0]}")
+            return row[0]
+        return first_page
+
+    def _finish_pages(self, app_id: str, endpoint: str, window: str = ""):
+        """The listing was read to its end: drop its checkpoint with the next flush."""
+        with self._raw_lock:
+            self._checkpoints[(app_id, endpoint, window)] = None
 
     # ------------------------------------------------------------------
     # Cursor helpers (incremental extraction)
@@ -95,12 +394,17 @@ class BaseExtractor(ABC):
                     SELECT last_cursor FROM public.sync_state
                     WHERE tenant_id = :tid AND entity = :entity
                 """),
-                {"tid": TENANT_ID, "entity": entity},
+                {"tid": self.tenant_id, "entity": entity},
             ).fetchone()
             return row[0] if row else None
 
     def _update_cursor(self, entity: str, cursor_value: str):
-        """Write last_cursor to sync_state for the given entity."""
+        """Write last_cursor to sync_state for the given entity.
+
+        Queued raw rows are flushed first: a cursor never moves past a page
+        that is not stored yet.
+        """
+        self.flush_raw()
         with self.engine.begin() as conn:
             conn.execute(
                 text("""
@@ -109,9 +413,69 @@ class BaseExtractor(ABC):
                     ON CONFLICT (tenant_id, entity) DO UPDATE SET
                         last_cursor = EXCLUDED.last_cursor
                 """),
-                {"tid": TENANT_ID, "entity": entity, "cursor": cursor_value},
+                {"tid": self.tenant_id, "entity": entity, "cursor": cursor_value},
             )
 
+    def _settled_from(self, entity: str) -> date:
+        """Start date for an incremental request of a date-ranged endpoint.
+
+        The cursor holds the dateTo of the last successful request, so starting
+        EXTRACTION_SETTLEMENT_DAYS before it covers any gap since then plus the
+        recent days the API may still revise. No cursor (or --full-refresh):
+        the whole extraction range. Advance with _update_cursor(entity, date_to_str).
+        """
+        cursor = self._get_cursor(entity)
+        if not cursor:
+            return self.date_from
+        try:
+            last_to = date.fromisoformat(cursor)
+        except ValueError:
+            return self.date_from  # bad cursor, fall back to the full range
+        settled = min(last_to, self.date_to) - timedelta(days=cfg.EXTRACTION_SETTLEMENT_DAYS)
+        return max(self.date_from, settled)
+
+    # ------------------------------------------------------------------
+    # Campaign state helpers (skip settled campaigns)
+    # ------------------------------------------------------------------
+
+    def _settled_campaigns(self, channel: str, app_id: str,
+                           campaigns: dict[str, dict]) -> set[str]:
+        """IDs in `campaigns` ({id: list entry}) whose stats need no refetch.
+
+        A campaign is settled when its list entry is unchanged and neither it nor
+        its stats changed for EXTRACTION_CAMPAIGN_SETTLED_DAYS. Empty when
+        refresh_campaigns (or full_refresh) is set.
+        """
+        if self.refresh_campaigns:
+            return set()
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(CAMPAIGN_STATES_SQL), {
+                "tid": self.tenant_id, "app_id": app_id, "channel": channel,
+                "settled_days": cfg.EXTRACTION_CAMPAIGN_SETTLED_DAYS,
+            }).fetchall()
+        return {
+            cid for cid, campaign_hash, _stats_hash, settled in rows
+            if settled and cid in campaigns and campaign_hash == payload_hash(campaigns[cid])
+        }
+
+    def _save_campaign_states(self, channel: str, app_id: str, states: list[dict]):
+        """Record fetched campaigns: {"campaign_id", "status", "campaign", "stats"} each.
+
+        Queued raw rows are flushed first, so a campaign is never marked as
+        checked for stats that are not stored.
+        """
+        if not states:
+            return
+        self.flush_raw()
+        with self.engine.begin() as conn:
+            conn.execute(text(SAVE_CAMPAIGN_STATES_SQL), {
+                "tid": self.tenant_id, "app_id": app_id, "channel": channel,
+                "campaign_id": [st["campaign_id"] for st in states],
+                "status": [None if st["status"] is None else str(st["status"]) for st in states],
+                "campaign_hash": [payload_hash(st["campaign"]) for st in states],
+                "stats_hash": [payload_hash(st["stats"]) for st in states],
+            })
+
     # ------------------------------------------------------------------
     # Date helpers (formatted for Indigitall API)
     # ------------------------------------------------------------------
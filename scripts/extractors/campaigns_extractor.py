@@ -20,7 +20,7 @@ class CampaignsExtractor(BaseExtractor):
 
         # 1. Campaign list (paginated — uses limit+page)
         total_campaigns = 0
-        for page_num in range(self.MAX_PAGES):
+        for page_num in range(self._resume_page(app_id, "/v1/campaign"), self.MAX_PAGES):
             try:
                 data = self.client.get(
                     "/v1/campaign",
@@ -36,17 +36,22 @@ class CampaignsExtractor(BaseExtractor):
 
                 campaigns = data.get("data", []) if isinstance(data, dict) else data
                 if not campaigns:
+                    self._finish_pages(app_id, "/v1/campaign")
                     break
 
-                self._store_raw(app_id, "/v1/campaign", data)
+                self._store_raw(app_id, "/v1/campaign", data, checkpoint=("", page_num + 1),
+                                page=(f"limit={page_size}", page_num))
                 total_campaigns += len(campaigns)
 
                 if len(campaigns) < page_size:
+                    self._finish_pages(app_id, "/v1/campaign")
                     break
 
             except Exception as exc:
                 print(f"    campaign list page {page_num}: FAILED ({exc})")
                 break
+        else:
+            self._finish_pages(app_id, "/v1/campaign")
 
         print(f"    campaign list: {total_campaigns} records")
 
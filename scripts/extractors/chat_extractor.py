@@ -3,8 +3,13 @@
 Verified endpoints (ServerKey auth):
   - /v1/chat/contacts         (paginated contact list)
   - /v1/chat/agent/status     (active agent count)
-  - /v1/chat/history/csv      (message history — CSV, max 7 days per request)
+  - /v1/chat/history/csv      (message history — CSV, max 7 days per request;
+                               stored as {"columns": header, "rows": [[...], ...]})
   - /v1/chat/agent/conversations  (agent sessions — JSON, all at once)
+
+History messages and agent conversations are also upserted into the typed
+raw.chat_message_rows / raw.chat_conversation_rows tables, which the transform
+reads; EXTRACTION_ARCHIVE_LANDED_PAGES=false stops archiving their JSONB pages.
   - /v1/chat/channel          (WhatsApp + webchat channels)
   - /v1/chat/configuration    (chat config)
   - /v1/chat/topic            (conversation topics)
@@ -19,6 +24,101 @@ from datetime import date, timedelta
 from scripts.extractors.base_extractor import BaseExtractor
 from scripts.extractors.config import extraction_settings as cfg
 
+# Typed landing rows, upserted by id. Timestamps are parsed here, once, instead
+# of on every transform run; a record repeated within one batch (window edges)
+# keeps its last occurrence. Unchanged rows keep their loaded_at, so the
+# transform_bridge watermarks only see records that actually changed.
+UPSERT_MESSAGE_ROWS_SQL = """
+INSERT INTO raw.chat_message_rows AS t
+    (tenant_id, application_id, message_id, message_at, send_type, content_type,
+     status, profile_name, contact_id, conversation_id, agent_id, close_reason,
+     intent, is_fallback, message_body, integration, channel)
+SELECT DISTINCT ON (e.elem->>'messageId')
+    :tenant, :app_id,
+    e.elem->>'messageId',
+    nullif(e.elem->>'messageDate', '')::timestamptz,
+    e.elem->>'sendType',
+    e.elem->>'contentType',
+    e.elem->>'status',
+    e.elem->>'profileName',
+    e.elem->>'contactId',
+    e.elem->>'agentConversationId',
+    e.elem->>'agentId',
+    e.elem->>'agentCloseReason',
+    e.elem->>'dfIntentName',
+    coalesce(e.elem->>'isFallback' = 'Yes', FALSE),
+    e.elem->>'content',
+    e.elem->>'integration',
+    e.elem->>'channel'
+FROM jsonb_array_elements(CAST(:rows AS jsonb)) WITH ORDINALITY AS e(elem, n)
+WHERE e.elem->>'messageId' IS NOT NULL
+ORDER BY e.elem->>'messageId', e.n DESC
+ON CONFLICT (tenant_id, message_id) DO UPDATE SET
+    application_id  = EXCLUDED.application_id,
+    message_at      = EXCLUDED.message_at,
+    send_type       = EXCLUDED.send_type,
+    content_type    = EXCLUDED.content_type,
+    status          = EXCLUDED.status,
+    profile_name    = EXCLUDED.profile_name,
+    contact_id      = EXCLUDED.contact_id,
+    conversation_id = EXCLUDED.conversation_id,
+    agent_id        = EXCLUDED.agent_id,
+    close_reason    = EXCLUDED.close_reason,
+    intent          = EXCLUDED.intent,
+    is_fallback     = EXCLUDED.is_fallback,
+    message_body    = EXCLUDED.message_body,
+    integration     = EXCLUDED.integration,
+    channel         = EXCLUDED.channel,
+    loaded_at       = now()
+WHERE (t.application_id, t.message_at, t.send_type, t.content_type, t.status,
+       t.profile_name, t.contact_id, t.conversation_id, t.agent_id, t.close_reason,
+       t.intent, t.is_fallback, t.message_body, t.integration, t.channel)
+      IS DISTINCT FROM
+      (EXCLUDED.application_id, EXCLUDED.message_at, EXCLUDED.send_type, EXCLUDED.content_type,
+       EXCLUDED.status, EXCLUDED.profile_name, EXCLUDED.contact_id, EXCLUDED.conversation_id,
+       EXCLUDED.agent_id, EXCLUDED.close_reason, EXCLUDED.intent, EXCLUDED.is_fallback,
+       EXCLUDED.message_body, EXCLUDED.integration, EXCLUDED.channel)
+"""
+
+UPSERT_CONVERSATION_ROWS_SQL = """
+INSERT INTO raw.chat_conversation_rows AS t
+    (tenant_id, application_id, session_id, conversation_session_id, contact_id,
+     agent_id, agent_email, channel, queued_at, assigned_at, closed_at, initial_session_id)
+SELECT DISTINCT ON (e.elem->>'agentSessionId')
+    :tenant, :app_id,
+    e.elem->>'agentSessionId',
+    e.elem->>'conversationSessionId',
+    e.elem->>'contactId',
+    e.elem->>'agentId',
+    e.elem->>'email',
+    e.elem->>'channel',
+    nullif(e.elem->>'queuedAt', '')::timestamptz,
+    nullif(e.elem->>'assignedAt', '')::timestamptz,
+    nullif(e.elem->>'closedAt', '')::timestamptz,
+    e.elem->>'initialAgentSession'
+FROM jsonb_array_elements(CAST(:rows AS jsonb)) WITH ORDINALITY AS e(elem, n)
+WHERE e.elem->>'agentSessionId' IS NOT NULL
+ORDER BY e.elem->>'agentSessionId', e.n DESC
+ON CONFLICT (tenant_id, session_id) DO UPDATE SET
+    application_id          = EXCLUDED.application_id,
+    conversation_session_id = EXCLUDED.conversation_session_id,
+    contact_id              = EXCLUDED.contact_id,
+    agent_id                = EXCLUDED.agent_id,
+    agent_email             = EXCLUDED.agent_email,
+    channel                 = EXCLUDED.channel,
+    queued_at               = EXCLUDED.queued_at,
+    assigned_at             = EXCLUDED.assigned_at,
+    closed_at               = EXCLUDED.closed_at,
+    initial_session_id      = EXCLUDED.initial_session_id,
+    loaded_at               = now()
+WHERE (t.application_id, t.conversation_session_id, t.contact_id, t.agent_id, t.agent_email,
+       t.channel, t.queued_at, t.assigned_at, t.closed_at, t.initial_session_id)
+      IS DISTINCT FROM
+      (EXCLUDED.application_id, EXCLUDED.conversation_session_id, EXCLUDED.contact_id,
+       EXCLUDED.agent_id, EXCLUDED.agent_email, EXCLUDED.channel, EXCLUDED.queued_at,
+       EXCLUDED.assigned_at, EXCLUDED.closed_at, EXCLUDED.initial_session_id)
+"""
+
 
 class ChatExtractor(BaseExtractor):
     CHANNEL_NAME = "chat"
@@ -63,6 +163,7 @@ class ChatExtractor(BaseExtractor):
                 "/v1/chat/agent/status",
                 params={"applicationId": app_id},
                 application_id=app_id,
+                cache=True,  # ChatExtractor and ContactsExtractor both call it
             )
             if data is not None:
                 self._store_raw(app_id, "/v1/chat/agent/status", data)
@@ -80,7 +181,11 @@ class ChatExtractor(BaseExtractor):
         page_size = min(cfg.EXTRACTION_MAX_RECORDS, 100)
         total_contacts = 0
 
-        for page_num in range(self.MAX_PAGES):
+        # Resumes at the page an interrupted run stopped at; reaching
+        # MAX_PAGES clears the checkpoint so the next run starts over.
+        first_page = self._resume_page(app_id, "/v1/chat/contacts")
+        page_num = first_page
+        for page_num in range(first_page, self.MAX_PAGES):
             try:
                 data = self.client.get(
                     "/v1/chat/contacts",
@@ -90,76 +195,112 @@ class ChatExtractor(BaseExtractor):
                         "page": page_num,
                     },
                     application_id=app_id,
+                    cache=True,  # ChatExtractor and ContactsExtractor both page it
                 )
                 if data is None:
                     break
 
                 contacts = data.get("data", []) if isinstance(data, dict) else data
                 if not contacts:
+                    self._finish_pages(app_id, "/v1/chat/contacts")
                     break
 
-                self._store_raw(app_id, "/v1/chat/contacts", data)
+                self._store_raw(app_id, "/v1/chat/contacts", data, checkpoint=("", page_num + 1),
+                                page=(f"limit={page_size}", page_num))
                 total_contacts += len(contacts)
 
                 if len(contacts) < page_size:
+                    self._finish_pages(app_id, "/v1/chat/contacts")
                     break
 
             except Exception as exc:
                 print(f"    contacts page {page_num}: FAILED ({exc})")
                 break
+        else:
+            self._finish_pages(app_id, "/v1/chat/contacts")
 
-        print(f"    contacts: {total_contacts} records across {page_num + 1} page(s)")
+        print(f"    contacts: {total_contacts} records across {page_num - first_page + 1} page(s)")
 
     # ------------------------------------------------------------------
-    # 3. Message history (CSV, 7-day sliding windows)
+    # 3. Message history (CSV, 7-day windows)
     # ------------------------------------------------------------------
 
     def _extract_message_history(self, app_id: str):
         """Extract chat messages via /v1/chat/history/csv.
 
-        The API enforces a max 7-day window, so we slide through the
-        full date range in 7-day chunks, paginating each chunk.
+        The API enforces a max 7-day window, so we split the full date
+        range into 7-day chunks on a fixed grid, paginating each chunk.
 
         Incremental: reads last cursor (ISO date) and starts from
         cursor - 1 day (overlap for late-arriving messages).
         """
-        total_messages = 0
 
-        # Incremental: use cursor if available
+        # Incremental: use cursor if available. Kept local — self.date_from is
+        # shared with the other endpoints and apps this extractor handles.
+        history_from = self.date_from
         cursor = self._get_cursor("chat_messages")
         if cursor and not self.full_refresh:
             try:
                 cursor_date = date.fromisoformat(cursor)
                 # Start 1 day before cursor for overlap
                 incremental_start = cursor_date - timedelta(days=1)
-                if incremental_start > self.date_from:
-                    self.date_from = incremental_start
-                    print(f"    message-history: incremental from {self.date_from}")
+                if incremental_start > history_from:
+                    history_from = incremental_start
+                    print(f"    message-history: incremental from {history_from}")
             except ValueError:
                 pass  # bad cursor, fall through to full extraction
 
-        window_start = self.date_from
-
+        # Windows sit on a fixed 7-day grid, so a window keeps its page
+        # checkpoint key from one run to the next; the last one's request
+        # stops at date_to and grows with later runs.
+        windows = []
+        window_start = self._history_window_start(history_from)
         while window_start < self.date_to:
-            window_end = min(window_start + timedelta(days=self.HISTORY_MAX_DAYS),
-                             self.date_to)
-
-            page_messages = self._extract_history_window(
-                app_id, window_start.isoformat(), window_end.isoformat()
-            )
-            total_messages += page_messages
+            window_end = window_start + timedelta(days=self.HISTORY_MAX_DAYS)
+            windows.append((window_start, window_end))
             window_start = window_end
 
-        # Save cursor for next incremental run
-        self._update_cursor("chat_messages", self.date_to.isoformat())
+        # Windows are independent — fetch them concurrently (pages within a
+        # window stay sequential, each one ends the window when short).
+        results = self.client.map_concurrent(
+            lambda w: self._extract_history_window(
+                app_id, w[0].isoformat(), min(w[1], self.date_to).isoformat(),
+                window=f"{w[0].isoformat()}..{w[1].isoformat()}"),
+            windows,
+        )
+        total_messages = sum(count for count, _ in results)
+
+        # Save cursor for next incremental run — only past the windows read to
+        # the end: the next run (cursor - 1 day) starts again at the first
+        # unfinished one and resumes it from its page checkpoint.
+        unfinished = [w for w, (_, complete) in zip(windows, results) if not complete]
+        if unfinished:
+            cursor_to = unfinished[0][0] + timedelta(days=1)
+            print(f"    message-history: {len(unfinished)} window(s) incomplete, "
+                  f"cursor held at {cursor_to}")
+        else:
+            cursor_to = self.date_to
+        self._update_cursor("chat_messages", cursor_to.isoformat())
 
         print(f"    message-history: {total_messages} messages")
 
-    def _extract_history_window(self, app_id: str, date_from: str, date_to: str) -> int:
-        """Extract all pages for one 7-day window. Returns message count."""
+    def _history_window_start(self, day: date) -> date:
+        """Start of the grid window holding day (weeks counted from date.min, a Monday)."""
+        ordinal = day.toordinal() - 1
+        return date.fromordinal(ordinal - ordinal % self.HISTORY_MAX_DAYS + 1)
+
+    def _extract_history_window(self, app_id: str, date_from: str, date_to: str,
+                                window: str | None = None) -> tuple[int, bool]:
+        """Extract all pages for one 7-day window.
+
+        `window` is the page checkpoint key (default "date_from..date_to").
+        Returns (message count, whether the window was read to its last page).
+        """
         window_total = 0
+        endpoint = "/v1/chat/history/csv"
+        window = window or f"{date_from}..{date_to}"
 
-        for page_num in range(self.MAX_PAGES):
+        for page_num in range(self._resume_page(app_id, endpoint, window), self.MAX_PAGES):
             try:
                 csv_text = self.client.get_text(
                     "/v1/chat/history/csv",
@@ -173,32 +314,43 @@ class ChatExtractor(BaseExtractor):
                     application_id=app_id,
                 )
                 if csv_text is None:
-                    break
+                    return window_total, False
 
-                # Parse CSV to list of dicts for JSONB storage
-                reader = csv.DictReader(io.StringIO(csv_text))
-                rows = list(reader)
+                # Stored columnar: the CSV header once, then one array per row
+                reader = csv.reader(io.StringIO(csv_text))
+                columns = next(reader, [])
+                rows = [row for row in reader if row]
                 if not rows:
+                    self._finish_pages(app_id, endpoint, window)
                     break
 
-                payload = {
-                    "dateFrom": date_from,
-                    "dateTo": date_to,
-                    "page": page_num,
-                    "count": len(rows),
-                    "data": rows,
-                }
-                self._store_raw(app_id, "/v1/chat/history/csv", payload)
+                if cfg.EXTRACTION_ARCHIVE_LANDED_PAGES:
+                    self._store_raw(app_id, endpoint, {
+                        "dateFrom": date_from,
+                        "dateTo": date_to,
+                        "page": page_num,
+                        "count": len(rows),
+                        "format": "columnar",
+                        "columns": columns,
+                        "rows": rows,
+                    }, page=(f"{window};limit={self.HISTORY_PAGE_SIZE}", page_num))
+                # Queued last: the checkpoint covers the archived page too
+                self._store_rows(app_id, UPSERT_MESSAGE_ROWS_SQL,
+                                 [dict(zip(columns, row)) for row in rows],
+                                 checkpoint=(endpoint, window, page_num + 1))
                 window_total += len(rows)
 
                 if len(rows) < self.HISTORY_PAGE_SIZE:
+                    self._finish_pages(app_id, endpoint, window)
                     break
 
             except Exception as exc:
                 print(f"    history {date_from}/{date_to} p{page_num}: FAILED ({exc})")
-                break
+                return window_total, False
+        else:
+            self._finish_pages(app_id, endpoint, window)
 
-        return window_total
+        return window_total, True
 
     # ------------------------------------------------------------------
     # 4. Agent conversations
@@ -224,7 +376,10 @@ class ChatExtractor(BaseExtractor):
                 return
 
             convs = data.get("data", []) if isinstance(data, dict) else []
-            self._store_raw(app_id, "/v1/chat/agent/conversations", data)
+            if cfg.EXTRACTION_ARCHIVE_LANDED_PAGES:
+                self._store_raw(app_id, "/v1/chat/agent/conversations", data)
+            self._store_rows(app_id, UPSERT_CONVERSATION_ROWS_SQL,
+                             [c for c in convs if isinstance(c, dict)])
             print(f"    agent/conversations: {len(convs)} sessions")
         except Exception as exc:
             print(f"    agent/conversations: FAILED ({exc})")
@@ -22,13 +22,45 @@ class ExtractionSettings(BaseSettings):
 
     # Extraction limits
     EXTRACTION_DAYS_BACK: int = 90
+    EXTRACTION_SETTLEMENT_DAYS: int = 3  # trailing days re-fetched by incremental stats requests
+    EXTRACTION_CAMPAIGN_SETTLED_DAYS: int = 14  # campaigns unchanged this long are not re-fetched
+    EXTRACTION_SMS_OVERLAP_HOURS: float = 6  # sendings re-read before the stored max sentAt
     EXTRACTION_PAGE_LIMIT: int = 50
     EXTRACTION_MAX_RECORDS: int = 100  # page size (API max per request)
+    EXTRACTION_RAW_BATCH_PAGES: int = 50  # raw pages per multi-row insert
+    EXTRACTION_RAW_BATCH_BYTES: int = 8_000_000  # ...or this much JSON, whichever first
+    # Chat history and agent conversations land in typed raw.chat_*_rows tables;
+    # also keep their JSONB pages (needed by migrate/reconcile tooling that reads them)
+    EXTRACTION_ARCHIVE_LANDED_PAGES: bool = True
 
     # Rate-limiting / resilience
-    API_REQUEST_DELAY_SECONDS: float = 0.5
+    API_REQUEST_DELAY_SECONDS: float = 0.5  # pacing when API_REQUESTS_PER_SECOND is 0
+    API_REQUESTS_PER_SECOND: float = 0.0  # token-bucket rate shared by all threads (0 = 1 / delay)
+    API_RATE_BURST: int = 4
+    API_MIN_REQUESTS_PER_SECOND: float = 0.2  # floor for the adaptive slow-down on 429
+    API_MAX_CONCURRENCY: int = 4  # concurrent requests (and pooled keep-alive connections)
     API_MAX_RETRIES: int = 3
     API_TIMEOUT_SECONDS: int = 30
 
+    # Per-run response cache: GETs several extractors of one tenant make with the
+    # same endpoint + params (chat contacts pages, agent status) are sent once per run. Up to N MB stay in
+    # memory, older responses spill to a temp dir (under DIR if set) removed after the run.
+    EXTRACTION_RESPONSE_CACHE: bool = True
+    EXTRACTION_RESPONSE_CACHE_MB: int = 64
+    EXTRACTION_RESPONSE_CACHE_DIR: str = ""
+
+    # raw.extraction_log buffering: flush every N rows or after N seconds; rows
+    # wait in a JSONL spill file (temp dir if empty) until they are written.
+    EXTRACTION_LOG_BATCH_SIZE: int = 200
+    EXTRACTION_LOG_FLUSH_SECONDS: float = 10.0
+    EXTRACTION_LOG_SPILL_DIR: str = ""
+
+    # Multi-tenant: tenant_id -> application ids, as JSON, e.g.
+    # EXTRACTION_TENANT_APPS='{"coovimag": ["100301"]}'. Unlisted tenants match
+    # apps by name; the default tenant keeps the Visionamos keyword filter.
+    EXTRACTION_TENANT_APPS: dict[str, list[str]] = {}
+    EXTRACTION_MAX_TENANT_WORKERS: int = 4
+    EXTRACTION_CONCURRENCY: int = 4  # (extractor, app) units running at once per tenant
+
 
 extraction_settings = ExtractionSettings()
@@ -26,7 +26,11 @@ class ContactsExtractor(BaseExtractor):
         #    The Indigitall API ignores the offset parameter for /v1/chat/contacts.
         #    Page numbers are 0-indexed.
         total = 0
-        for page_num in range(self.MAX_PAGES):
+        # Resumes at the page an interrupted run stopped at; reaching
+        # MAX_PAGES clears the checkpoint so the next run starts over.
+        first_page = self._resume_page(app_id, "/v1/chat/contacts")
+        page_num = first_page
+        for page_num in range(first_page, self.MAX_PAGES):
             try:
                 data = self.client.get(
                     "/v1/chat/contacts",
@@ -36,25 +40,31 @@ class ContactsExtractor(BaseExtractor):
                         "page": page_num,
                     },
                     application_id=app_id,
+                    cache=True,  # ChatExtractor and ContactsExtractor both page it
                 )
                 if data is None:
                     break
 
                 contacts = data.get("data", []) if isinstance(data, dict) else data
                 if not contacts:
+                    self._finish_pages(app_id, "/v1/chat/contacts")
                     break
 
-                self._store_raw(app_id, "/v1/chat/contacts", data)
+                self._store_raw(app_id, "/v1/chat/contacts", data, checkpoint=("", page_num + 1),
+                                page=(f"limit={page_size}", page_num))
                 total += len(contacts)
 
                 if len(contacts) < page_size:
+                    self._finish_pages(app_id, "/v1/chat/contacts")
                     break
 
             except Exception as exc:
                 print(f"    contacts page {page_num}: FAILED ({exc})")
                 break
+        else:
+            self._finish_pages(app_id, "/v1/chat/contacts")
 
-        print(f"    contacts: {total} records across {page_num + 1} page(s)")
+        print(f"    contacts: {total} records across {page_num - first_page + 1} page(s)")
 
         # 2. Agent status
         try:
@@ -62,6 +72,7 @@ class ContactsExtractor(BaseExtractor):
                 "/v1/chat/agent/status",
                 params={"applicationId": app_id},
                 application_id=app_id,
+                cache=True,  # ChatExtractor and ContactsExtractor both call it
             )
             if data is not None:
                 self._store_raw(app_id, "/v1/chat/agent/status", data)
@@ -0,0 +1,177 @@
+"""Buffered, batched writer for raw.extraction_log with a crash-safe spill file."""
+
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import text
+
+from scripts.extractors.config import extraction_settings as cfg
+
+# One multi-row INSERT per flush: the batch travels as a single JSON array.
+INSERT_LOG_SQL = """
+INSERT INTO raw.extraction_log
+    (application_id, tenant_id, endpoint, http_status, duration_ms,
+     error_message, started_at, finished_at)
+SELECT application_id, tenant_id, endpoint, http_status, duration_ms,
+       error_message, started_at, finished_at
+FROM jsonb_to_recordset(CAST(:rows AS jsonb)) AS r(
+    application_id varchar, tenant_id varchar, endpoint varchar, http_status int,
+    duration_ms int, error_message text, started_at timestamptz, finished_at timestamptz
+)
+"""
+
+SPILL_PATTERN = "extraction_log.*.jsonl"
+
+
+def _spill_dir() -> str:
+    return cfg.EXTRACTION_LOG_SPILL_DIR or tempfile.gettempdir()
+
+
+class ExtractionLogBuffer:
+    """Collects extraction_log rows in memory and inserts them in batches.
+
+    A batch is flushed when it reaches `max_rows`, when the oldest pending row
+    is older than `max_age` seconds (checked on every append), on flush() and
+    at interpreter exit. Every row is also appended to a per-process JSONL
+    spill file before it is buffered; the file is rewritten to the still
+    pending rows after each successful flush. Spill files left behind by a
+    crashed process are claimed and flushed by the next buffer created, so
+    entries are delivered at least once (a crash between commit and rewrite
+    can repeat a batch).
+    """
+
+    def __init__(self, engine, max_rows: int | None = None, max_age: float | None = None,
+                 spill_dir: str | None = None):
+        self.engine = engine
+        self.max_rows = max(1, max_rows or cfg.EXTRACTION_LOG_BATCH_SIZE)
+        self.max_age = cfg.EXTRACTION_LOG_FLUSH_SECONDS if max_age is None else max_age
+        self.spill_dir = spill_dir or _spill_dir()
+        self.spill_path = os.path.join(self.spill_dir, f"extraction_log.{os.getpid()}.jsonl")
+        self.rows: list[dict] = []
+        self.oldest: float | None = None
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self._spill = None
+        self._recover_spills()
+        atexit.register(self.flush)
+
+    # ------------------------------------------------------------------
+    # Spill file
+    # ------------------------------------------------------------------
+
+    def _open_spill(self):
+        if self._spill is None:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._spill = open(self.spill_path, "a", encoding="utf-8")
+        return self._spill
+
+    def _rewrite_spill(self):
+        """Replace the spill file with the rows still pending (caller holds self.lock)."""
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+        if not self.rows:
+            if os.path.exists(self.spill_path):
+                os.remove(self.spill_path)
+            return
+        tmp_path = self.spill_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            fh.writelines(json.dumps(row) + "\n" for row in self.rows)
+        os.replace(tmp_path, self.spill_path)
+
+    def _recover_spills(self):
+        """Take over spill files of processes that are no longer running."""
+        recovered = []
+        for path in glob.glob(os.path.join(self.spill_dir, SPILL_PATTERN)):
+            try:
+                pid = int(path.rsplit(".", 2)[-2])
+            except ValueError:
+                continue
+            if pid != os.getpid() and _pid_alive(pid):
+                continue
+            # Rename first so two recovering processes cannot both claim it
+            claimed = f"{path}.claimed.{os.getpid()}"
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            with open(claimed, encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        recovered.append(json.loads(line))
+                    except ValueError:
+                        pass  # line torn by the crash
+            os.remove(claimed)
+        if recovered:
+            print(f"    Recovered {len(recovered)} unflushed extraction_log row(s)")
+            with self.lock:
+                self.rows = recovered + self.rows
+                self.oldest = self.oldest or time.monotonic()
+                self._rewrite_spill()
+            self.flush()
+
+    # ------------------------------------------------------------------
+    # Buffering
+    # ------------------------------------------------------------------
+
+    def append(self, row: dict):
+        """Buffer one row (datetimes as ISO strings); flushes when a threshold is hit."""
+        with self.lock:
+            spill = self._open_spill()
+            spill.write(json.dumps(row) + "\n")
+            spill.flush()
+            self.rows.append(row)
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            due = (len(self.rows) >= self.max_rows
+                   or time.monotonic() - self.oldest >= self.max_age)
+        if due:
+            self.flush()
+
+    def flush(self) -> int:
+        """Insert every buffered row in one statement. Returns rows written."""
+        with self.flush_lock:
+            with self.lock:
+                batch, self.rows, self.oldest = self.rows, [], None
+            if not batch:
+                return 0
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(text(INSERT_LOG_SQL), {"rows": json.dumps(batch)})
+            except Exception as exc:
+                print(f"    [WARN] Could not flush {len(batch)} extraction_log row(s): {exc}")
+                with self.lock:
+                    self.rows = batch + self.rows
+                    self.oldest = time.monotonic()
+                return 0
+            with self.lock:
+                self._rewrite_spill()
+            return len(batch)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_buffers: dict[tuple[int, int], ExtractionLogBuffer] = {}
+_buffers_lock = threading.Lock()
+
+
+def shared_log_buffer(engine) -> ExtractionLogBuffer:
+    """The buffer for this engine in this process (forked workers get their own)."""
+    key = (os.getpid(), id(engine))
+    with _buffers_lock:
+        if key not in _buffers:
+            _buffers[key] = ExtractionLogBuffer(engine)
+        return _buffers[key]
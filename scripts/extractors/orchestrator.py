@@ -1,23 +1,43 @@
 """
 Orchestrator — main entry point for the Indigitall extraction pipeline.
 
+Each tenant (from --tenants, or every tenant in public.sync_state plus the
+default) is extracted in its own worker process with its own API session,
+raw tenant_id and sync_state cursors; --max-workers caps how many tenants
+hit the API at once.
+
+Within a tenant, every (extractor, app) pair is one unit of work; up to
+--concurrency units run at once on a thread pool. All units of a tenant share
+its API client — one auth session, one rate limiter, whose quota is split
+between the tenant processes running at the same time, and one response cache,
+so a GET another unit already made this run (ChatExtractor and ContactsExtractor
+both page /v1/chat/contacts) is not sent again.
+
 Usage:
     docker compose exec app python -m scripts.extractors.orchestrator
     python -m scripts.extractors.orchestrator --full-refresh
+    python -m scripts.extractors.orchestrator --tenants visionamos,coovimag --max-workers 2
+    python -m scripts.extractors.orchestrator --concurrency 8
+    python -m scripts.extractors.orchestrator --refresh-campaigns   # include settled campaigns
 """
 
 import argparse
 import sys
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+from sqlalchemy import text
+
 # Ensure project root is on sys.path so `app.*` and `scripts.*` resolve
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
 
 from app.models.database import engine
 from scripts.extractors.config import extraction_settings as cfg
-from scripts.extractors.api_client import IndigitallAPIClient
+from scripts.extractors.api_client import IndigitallAPIClient, default_limiter
+from scripts.extractors.base_extractor import TENANT_ID
 from scripts.extractors.discovery import discover_applications, get_visionamos_apps
+from scripts.extractors.response_cache import ResponseCache
 from scripts.extractors.push_extractor import PushExtractor
 from scripts.extractors.chat_extractor import ChatExtractor
 from scripts.extractors.sms_extractor import SMSExtractor
@@ -28,11 +48,131 @@ from scripts.extractors.contacts_extractor import ContactsExtractor
 
 MAX_FALLBACK_APPS = 3
 
+EXTRACTOR_CLASSES = [
+    PushExtractor,
+    ChatExtractor,
+    SMSExtractor,
+    EmailExtractor,
+    InAppExtractor,
+    CampaignsExtractor,
+    ContactsExtractor,
+]
+
+
+def discover_tenants() -> list[str]:
+    """Tenants with sync_state rows or an app mapping in settings, plus the default."""
+    with engine.connect() as conn:
+        tenants = conn.execute(text("SELECT DISTINCT tenant_id FROM public.sync_state")).scalars().all()
+    return sorted(set(tenants) | set(cfg.EXTRACTION_TENANT_APPS) | {TENANT_ID})
+
+
+def _app_id(app: dict) -> str:
+    return str(app.get("id") or app.get("appKey") or app.get("applicationId", "unknown"))
+
+
+def tenant_apps(tenant_id: str, all_apps: list[dict], tenants: list[str]) -> list[dict]:
+    """Applications extracted for a tenant.
+
+    EXTRACTION_TENANT_APPS wins; otherwise any tenant but the default matches
+    apps by name. The default tenant keeps the Visionamos keyword filter (with
+    the first-apps fallback) over the apps no other tenant in `tenants` claims.
+    """
+    mapped = cfg.EXTRACTION_TENANT_APPS
+    if tenant_id in mapped:
+        ids = set(mapped[tenant_id])
+        return [a for a in all_apps if _app_id(a) in ids]
+    if tenant_id != TENANT_ID:
+        return [a for a in all_apps if tenant_id.lower() in (a.get("name") or "").lower()]
+
+    claimed = {_app_id(a) for t in tenants if t != TENANT_ID
+               for a in tenant_apps(t, all_apps, tenants)}
+    unclaimed = [a for a in all_apps if _app_id(a) not in claimed]
+    apps = get_visionamos_apps(unclaimed)
+    if not apps:
+        apps = unclaimed[:MAX_FALLBACK_APPS]
+        names = [a.get("name", "?") for a in apps]
+        print(f"  Using fallback: first {len(apps)} app(s): {names}")
+    return apps
+
+
+def _init_tenant_worker():
+    """Drop pooled connections inherited from the parent — they must not cross a fork."""
+    engine.dispose(close=False)
+
+
+def _extract_unit(client, extractor_cls, app: dict, tenant_id: str, full_refresh: bool,
+                  refresh_campaigns: bool = False) -> tuple[int, int, int, list[tuple[str, str]]]:
+    """Run one extractor for one app.
+
+    Returns (records stored, payloads deduplicated, payloads re-stamped, failures).
+    """
+    extractor = extractor_cls(client, engine, full_refresh=full_refresh, tenant_id=tenant_id,
+                              refresh_campaigns=refresh_campaigns)
+    try:
+        stored = extractor.extract([app])
+        return stored, extractor.records_deduped, extractor.records_refreshed, extractor.failures
+    except Exception as exc:
+        print(f"    [ERROR] {extractor.CHANNEL_NAME} failed for {_app_id(app)}: {exc}")
+        return (extractor.records_stored, extractor.records_deduped, extractor.records_refreshed,
+                [(_app_id(app), str(exc))])
+
+
+def extract_tenant(tenant_id: str, apps: list[dict], full_refresh: bool,
+                   concurrency: int = 1, share: int = 1,
+                   refresh_campaigns: bool = False) -> tuple[dict[str, dict], dict]:
+    """Run every (extractor, app) unit for one tenant, `concurrency` at a time.
+
+    Units share one client (auth session, limiter at 1/share of the quota and
+    response cache), and each gets its own extractor instance so counters and
+    date ranges stay per unit. Returns
+    ({channel: {"records": n, "deduped": n, "refreshed": n, "failures": [(app_id, error)]}},
+    cache stats).
+    """
+    cache = ResponseCache() if cfg.EXTRACTION_RESPONSE_CACHE else None
+    client = IndigitallAPIClient(engine, tenant_id=tenant_id, limiter=default_limiter(share),
+                                 cache=cache)
+    client.authenticate()
+    results = {cls.CHANNEL_NAME: {"records": 0, "deduped": 0, "refreshed": 0, "failures": []} for cls in EXTRACTOR_CLASSES}
+    units = [(cls, app) for cls in EXTRACTOR_CLASSES for app in apps]
+    print(f"\n  --- [{tenant_id}] {len(units)} unit(s), {concurrency} at a time ---", flush=True)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(units)))) as pool:
+            futures = {
+                pool.submit(_extract_unit, client, cls, app, tenant_id, full_refresh,
+                            refresh_campaigns): cls.CHANNEL_NAME
+                for cls, app in units
+            }
+            for future in as_completed(futures):
+                records, deduped, refreshed, failures = future.result()
+                channel = results[futures[future]]
+                channel["records"] += records
+                channel["deduped"] += deduped
+                channel["refreshed"] += refreshed
+                channel["failures"].extend(failures)
+    finally:
+        # Pool worker processes exit without running atexit hooks
+        client.flush_log()
+        cache_stats = cache.stats() if cache is not None else {}
+        if cache is not None:
+            cache.close()
+    return results, cache_stats
+
 
 def main():
     parser = argparse.ArgumentParser(description="Indigitall extraction pipeline")
     parser.add_argument("--full-refresh", action="store_true",
                         help="Ignore incremental cursors — re-extract everything")
+    parser.add_argument("--tenants", default="",
+                        help="Comma-separated tenant ids (default: every tenant in sync_state)")
+    parser.add_argument("--max-workers", type=int, default=cfg.EXTRACTION_MAX_TENANT_WORKERS,
+                        help="Max tenants extracted at once, one process each "
+                             f"(default: {cfg.EXTRACTION_MAX_TENANT_WORKERS})")
+    parser.add_argument("--concurrency", type=int, default=cfg.EXTRACTION_CONCURRENCY,
+                        help="(extractor, app) units run at once per tenant "
+                             f"(default: {cfg.EXTRACTION_CONCURRENCY})")
+    parser.add_argument("--refresh-campaigns", action="store_true",
+                        help="Re-fetch stats of settled campaigns too (implied by --full-refresh)")
     args = parser.parse_args()
     full_refresh = args.full_refresh
 
@@ -40,6 +180,8 @@ def main():
     print("  Indigitall API Extraction Pipeline")
     if full_refresh:
         print("  Mode: FULL REFRESH (ignoring cursors)")
+    elif args.refresh_campaigns:
+        print("  Mode: refreshing settled campaigns")
     print("=" * 60)
 
     # ----- Validate credentials -----
@@ -71,49 +213,98 @@ def main():
         print("  [FATAL] No applications found. Check credentials and permissions.")
         raise RuntimeError("No applications found")
 
-    # ----- Filter Visionamos -----
-    target_apps = get_visionamos_apps(all_apps)
+    # ----- Assign apps to tenants -----
+    tenants = [t.strip() for t in args.tenants.split(",") if t.strip()] or discover_tenants()
+    plan = {}
+    for tenant_id in tenants:
+        apps = tenant_apps(tenant_id, all_apps, tenants)
+        if not apps:
+            print(f"  [WARN] No applications for tenant {tenant_id} — skipping")
+            continue
+        plan[tenant_id] = apps
+        print(f"  {tenant_id}: {', '.join(a.get('name', '?') for a in apps)}")
 
-    if not target_apps:
-        fallback = all_apps[:MAX_FALLBACK_APPS]
-        names = [a.get("name", "?") for a in fallback]
-        print(f"  Using fallback: first {len(fallback)} app(s): {names}")
-        target_apps = fallback
+    if not plan:
+        print("  [FATAL] No tenant has applications to extract.")
+        raise RuntimeError("No tenant applications")
 
     # ----- Run extractors -----
-    print(f"\n[3/4] Extracting data for {len(target_apps)} app(s)...")
+    workers = max(1, min(args.max_workers, len(plan)))
+    n_apps = sum(len(apps) for apps in plan.values())
+    concurrency = max(1, args.concurrency)
+    print(f"\n[3/4] Extracting data for {n_apps} app(s) across {len(plan)} tenant(s), "
+          f"{workers} at a time, {concurrency} unit(s) each...")
     print(f"  Date range: {cfg.EXTRACTION_DAYS_BACK} days back")
 
-    extractors = [
-        PushExtractor(client, engine, full_refresh=full_refresh),
-        ChatExtractor(client, engine, full_refresh=full_refresh),
-        SMSExtractor(client, engine, full_refresh=full_refresh),
-        EmailExtractor(client, engine, full_refresh=full_refresh),
-        InAppExtractor(client, engine, full_refresh=full_refresh),
-        CampaignsExtractor(client, engine, full_refresh=full_refresh),
-        ContactsExtractor(client, engine, full_refresh=full_refresh),
-    ]
-
-    results = {}
-    for extractor in extractors:
-        print(f"\n  --- {extractor.CHANNEL_NAME.upper()} ---")
-        count = extractor.extract(target_apps)
-        results[extractor.CHANNEL_NAME] = count
+    results, cache_stats = {}, {}
+    if workers == 1:
+        for tenant_id, apps in plan.items():
+            try:
+                results[tenant_id], cache_stats[tenant_id] = extract_tenant(
+                    tenant_id, apps, full_refresh, concurrency,
+                    refresh_campaigns=args.refresh_campaigns)
+            except Exception as exc:
+                print(f"  [ERROR] Tenant {tenant_id} failed: {exc}")
+                results[tenant_id] = {}
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_tenant_worker) as pool:
+            futures = {
+                pool.submit(extract_tenant, tenant_id, apps, full_refresh,
+                            concurrency, workers, args.refresh_campaigns): tenant_id
+                for tenant_id, apps in plan.items()
+            }
+            for future in as_completed(futures):
+                tenant_id = futures[future]
+                try:
+                    results[tenant_id], cache_stats[tenant_id] = future.result()
+                except Exception as exc:
+                    print(f"  [ERROR] Tenant {tenant_id} failed: {exc}", flush=True)
+                    results[tenant_id] = {}
+
+    client.flush_log()
 
     # ----- Summary -----
     elapsed = time.time() - start_time
-    total = sum(results.values())
+    total = sum(c["records"] for counts in results.values() for c in counts.values())
+    deduped = sum(c["deduped"] for counts in results.values() for c in counts.values())
+    refreshed = sum(c["refreshed"] for counts in results.values() for c in counts.values())
+    failed = sum(len(c["failures"]) for counts in results.values() for c in counts.values())
+    hits = sum(c.get("hits", 0) for c in cache_stats.values())
+    gets = hits + sum(c.get("misses", 0) for c in cache_stats.values())
 
     print("\n" + "=" * 60)
     print(f"[4/4] Extraction Summary")
     print("=" * 60)
-    print(f"  Apps processed:  {len(target_apps)}")
+    print(f"  Tenants:         {len(plan)}")
+    print(f"  Apps processed:  {n_apps}")
     print(f"  Total records:   {total}")
+    print(f"  Deduplicated:    {deduped} unchanged payload(s) skipped")
+    print(f"  Re-stamped:      {refreshed} reappeared payload(s) given a fresh loaded_at")
+    print(f"  Failed units:    {failed}")
+    if cfg.EXTRACTION_RESPONSE_CACHE:
+        print(f"  Response cache:  {hits}/{gets} cacheable GETs served from cache "
+              f"({hits / gets if gets else 0:.0%} hit rate)")
     print(f"  Elapsed time:    {elapsed:.1f}s")
-    print()
-    for channel, count in results.items():
-        status = "OK" if count > 0 else "EMPTY"
-        print(f"    {channel:12s}  {count:4d} records  [{status}]")
+    for tenant_id in plan:
+        print(f"\n  Tenant: {tenant_id}")
+        if not results.get(tenant_id):
+            print("    [ERROR] no results — see log above")
+            continue
+        stats = cache_stats.get(tenant_id)
+        if stats:
+            tenant_gets = stats["hits"] + stats["misses"]
+            print(f"    cache         {stats['hits']:4d} hits / {tenant_gets} cacheable GETs "
+                  f"({stats['hits'] / tenant_gets if tenant_gets else 0:.0%}), "
+                  f"{stats['disk']} spilled to disk")
+        for channel, counts in results[tenant_id].items():
+            count, failures = counts["records"], counts["failures"]
+            if failures:
+                status = f"{len(failures)} FAILED"
+            else:
+                status = "OK" if count > 0 else "EMPTY"
+            print(f"    {channel:12s}  {count:4d} records  {counts['deduped']:4d} dedup  [{status}]")
+            for app_id, error in failures:
+                print(f"      {app_id}: {error[:100]}")
     print()
 
     if total == 0:
@@ -5,6 +5,10 @@ Verified endpoints:
   - /v1/application/{id}/pushHeatmap  (engagement heatmap by hour/weekday)
   - /v1/application/{id}/stats/device  (device stats, max 7-day range)
   - /v1/application/stats  (account-level summary: campaigns/devices/impacts)
+
+dateStats is incremental: a per-app cursor in sync_state limits each run to the
+days since the last success plus a trailing settlement window. pushHeatmap is
+one aggregate over the whole range, so it is re-fetched in full at most once a day.
 """
 
 from datetime import timedelta
@@ -17,6 +21,13 @@ class PushExtractor(BaseExtractor):
     RAW_TABLE = "raw.raw_push_stats"
 
     def _extract_for_app(self, app_id: str, app_meta: dict):
+        date_stats_cursor = f"push_date_stats:{app_id}"
+        heatmap_cursor = f"push_heatmap:{app_id}"
+
+        date_stats_from = self._settled_from(date_stats_cursor)
+        if date_stats_from > self.date_from:
+            print(f"    dateStats: incremental from {date_stats_from}")
+
         # Device stats endpoint is limited to 7-day range
         device_date_from = max(
             self.date_from,
@@ -28,10 +39,11 @@ class PushExtractor(BaseExtractor):
                 "name": "dateStats (daily)",
                 "path": f"/v1/application/{app_id}/dateStats",
                 "params": {
-                    "dateFrom": self.date_from_str,
+                    "dateFrom": date_stats_from.isoformat(),
                     "dateTo": self.date_to_str,
                     "periodicity": "daily",
                 },
+                "cursor": date_stats_cursor,
             },
             {
                 "name": "pushHeatmap",
@@ -40,6 +52,7 @@ class PushExtractor(BaseExtractor):
                     "dateFrom": self.date_from_str,
                     "dateTo": self.date_to_str,
                 },
+                "cursor": heatmap_cursor,
             },
             {
                 "name": "stats/device (7d)",
@@ -60,13 +73,33 @@ class PushExtractor(BaseExtractor):
             },
         ]
 
+        if self._get_cursor(heatmap_cursor) == self.date_to_str:
+            endpoints = [ep for ep in endpoints if ep.get("cursor") != heatmap_cursor]
+            print("    pushHeatmap: already refreshed today, skipped")
+
         for ep in endpoints:
             try:
                 data = self.client.get(ep["path"], params=ep["params"], application_id=app_id)
                 if data is not None:
                     self._store_raw(app_id, ep["path"], data)
+                    if ep.get("cursor"):
+                        self._update_cursor(ep["cursor"], self.date_to_str)
                     print(f"    {ep['name']}: OK")
                 else:
                     print(f"    {ep['name']}: empty response")
             except Exception as exc:
                 print(f"    {ep['name']}: FAILED ({exc})")
+
+    def _extract_date_stats_window(self, app_id: str, date_from: str, date_to: str) -> int:
+        """dateStats for one explicit window (used by the backfill). Returns daily rows stored."""
+        path = f"/v1/application/{app_id}/dateStats"
+        data = self.client.get(
+            path,
+            params={"dateFrom": date_from, "dateTo": date_to, "periodicity": "daily"},
+            application_id=app_id,
+        )
+        if data is None:
+            return 0
+        self._store_raw(app_id, path, data)
+        rows = data.get("data") if isinstance(data, dict) else data
+        return len(rows) if isinstance(rows, list) else 0
@@ -0,0 +1,58 @@
+"""Token-bucket rate limiter shared by every request an API client makes."""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket with adaptive slow-down.
+
+    acquire() blocks until a token is available; tokens refill at `rate` per
+    second up to `burst`. throttle() (on HTTP 429) halves the rate, down to
+    `min_rate`, and honours Retry-After by pushing the bucket into debt;
+    recover() (on success) creeps the rate back up to the configured maximum.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, min_rate: float | None = None):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate or rate / 10, rate)
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Take one token, sleeping (outside the lock) until one is available."""
+        while True:
+            with self.lock:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttle(self, retry_after: str | float | None = None):
+        """Rate limited: halve the rate and pause every caller for Retry-After seconds."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, self.rate / 2)
+            pause = 0.0
+            if retry_after is not None:
+                try:
+                    pause = float(retry_after)
+                except ValueError:
+                    pass  # HTTP-date form — the halved rate is enough
+            self.tokens = min(self.tokens, 0.0) - pause * self.rate
+
+    def recover(self):
+        """Successful call: additive increase back toward the configured rate."""
+        if self.rate >= self.max_rate:
+            return
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
@@ -0,0 +1,114 @@
+"""Run-scoped cache of API GET responses, shared by every extractor of a client."""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from scripts.extractors.config import extraction_settings as cfg
+
+
+def cache_key(endpoint: str, params: dict | None) -> tuple:
+    """Endpoint + params, order-insensitive (values compared as the query string sends them)."""
+    return endpoint, tuple(sorted((str(k), str(v)) for k, v in (params or {}).items()))
+
+
+class ResponseCache:
+    """Response bodies of successful cacheable GETs, keyed by endpoint and params.
+
+    Lives for one extraction run: a GET the client sends with cache=True that
+    another extractor already made during the run (both paging the same list)
+    is answered from here instead of the API. Concurrent callers of one key wait
+    for the first fetch rather than sending their own. Bodies are kept in
+    memory up to `max_bytes`; the least recently used ones are spilled to files
+    in a private directory (under `spill_dir`) that close() removes.
+    """
+
+    def __init__(self, max_bytes: int | None = None, spill_dir: str | None = None):
+        self.max_bytes = cfg.EXTRACTION_RESPONSE_CACHE_MB * 1_000_000 if max_bytes is None else max_bytes
+        self.spill_root = spill_dir or cfg.EXTRACTION_RESPONSE_CACHE_DIR or tempfile.gettempdir()
+        self.memory: OrderedDict[tuple, str] = OrderedDict()
+        self.memory_bytes = 0
+        self.on_disk: dict[tuple, str] = {}
+        self.pending: dict[tuple, threading.Event] = {}
+        self.lock = threading.Lock()
+        self._dir: str | None = None
+        self.hits = 0
+        self.misses = 0
+
+    def fetch(self, key: tuple, load) -> str | None:
+        """Cached body for key, else load() — stored unless None (failed requests are not cached)."""
+        while True:
+            with self.lock:
+                body = self._lookup(key)
+                if body is not None:
+                    self.hits += 1
+                    return body
+                event = self.pending.get(key)
+                if event is None:
+                    self.pending[key] = threading.Event()
+                    self.misses += 1
+                    break
+            event.wait()  # another thread is fetching it; None there means we try ourselves
+
+        try:
+            body = load()
+            if body is not None:
+                with self.lock:
+                    self._store(key, body)
+            return body
+        finally:
+            with self.lock:
+                self.pending.pop(key).set()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "memory": len(self.memory), "disk": len(self.on_disk)}
+
+    def close(self):
+        """Drop every entry and the spill directory."""
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+            self.on_disk.clear()
+            if self._dir:
+                shutil.rmtree(self._dir, ignore_errors=True)
+                self._dir = None
+
+    # -- internals, called under self.lock --------------------------------
+
+    def _lookup(self, key: tuple) -> str | None:
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+        path = self.on_disk.get(key)
+        if path:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    return f.read()
+            except OSError:
+                del self.on_disk[key]
+        return None
+
+    def _store(self, key: tuple, body: str):
+        self.memory[key] = body
+        self.memory_bytes += len(body)
+        while self.memory_bytes > self.max_bytes and self.memory:
+            old_key, old_body = self.memory.popitem(last=False)
+            self.memory_bytes -= len(old_body)
+            self._spill(old_key, old_body)
+
+    def _spill(self, key: tuple, body: str):
+        try:
+            if self._dir is None:
+                os.makedirs(self.spill_root, exist_ok=True)
+                self._dir = tempfile.mkdtemp(prefix="response_cache.", dir=self.spill_root)
+            path = os.path.join(self._dir, hashlib.sha1(repr(key).encode()).hexdigest())
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(body)
+            self.on_disk[key] = path
+        except OSError as exc:
+            print(f"    [WARN] response cache: could not spill to disk ({exc})")
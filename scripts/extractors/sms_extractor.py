@@ -11,23 +11,42 @@ Confirmed v2 endpoints (10):
   GET /v2/sms/contact?applicationId=X&limit=N&page=P               → SMS contacts (413K)
   GET /v2/sms/contact/{id}                                          → contact detail
   GET /v2/sms/topic?applicationId=X                                 → subscription topics
+
+The date-ranged stats endpoints are incremental: per-app cursors in sync_state
+limit each run to the days since the last success plus a trailing settlement
+window (EXTRACTION_SETTLEMENT_DAYS). Per-campaign stats history is skipped for
+campaigns settled in raw.campaign_state (unchanged for
+EXTRACTION_CAMPAIGN_SETTLED_DAYS) unless campaigns are force-refreshed.
+Sendings page only down to the stored max sentAt (minus a small overlap).
 """
 
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 
 from scripts.extractors.base_extractor import BaseExtractor
+from scripts.extractors.config import extraction_settings as cfg
 
 MAX_STATS_WINDOW_DAYS = 99
 
 
+def _parse_ts(value) -> datetime | None:
+    """API timestamp (ISO 8601, 'Z' suffix) -> aware datetime, or None."""
+    if not value:
+        return None
+    try:
+        ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
 class SMSExtractor(BaseExtractor):
     CHANNEL_NAME = "sms"
     RAW_TABLE = "raw.raw_sms_stats"
 
     def _extract_for_app(self, app_id: str, app_meta: dict):
-        campaign_ids = self._extract_campaigns(app_id)
+        campaigns = self._extract_campaigns(app_id)
         self._extract_campaign_stats_list(app_id)
-        self._extract_campaign_stats_detail(app_id, campaign_ids)
+        self._extract_campaign_stats_detail(app_id, campaigns)
         self._extract_app_stats(app_id)
         self._extract_sendings(app_id)
         self._extract_sending_details(app_id)
@@ -38,8 +57,8 @@ class SMSExtractor(BaseExtractor):
     # Campaigns
     # ------------------------------------------------------------------
 
-    def _extract_campaigns(self, app_id: str) -> list[int]:
-        """GET /v2/sms/campaign — list all SMS campaigns. Returns campaign IDs."""
+    def _extract_campaigns(self, app_id: str) -> list[dict]:
+        """GET /v2/sms/campaign — list all SMS campaigns. Returns the campaign entries."""
         data = self.client.get(
             "/v2/sms/campaign",
             params={"applicationId": app_id},
@@ -53,7 +72,7 @@ class SMSExtractor(BaseExtractor):
         campaigns = data.get("data", {}).get("campaigns", [])
         count = data.get("count", len(campaigns))
         print(f"    sms/campaign: {count} campaigns")
-        return [c["id"] for c in campaigns if "id" in c]
+        return [c for c in campaigns if "id" in c]
 
     # ------------------------------------------------------------------
     # Stats — aggregated
@@ -61,28 +80,29 @@ class SMSExtractor(BaseExtractor):
 
     def _extract_campaign_stats_list(self, app_id: str):
         """GET /v2/sms/stats/campaign — daily stats per campaign (date-ranged, max 99d)."""
-        for start, end in self._date_windows():
-            data = self.client.get(
-                "/v2/sms/stats/campaign",
-                params={
-                    "applicationId": app_id,
-                    "dateFrom": start.isoformat(),
-                    "dateTo": end.isoformat(),
-                },
-                application_id=app_id,
-            )
-            if data is None:
+        cursor = f"sms_campaign_stats:{app_id}"
+        rows = []
+        for start, end in self._date_windows(self._settled_from(cursor)):
+            rows = self._extract_stats_window(app_id, "/v2/sms/stats/campaign", start, end)
+            if rows is None:
                 print("    sms/stats/campaign: not available")
                 return
-            self._store_raw(app_id, "/v2/sms/stats/campaign", data)
+        self._update_cursor(cursor, self.date_to_str)
 
-        rows = data.get("data", []) if data else []
         print(f"    sms/stats/campaign: {len(rows)} rows (last window)")
 
-    def _extract_campaign_stats_detail(self, app_id: str, campaign_ids: list[int]):
-        """GET /v2/sms/stats/campaign/{id} — full history per campaign (no date limit)."""
+    def _extract_campaign_stats_detail(self, app_id: str, campaigns: list[dict]):
+        """GET /v2/sms/stats/campaign/{id} — full history per campaign (no date limit).
+
+        Settled campaigns are skipped; the others' state is recorded afterwards.
+        """
+        by_id = {str(c["id"]): c for c in campaigns}
+        settled = self._settled_campaigns("sms", app_id, by_id)
         total_rows = 0
-        for cid in campaign_ids:
+        states = []
+        for cid, campaign in by_id.items():
+            if cid in settled:
+                continue
             data = self.client.get(
                 f"/v2/sms/stats/campaign/{cid}",
                 params={"applicationId": app_id},
@@ -93,28 +113,24 @@ class SMSExtractor(BaseExtractor):
             rows = data.get("data", [])
             total_rows += len(rows)
             self._store_raw(app_id, f"/v2/sms/stats/campaign/{cid}", data)
+            states.append({"campaign_id": cid, "status": campaign.get("status"),
+                           "campaign": campaign, "stats": data})
+        self._save_campaign_states("sms", app_id, states)
 
-        print(f"    sms/stats/campaign/{{id}}: {total_rows} rows across {len(campaign_ids)} campaigns")
+        print(f"    sms/stats/campaign/{{id}}: {total_rows} rows across {len(states)} campaigns "
+              f"({len(settled)} settled, skipped)")
 
     def _extract_app_stats(self, app_id: str):
         """GET /v2/sms/stats/application — daily aggregate stats (max 99d windows)."""
+        cursor = f"sms_app_stats:{app_id}"
         total_rows = 0
-        for start, end in self._date_windows():
-            data = self.client.get(
-                "/v2/sms/stats/application",
-                params={
-                    "applicationId": app_id,
-                    "dateFrom": start.isoformat(),
-                    "dateTo": end.isoformat(),
-                },
-                application_id=app_id,
-            )
-            if data is None:
+        for start, end in self._date_windows(self._settled_from(cursor)):
+            rows = self._extract_stats_window(app_id, "/v2/sms/stats/application", start, end)
+            if rows is None:
                 print("    sms/stats/application: not available")
                 return
-            rows = data.get("data", [])
             total_rows += len(rows)
-            self._store_raw(app_id, "/v2/sms/stats/application", data)
+        self._update_cursor(cursor, self.date_to_str)
 
         print(f"    sms/stats/application: {total_rows} daily rows")
 
@@ -123,10 +139,23 @@ class SMSExtractor(BaseExtractor):
     # ------------------------------------------------------------------
 
     def _extract_sendings(self, app_id: str, max_records: int = 2000):
-        """GET /v2/sms/send — paginated list of sendings (capped for structure inspection)."""
+        """GET /v2/sms/send — paginated list of sendings (capped for structure inspection).
+
+        Incremental on sentAt: the API lists newest first, so paging stops at the
+        first page entirely older than the stored max sentAt minus
+        EXTRACTION_SMS_OVERLAP_HOURS. Every run starts at page 1 (no page
+        checkpoint: resuming deeper would stop reading the newest sendings), so
+        the max sentAt it saw is the list's newest and becomes the cursor even
+        when max_records stops it first — sendings beyond the cap are
+        extract_sms_bulk.py's job.
+        """
+        cursor = f"sms_sendings:{app_id}"
+        watermark = _parse_ts(self._get_cursor(cursor))
+        cutoff = watermark - timedelta(hours=cfg.EXTRACTION_SMS_OVERLAP_HOURS) if watermark else None
         page = 1
         page_size = 100
         total_fetched = 0
+        max_sent = watermark
 
         while total_fetched < max_records:
             data = self.client.get(
@@ -146,15 +175,23 @@ class SMSExtractor(BaseExtractor):
             if not sendings:
                 break
 
-            self._store_raw(app_id, "/v2/sms/send", data)
+            self._store_raw(app_id, "/v2/sms/send", data, page=(f"limit={page_size}", page))
             total_fetched += len(sendings)
             page += 1
 
+            sent = [ts for ts in (_parse_ts(s.get("sentAt")) for s in sendings) if ts]
+            if sent:
+                max_sent = max(max_sent or sent[0], *sent)
+            if cutoff and sent and len(sent) == len(sendings) and max(sent) < cutoff:
+                break
             if len(sendings) < page_size:
                 break
 
+        if max_sent:
+            self._update_cursor(cursor, max_sent.isoformat())
         api_total = data.get("count", 0) if data else 0
-        print(f"    sms/send: {total_fetched} fetched (API total: {api_total:,})")
+        mode = f"since {cutoff.isoformat()}" if cutoff else "full"
+        print(f"    sms/send: {total_fetched} fetched, {mode} (API total: {api_total:,})")
 
     def _extract_sending_details(self, app_id: str, sample_size: int = 5):
         """GET /v2/sms/send/{id} — fetch detail for a sample of sendings.
@@ -190,7 +227,12 @@ class SMSExtractor(BaseExtractor):
     # ------------------------------------------------------------------
 
     def _extract_contacts(self, app_id: str, max_records: int = 2000):
-        """GET /v2/sms/contact — paginated SMS contacts (capped for inspection)."""
+        """GET /v2/sms/contact — paginated SMS contacts (capped for inspection).
+
+        Always the first max_records contacts: no page checkpoint, a capped run
+        must not push the next one deeper into the list (extract_sms_bulk.py
+        reads it all).
+        """
         page = 1
         page_size = 100
         total_fetched = 0
@@ -213,7 +255,7 @@ class SMSExtractor(BaseExtractor):
             if not contacts:
                 break
 
-            self._store_raw(app_id, "/v2/sms/contact", data)
+            self._store_raw(app_id, "/v2/sms/contact", data, page=(f"limit={page_size}", page))
             total_fetched += len(contacts)
             page += 1
 
@@ -245,9 +287,25 @@ class SMSExtractor(BaseExtractor):
     # Helpers
     # ------------------------------------------------------------------
 
-    def _date_windows(self):
-        """Yield (start, end) date tuples in <=99-day windows covering the extraction range."""
-        current = self.date_from
+    def _extract_stats_window(self, app_id: str, endpoint: str, start, end) -> list | None:
+        """Fetch and store one <=99-day window of a stats endpoint. Returns its rows (None = unavailable)."""
+        data = self.client.get(
+            endpoint,
+            params={
+                "applicationId": app_id,
+                "dateFrom": start.isoformat(),
+                "dateTo": end.isoformat(),
+            },
+            application_id=app_id,
+        )
+        if data is None:
+            return None
+        self._store_raw(app_id, endpoint, data)
+        return data.get("data", [])
+
+    def _date_windows(self, start=None):
+        """Yield (start, end) date tuples in <=99-day windows from start (default date_from) to date_to."""
+        current = start or self.date_from
         while current < self.date_to:
             window_end = min(current + timedelta(days=MAX_STATS_WINDOW_DAYS - 1), self.date_to)
             yield current, window_end
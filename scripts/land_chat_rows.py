@@ -0,0 +1,189 @@
+"""
+Land archived chat pages into the typed landing tables.
+
+ChatExtractor upserts chat history messages and agent conversations straight
+into raw.chat_message_rows / raw.chat_conversation_rows, which is what
+transform_bridge reads. Pages extracted before those tables existed only live
+in the JSONB archive (raw.raw_chat_stats); this copies them in, once per
+tenant, in batches of --batch-pages archived pages (one transaction each).
+
+Each row keeps the loaded_at of the newest page holding it, so transform_bridge
+watermarks do not re-flatten records already transformed from the archive, and
+a row already landed by the extractor is only replaced by a newer page.
+Safe to re-run.
+
+Usage:
+    python scripts/land_chat_rows.py
+    python scripts/land_chat_rows.py --tenants visionamos --batch-pages 200
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from sqlalchemy import text
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.models.database import engine
+from scripts import transform_bridge as tb
+
+LAND_MESSAGES_SQL = """
+WITH {history_rows}
+INSERT INTO raw.chat_message_rows AS t
+    (tenant_id, application_id, message_id, message_at, send_type, content_type,
+     status, profile_name, contact_id, conversation_id, agent_id, close_reason,
+     intent, is_fallback, message_body, integration, channel, loaded_at)
+SELECT DISTINCT ON (h.message_id)
+    h.tenant_id, h.application_id, h.message_id,
+    nullif(h.message_date, '')::timestamptz,
+    h.send_type, h.content_type, h.status, h.profile_name, h.contact_id,
+    h.conversation_id, h.agent_id, h.close_reason, h.intent,
+    coalesce(h.is_fallback = 'Yes', FALSE),
+    h.message_body, h.integration, h.channel, h.loaded_at
+FROM history_rows h
+WHERE h.message_id IS NOT NULL
+ORDER BY h.message_id, h.loaded_at DESC
+ON CONFLICT (tenant_id, message_id) DO UPDATE SET
+    application_id  = EXCLUDED.application_id,
+    message_at      = EXCLUDED.message_at,
+    send_type       = EXCLUDED.send_type,
+    content_type    = EXCLUDED.content_type,
+    status          = EXCLUDED.status,
+    profile_name    = EXCLUDED.profile_name,
+    contact_id      = EXCLUDED.contact_id,
+    conversation_id = EXCLUDED.conversation_id,
+    agent_id        = EXCLUDED.agent_id,
+    close_reason    = EXCLUDED.close_reason,
+    intent          = EXCLUDED.intent,
+    is_fallback     = EXCLUDED.is_fallback,
+    message_body    = EXCLUDED.message_body,
+    integration     = EXCLUDED.integration,
+    channel         = EXCLUDED.channel,
+    loaded_at       = EXCLUDED.loaded_at
+WHERE EXCLUDED.loaded_at > t.loaded_at
+""".replace("{history_rows}", tb.HISTORY_ROWS_SQL.strip())
+
+LAND_CONVERSATIONS_SQL = """
+INSERT INTO raw.chat_conversation_rows AS t
+    (tenant_id, application_id, session_id, conversation_session_id, contact_id,
+     agent_id, agent_email, channel, queued_at, assigned_at, closed_at,
+     initial_session_id, loaded_at)
+SELECT DISTINCT ON (elem->>'agentSessionId')
+    coalesce(p.tenant_id, :tid), p.application_id,
+    elem->>'agentSessionId',
+    elem->>'conversationSessionId',
+    elem->>'contactId',
+    elem->>'agentId',
+    elem->>'email',
+    elem->>'channel',
+    nullif(elem->>'queuedAt', '')::timestamptz,
+    nullif(elem->>'assignedAt', '')::timestamptz,
+    nullif(elem->>'closedAt', '')::timestamptz,
+    elem->>'initialAgentSession',
+    p.loaded_at
+FROM raw.raw_chat_stats p,
+     jsonb_array_elements(p.source_data->'data') AS elem
+WHERE p.endpoint = '/v1/chat/agent/conversations'
+  AND jsonb_typeof(p.source_data->'data') = 'array'
+  AND p.loaded_at > :since AND p.loaded_at <= :until
+  AND coalesce(p.tenant_id, :default_tid) = :tid
+  AND elem->>'agentSessionId' IS NOT NULL
+ORDER BY elem->>'agentSessionId', p.loaded_at DESC
+ON CONFLICT (tenant_id, session_id) DO UPDATE SET
+    application_id          = EXCLUDED.application_id,
+    conversation_session_id = EXCLUDED.conversation_session_id,
+    contact_id              = EXCLUDED.contact_id,
+    agent_id                = EXCLUDED.agent_id,
+    agent_email             = EXCLUDED.agent_email,
+    channel                 = EXCLUDED.channel,
+    queued_at               = EXCLUDED.queued_at,
+    assigned_at             = EXCLUDED.assigned_at,
+    closed_at               = EXCLUDED.closed_at,
+    initial_session_id      = EXCLUDED.initial_session_id,
+    loaded_at               = EXCLUDED.loaded_at
+WHERE EXCLUDED.loaded_at > t.loaded_at
+"""
+
+# (label, archived endpoint, landing statement)
+LANDINGS = [
+    ("messages",      "/v1/chat/history/csv",         LAND_MESSAGES_SQL),
+    ("conversations", "/v1/chat/agent/conversations", LAND_CONVERSATIONS_SQL),
+]
+
+PAGE_BOUNDS_SQL = """
+SELECT loaded_at FROM (
+    SELECT loaded_at, row_number() OVER (ORDER BY loaded_at) AS rn
+    FROM raw.raw_chat_stats
+    WHERE endpoint = :endpoint
+      AND loaded_at <= :until
+      AND coalesce(tenant_id, :default_tid) = :tid
+) pages
+WHERE mod(rn, :batch) = 0
+ORDER BY loaded_at
+"""
+
+
+def archive_tenants(conn) -> list[str]:
+    return conn.execute(text("""
+        SELECT DISTINCT coalesce(tenant_id, :default_tid) FROM raw.raw_chat_stats
+        WHERE endpoint IN ('/v1/chat/history/csv', '/v1/chat/agent/conversations')
+    """), {"default_tid": tb.TENANT_ID}).scalars().all()
+
+
+def land(tid: str, label: str, endpoint: str, sql: str, batch_pages: int,
+         until: datetime) -> int:
+    """Land one tenant's archived pages of an endpoint. Returns rows written."""
+    params = {"tid": tid, "default_tid": tb.TENANT_ID, "app_id": tb.APP_ID,
+              "since": tb.FULL_REBUILD_SINCE, "until": until}
+    with engine.connect() as conn:
+        bounds = conn.execute(text(PAGE_BOUNDS_SQL), {
+            **params, "endpoint": endpoint, "batch": max(1, batch_pages),
+        }).scalars().all()
+    bounds = [b for b in dict.fromkeys(bounds) if b < until] + [until]
+
+    written, since = 0, params["since"]
+    for bound in bounds:
+        with engine.begin() as conn:
+            written += conn.execute(text(sql), {**params, "since": since, "until": bound}).rowcount
+        since = bound
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Land archived chat pages into raw.chat_*_rows")
+    parser.add_argument("--tenants", help="Comma-separated tenant ids (default: every tenant in the archive)")
+    parser.add_argument("--batch-pages", type=int, default=500,
+                        help="Archived pages landed per transaction (default: 500)")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("  Land chat archive → raw.chat_message_rows / chat_conversation_rows")
+    print("=" * 60)
+
+    until = datetime.now(timezone.utc)
+    with engine.connect() as conn:
+        tenants = args.tenants.split(",") if args.tenants else archive_tenants(conn)
+    if not tenants:
+        print("  No archived chat pages.")
+        return 0
+
+    errors = 0
+    for tid in tenants:
+        for label, endpoint, sql in LANDINGS:
+            start = time.time()
+            try:
+                n = land(tid, label, endpoint, sql, args.batch_pages, until)
+                print(f"  {tid:<20s} {label:<14s} {n:>10,d} rows ({time.time() - start:.1f}s)")
+            except Exception as e:
+                errors += 1
+                print(f"  [ERROR] {tid} {label}: {e}")
+
+    print("=" * 60)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+"""
+Migrate raw chat history pages to the columnar format, with a size/speed report.
+
+Legacy /v1/chat/history/csv pages in raw.raw_chat_stats hold one JSON object
+per message under "data", repeating every column name in every row. The
+extractor now stores {"format": "columnar", "columns": [header], "rows": [[...]]};
+this rewrites the legacy pages the same way, in batches of --batch-pages pages,
+one transaction each (an interrupted run just continues with the pages left).
+loaded_at is kept, so the transform_bridge watermarks do not re-read them.
+
+A legacy page whose columnar form is byte-identical to a page already stored
+(same payload_hash) stays legacy; the transforms read both formats.
+
+The report compares, for the pages migrated (or, with --report, for every
+legacy page inside a transaction that is rolled back):
+    json     sum of octet_length(source_data::text) — the payload as JSON text
+    stored   sum of pg_column_size(source_data) — bytes on disk after TOAST
+             compression, which already squeezes much of the repeated keys
+    flatten  reading every message out of the archived pages
+             (transform_bridge.HISTORY_ROWS_SQL, as scripts/land_chat_rows.py does)
+
+Usage:
+    python scripts/migrate_chat_history_columnar.py --report   # measure only, change nothing
+    python scripts/migrate_chat_history_columnar.py
+    python scripts/migrate_chat_history_columnar.py --batch-pages 200
+
+The table file shrinks only after VACUUM FULL raw.raw_chat_stats (or pg_repack);
+a plain VACUUM makes the freed space reusable for new pages.
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from sqlalchemy import text
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.models.database import engine
+from scripts import transform_bridge as tb
+
+LEGACY_PAGES_SQL = """
+SELECT id FROM raw.raw_chat_stats
+WHERE endpoint = '/v1/chat/history/csv'
+  AND jsonb_typeof(source_data->'data') = 'array'
+  AND id > :after
+ORDER BY id
+LIMIT :limit
+"""
+
+PAGES_SIZE_SQL = """
+SELECT count(*),
+       coalesce(sum(octet_length(source_data::text)), 0),
+       coalesce(sum(pg_column_size(source_data)), 0)
+FROM raw.raw_chat_stats
+WHERE id = ANY(CAST(:ids AS int[]))
+"""
+
+# Columns: every key any message of the page has, in sorted order. Values keep
+# their JSON type (CSV pages only hold strings, or null for short rows).
+COLUMNAR_SQL = """
+WITH converted AS (
+    SELECT p.id, p.application_id, p.endpoint,
+           (p.source_data - 'data') || jsonb_build_object(
+               'format', 'columnar',
+               'columns', to_jsonb(c.cols),
+               'rows', coalesce((
+                   SELECT jsonb_agg(
+                              (SELECT jsonb_agg(e.elem -> col ORDER BY i)
+                               FROM unnest(c.cols) WITH ORDINALITY AS k(col, i))
+                              ORDER BY e.n)
+                   FROM jsonb_array_elements(p.source_data->'data') WITH ORDINALITY AS e(elem, n)
+               ), '[]'::jsonb)
+           ) AS source_data
+    FROM raw.raw_chat_stats p
+    CROSS JOIN LATERAL (
+        SELECT coalesce(array_agg(DISTINCT key ORDER BY key), '{}') AS cols
+        FROM jsonb_array_elements(p.source_data->'data') AS m(elem),
+             jsonb_object_keys(CASE jsonb_typeof(m.elem) WHEN 'object' THEN m.elem
+                                    ELSE '{}'::jsonb END) AS key
+    ) c
+    WHERE p.id = ANY(CAST(:ids AS int[]))
+)
+UPDATE raw.raw_chat_stats t
+SET source_data = c.source_data
+FROM converted c
+WHERE t.id = c.id
+  AND NOT EXISTS (
+      SELECT 1 FROM raw.raw_chat_stats o
+      WHERE o.application_id IS NOT DISTINCT FROM c.application_id
+        AND o.endpoint = c.endpoint
+        AND o.payload_hash = md5(c.source_data::text)::uuid
+  )
+"""
+
+FLATTEN_COUNT_SQL = """
+WITH {history_rows}
+SELECT count(*) FROM history_rows WHERE message_id IS NOT NULL
+""".replace("{history_rows}", tb.HISTORY_ROWS_SQL.strip())
+
+
+def legacy_page_ids(conn, after: int, limit: int) -> list[int]:
+    return conn.execute(text(LEGACY_PAGES_SQL), {"after": after, "limit": limit}).scalars().all()
+
+
+def pages_size(conn, ids: list[int]) -> tuple[int, int, int]:
+    """(pages, JSON text bytes, stored bytes) of their source_data."""
+    return tuple(conn.execute(text(PAGES_SIZE_SQL), {"ids": ids}).fetchone())
+
+
+def to_columnar(conn, ids: list[int]) -> int:
+    """Rewrite the given legacy pages. Returns pages converted."""
+    return conn.execute(text(COLUMNAR_SQL), {"ids": ids}).rowcount
+
+
+def time_flatten(conn, tid: str) -> tuple[int, float]:
+    """(messages, seconds) of flattening every archived history page of a tenant."""
+    params = {"tid": tid, "default_tid": tb.TENANT_ID, "app_id": tb.APP_ID,
+              "since": tb.FULL_REBUILD_SINCE, "until": datetime.now(timezone.utc)}
+    start = time.perf_counter()
+    n = conn.execute(text(FLATTEN_COUNT_SQL), params).scalar()
+    return n, time.perf_counter() - start
+
+
+def _tenants(conn) -> list[str]:
+    return conn.execute(text("""
+        SELECT DISTINCT coalesce(tenant_id, :default_tid) FROM raw.raw_chat_stats
+        WHERE endpoint = '/v1/chat/history/csv'
+    """), {"default_tid": tb.TENANT_ID}).scalars().all()
+
+
+def report(conn, label: str) -> dict:
+    """Flatten timings per tenant (rows, seconds)."""
+    timings = {tid: time_flatten(conn, tid) for tid in _tenants(conn)}
+    for tid, (n, secs) in timings.items():
+        print(f"    {label:<9s} {tid:<20s} {n:>10,d} messages flattened in {secs:.2f}s")
+    return timings
+
+
+def print_comparison(before_size: tuple, after_size: tuple, pages: int,
+                     before: dict, after: dict):
+    print(f"\n{'=' * 60}")
+    print("  Columnar chat history — size / speed")
+    print(f"{'=' * 60}")
+    print(f"    Pages:    {pages:,}")
+    for label, b, a in zip(("JSON:", "Stored:"), before_size, after_size):
+        ratio = b / a if a else 0
+        print(f"    {label:<9s} {b / 1e6:,.1f} MB → {a / 1e6:,.1f} MB ({ratio:.1f}x smaller)")
+    for tid in before:
+        (n0, t0), (n1, t1) = before[tid], after.get(tid, (0, 0.0))
+        check = "" if n0 == n1 else f"  [WARN] {n0:,} vs {n1:,} messages"
+        speedup = t0 / t1 if t1 else 0
+        print(f"    Flatten:  {tid:<20s} {t0:.2f}s → {t1:.2f}s ({speedup:.1f}x){check}")
+    print(f"{'=' * 60}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate raw chat history pages to the columnar format")
+    parser.add_argument("--report", action="store_true",
+                        help="Measure size and flatten speed on a rolled-back migration; change nothing")
+    parser.add_argument("--batch-pages", type=int, default=500,
+                        help="Pages converted per transaction (default: 500)")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("  Migrate chat history pages → columnar")
+    if args.report:
+        print("  Mode: REPORT (rolled back)")
+    print("=" * 60)
+
+    if args.report:
+        with engine.connect() as conn:
+            with conn.begin() as tx:
+                ids = legacy_page_ids(conn, 0, 2**31 - 1)
+                if not ids:
+                    print("  No legacy pages left.")
+                    return 0
+                pages, *before_size = pages_size(conn, ids)
+                before = report(conn, "legacy")
+                converted = to_columnar(conn, ids)
+                _, *after_size = pages_size(conn, ids)
+                after = report(conn, "columnar")
+                tx.rollback()
+        print(f"\n  {converted:,} of {pages:,} legacy page(s) would be converted")
+        print_comparison(before_size, after_size, pages, before, after)
+        return 0
+
+    with engine.connect() as conn:
+        before = report(conn, "before")
+
+    start = time.time()
+    after_id, converted = 0, 0
+    total_before, total_after = [0, 0], [0, 0]
+    while True:
+        with engine.begin() as conn:
+            ids = legacy_page_ids(conn, after_id, max(1, args.batch_pages))
+            if not ids:
+                break
+            _, *before_size = pages_size(conn, ids)
+            converted += to_columnar(conn, ids)
+            _, *after_size = pages_size(conn, ids)
+        total_before = [t + b for t, b in zip(total_before, before_size)]
+        total_after = [t + a for t, a in zip(total_after, after_size)]
+        after_id = ids[-1]
+        print(f"  {converted:,} page(s) converted ({time.time() - start:.1f}s)", flush=True)
+
+    with engine.connect() as conn:
+        after = report(conn, "after")
+    print_comparison(total_before, total_after, converted, before, after)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""
+Maintenance of the raw.* page tables: monthly partitions, compaction, retention.
+
+The page tables (create_raw_schema.PAGE_TABLES) are range-partitioned by month
+of loaded_at. Every run creates the partitions for the current month and the
+next PARTITION_MONTHS_AHEAD (schedule it at least monthly); the options add:
+
+    --partition            one-time conversion of tables created before
+                           partitioning: each is rebuilt as a partitioned table
+                           in one transaction (ids and loaded_at kept, so the
+                           transform_bridge watermarks are unaffected)
+    --compact              collapse superseded pages: of the pages stored with a
+                           (window_key, page) position, only the newest payload
+                           per (application, tenant, endpoint, window_key, page)
+                           is kept — the one every "newest page wins" transform
+                           already reads
+    --retention-months N   drop the monthly partitions entirely older than N
+                           months (DROP TABLE, no DELETE); a partition holding
+                           pages newer than a transform watermark is kept
+
+A --full transform_bridge rebuild only re-flattens the pages still retained;
+public.* rows built from dropped pages stay as they are.
+
+Usage:
+    python scripts/raw_maintenance.py                        # create upcoming partitions
+    python scripts/raw_maintenance.py --partition            # convert pre-partitioning tables
+    python scripts/raw_maintenance.py --compact --retention-months 13
+    python scripts/raw_maintenance.py --compact --retention-months 13 --dry-run
+"""
+
+import argparse
+import re
+import sys
+import time as timer
+from datetime import date, datetime, time, timezone
+from pathlib import Path
+
+from sqlalchemy import text
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.models.database import engine
+from scripts import create_raw_schema as schema
+from scripts import transform_bridge as tb
+
+PARTITION_SUFFIX = re.compile(r"_p(\d{4})(\d{2})$")
+
+PARTITIONS_SQL = """
+SELECT c.relname
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = to_regclass(:table)
+ORDER BY c.relname
+"""
+
+# Every superseded page: a newer row holds the same position of the same listing
+SUPERSEDED_PAGES_SQL = """
+SELECT id, loaded_at FROM (
+    SELECT id, loaded_at,
+           row_number() OVER (
+               PARTITION BY application_id, tenant_id, endpoint, window_key, page
+               ORDER BY loaded_at DESC, id DESC
+           ) AS rn
+    FROM raw.{table}
+    WHERE page IS NOT NULL
+) pages
+WHERE rn > 1
+"""
+
+COMPACT_SQL = """
+DELETE FROM raw.{table} r
+USING ({superseded}) old
+WHERE r.id = old.id AND r.loaded_at = old.loaded_at
+"""
+
+# Oldest loaded_at watermark of any transform entity (None: nothing transformed yet)
+OLDEST_WATERMARK_SQL = """
+SELECT min(last_cursor::timestamptz) FROM public.sync_state
+WHERE entity = ANY(:entities) AND last_cursor IS NOT NULL
+"""
+
+
+def months_before(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 - n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_partitions(conn, table: str) -> list[tuple[str, date]]:
+    """(partition name, month) of raw.<table>'s monthly partitions, oldest first."""
+    parts = []
+    for name in conn.execute(text(PARTITIONS_SQL), {"table": f"raw.{table}"}).scalars().all():
+        match = PARTITION_SUFFIX.search(name)
+        if match:
+            parts.append((name, date(int(match[1]), int(match[2]), 1)))
+    return sorted(parts, key=lambda p: p[1])
+
+
+def partition_table(conn, table: str) -> int:
+    """Rebuild a plain raw.<table> as a monthly-partitioned table. Returns rows copied."""
+    conn.execute(text(schema.ADD_PAGE_COLUMNS.format(table=table)))
+    conn.execute(text(f"ALTER TABLE raw.{table} RENAME TO {table}_unpartitioned"))
+    conn.execute(text(f"ALTER SEQUENCE raw.{table}_id_seq RENAME TO {table}_unpartitioned_id_seq"))
+    # index and constraint names are per schema: free them for the new table
+    for index in conn.execute(text("""
+        SELECT indexname FROM pg_indexes WHERE schemaname = 'raw' AND tablename = :t
+    """), {"t": f"{table}_unpartitioned"}).scalars().all():
+        conn.execute(text(f'ALTER INDEX raw."{index}" RENAME TO "{index[:50]}_unpartitioned"'))
+
+    conn.execute(text(schema.PAGE_TABLE_DDL.format(table=table)))
+    first, last = conn.execute(text(f"""
+        SELECT min(loaded_at AT TIME ZONE 'UTC')::date, max(loaded_at AT TIME ZONE 'UTC')::date
+        FROM raw.{table}_unpartitioned
+    """)).fetchone()
+    months = schema.upcoming_months()
+    if first:
+        month = schema.month_start(first)
+        while month <= schema.month_start(last):
+            months.append(month)
+            month = schema.next_month(month)
+    schema.ensure_partitions(conn, table, sorted(set(months)))
+
+    columns = schema.PAGE_COLUMNS.replace("loaded_at", "coalesce(loaded_at, now())")
+    copied = conn.execute(text(f"""
+        INSERT INTO raw.{table} ({schema.PAGE_COLUMNS})
+        SELECT {columns} FROM raw.{table}_unpartitioned
+    """)).rowcount
+    conn.execute(text(f"""
+        SELECT setval(pg_get_serial_sequence('raw.{table}', 'id'),
+                      greatest((SELECT max(id) FROM raw.{table}), 1))
+    """))
+    conn.execute(text(f"DROP TABLE raw.{table}_unpartitioned"))
+    schema.create_indices(conn, [table])
+    return copied
+
+
+def compact(conn, table: str, dry_run: bool) -> int:
+    """Delete the superseded pages of raw.<table>. Returns pages removed (or removable)."""
+    superseded = SUPERSEDED_PAGES_SQL.format(table=table)
+    if dry_run:
+        return conn.execute(text(f"SELECT count(*) FROM ({superseded}) s")).scalar()
+    return conn.execute(text(COMPACT_SQL.format(table=table, superseded=superseded))).rowcount
+
+
+def expired_partitions(conn, table: str, retention_months: int,
+                       today: date | None = None) -> tuple[list[str], list[str]]:
+    """(partitions to drop, partitions kept back by a lagging transform watermark)."""
+    cutoff = months_before(schema.month_start(today or datetime.now(timezone.utc).date()),
+                           retention_months)
+    watermark = conn.execute(text(OLDEST_WATERMARK_SQL),
+                             {"entities": list(tb.ENTITY_SOURCES)}).scalar()
+    expired, held = [], []
+    for name, month in month_partitions(conn, table):
+        end = schema.next_month(month)
+        if end > cutoff:
+            continue
+        if watermark is not None and watermark < datetime.combine(end, time(), timezone.utc):
+            held.append(name)
+        else:
+            expired.append(name)
+    return expired, held
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Partitions, compaction and retention of raw.* page tables")
+    parser.add_argument("--partition", action="store_true",
+                        help="Convert page tables created before partitioning (one-time)")
+    parser.add_argument("--compact", action="store_true",
+                        help="Keep only the newest payload per (endpoint, window, page)")
+    parser.add_argument("--retention-months", type=int,
+                        help="Drop monthly partitions entirely older than N months")
+    parser.add_argument("--tables", help=f"Comma-separated subset of {','.join(schema.PAGE_TABLES)}")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Report what compaction/retention would remove; change nothing")
+    args = parser.parse_args()
+
+    tables = args.tables.split(",") if args.tables else schema.PAGE_TABLES
+    unknown = sorted(set(tables) - set(schema.PAGE_TABLES))
+    if unknown:
+        parser.error(f"not a page table: {', '.join(unknown)}")
+    if args.retention_months is not None and args.retention_months < 1:
+        parser.error("--retention-months must be at least 1")
+
+    print("=" * 60)
+    print("  Raw page tables — partitions / compaction / retention")
+    if args.dry_run:
+        print("  Mode: DRY RUN")
+    print("=" * 60)
+
+    errors = 0
+    for table in tables:
+        start = timer.time()
+        try:
+            with engine.begin() as conn:
+                if not schema.is_partitioned(conn, table):
+                    if not args.partition or args.dry_run:
+                        print(f"  [WARN] raw.{table} is not partitioned (use --partition)")
+                        continue
+                    copied = partition_table(conn, table)
+                    print(f"  raw.{table}: partitioned, {copied:,} rows copied")
+
+                created = [] if args.dry_run else schema.ensure_partitions(
+                    conn, table, schema.upcoming_months())
+                if created:
+                    print(f"  raw.{table}: created {', '.join(created)}")
+
+                if args.compact:
+                    removed = compact(conn, table, args.dry_run)
+                    verb = "removable" if args.dry_run else "removed"
+                    print(f"  raw.{table}: {removed:,} superseded page(s) {verb}")
+
+                if args.retention_months:
+                    expired, held = expired_partitions(conn, table, args.retention_months)
+                    for name in expired:
+                        if not args.dry_run:
+                            conn.execute(text(f"DROP TABLE raw.{name}"))
+                        print(f"  raw.{table}: {'would drop' if args.dry_run else 'dropped'} {name}")
+                    for name in held:
+                        print(f"  [WARN] raw.{table}: kept {name} — holds pages newer than "
+                              f"a transform_bridge watermark")
+            print(f"  raw.{table}: done ({timer.time() - start:.1f}s)")
+        except Exception as e:
+            errors += 1
+            print(f"  [ERROR] raw.{table}: {e}")
+
+    if args.compact and not args.dry_run:
+        print("\n  Compacted space is reused by new pages; VACUUM (or pg_repack) returns it to the OS.")
+    print("=" * 60)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+"""
+Reconcile public.messages against raw.chat_message_rows, one (tenant, day) at a time.
+
+For every tenant and message date, compares the row count and an
+order-independent checksum (sum of a 64-bit hash per row) of:
+
+    raw     the transform_bridge messages read of every landed message up to
+            the tenant's messages watermark — what a full rebuild would write
+    public  the rows currently in public.messages
+
+Only days whose count or checksum differ are repaired, in one transaction per
+tenant: public rows of those days that match no flattened row are deleted,
+the flattened rows of those days are upserted, and the messages post-steps
+(daily_stats, contacts, agents) are refreshed for the keys that changed.
+
+Days with public rows but no raw rows at all are reported, never repaired:
+repairing them would delete every message of the day, and the usual cause is a
+landing table that was not backfilled (scripts/land_chat_rows.py) rather than
+messages that should not exist.
+
+Usage:
+    python scripts/reconcile_messages.py                     # every tenant in sync_state
+    python scripts/reconcile_messages.py --tenants visionamos
+    python scripts/reconcile_messages.py --dry-run           # report drifted days only
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from sqlalchemy import text
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.models.database import engine
+from scripts import transform_bridge as tb
+
+# public.messages columns in the order the flatten query selects them
+MESSAGE_COLUMNS = [
+    "tenant_id", "message_id", "timestamp", "date", "hour", "day_of_week",
+    "send_type", "direction", "content_type", "status", "contact_name", "contact_id",
+    "conversation_id", "agent_id", "close_reason", "intent", "is_fallback",
+    "message_body", "is_bot", "is_human", "wait_time_seconds", "handle_time_seconds",
+]
+
+# Text form of a whole row — identical for a flattened row and the public row it
+# produced (int widths and text/varchar render the same).
+ROW_TEXT = "ROW({cols})::text"
+
+# 64-bit hash of one row; summing them (as numeric) is order-independent.
+ROW_HASH = "('x' || left(md5(" + ROW_TEXT + "), 16))::bit(64)::bigint"
+
+DAY_CHECKSUMS_SQL = """
+WITH src AS (
+{messages_sql}
+), raw_days AS (
+    SELECT date, count(*) AS n, sum({raw_hash}) AS checksum
+    FROM src s
+    GROUP BY date
+), public_days AS (
+    SELECT date, count(*) AS n, sum({public_hash}) AS checksum
+    FROM public.messages m
+    WHERE tenant_id = :tid
+    GROUP BY date
+)
+SELECT date, coalesce(r.n, 0) AS raw_rows, coalesce(p.n, 0) AS public_rows
+FROM raw_days r
+FULL JOIN public_days p USING (date)
+WHERE (r.n, r.checksum) IS DISTINCT FROM (p.n, p.checksum)
+ORDER BY date
+"""
+
+# day_rows is MATERIALIZED: inlined, the anti-join can re-run the whole
+# flatten once per public row.
+DELETE_STALE_SQL = """
+WITH src AS (
+{messages_sql}
+), day_rows AS MATERIALIZED (
+    SELECT md5({raw_text}) AS row_md5
+    FROM src s
+    WHERE date = ANY(CAST(:dates AS date[]))
+)
+DELETE FROM public.messages m
+WHERE m.tenant_id = :tid
+  AND m.date = ANY(CAST(:dates AS date[]))
+  AND NOT EXISTS (SELECT 1 FROM day_rows d WHERE d.row_md5 = md5({public_text}))
+RETURNING m.date, m.contact_id, m.agent_id
+"""
+
+DAY_MESSAGES_SQL = """
+SELECT * FROM (
+{messages_sql}
+) s
+WHERE date = ANY(CAST(:dates AS date[]))
+"""
+
+
+def _sql(template: str) -> str:
+    raw_cols = ", ".join(f"s.{c}" for c in MESSAGE_COLUMNS)
+    public_cols = ", ".join(f"m.{c}" for c in MESSAGE_COLUMNS)
+    return template.format(
+        messages_sql=tb.MESSAGES_SQL,
+        raw_hash=ROW_HASH.format(cols=raw_cols),
+        public_hash=ROW_HASH.format(cols=public_cols),
+        raw_text=ROW_TEXT.format(cols=raw_cols),
+        public_text=ROW_TEXT.format(cols=public_cols),
+    )
+
+
+def reconcile_params(conn, tid: str) -> dict | None:
+    """Full-history window up to the tenant's messages watermark (None if never transformed).
+
+    Raw pages past the watermark are not transformed yet; counting them would
+    report drift the next incremental run is about to fix.
+    """
+    until = tb.get_watermark(conn, tid, "messages")
+    if until is None:
+        return None
+    return {"tid": tid, "default_tid": tb.TENANT_ID, "app_id": tb.APP_ID,
+            "since": tb.FULL_REBUILD_SINCE, "until": until}
+
+
+def drifted_days(conn, params: dict) -> list:
+    """(date, raw_rows, public_rows) for every day whose count or checksum differs."""
+    return conn.execute(text(_sql(DAY_CHECKSUMS_SQL)), params).fetchall()
+
+
+def repair_days(conn, params: dict, dates: list) -> dict:
+    """Re-transform the given days. Returns {"deleted", "inserted", "updated", "refreshed"}."""
+    params = {**params, "dates": dates}
+    deleted = conn.execute(text(_sql(DELETE_STALE_SQL)), params).fetchall()
+    counts = tb.run_upsert(conn, _sql(DAY_MESSAGES_SQL), tb.MESSAGES_UPSERT, params,
+                           track=tb.MESSAGES_TRACK)
+
+    # Keys the deleted rows held need their aggregates refreshed too
+    touched = counts["touched"]
+    for date, contact_id, agent_id in deleted:
+        touched.setdefault("messages.date", set()).add(date)
+        if contact_id is not None:
+            touched.setdefault("messages.contact_id", set()).add(contact_id)
+        if agent_id is not None:
+            touched.setdefault("messages.agent_id", set()).add(agent_id)
+
+    # daily_stats_from_messages also registers new dates, which the deferred
+    # messages → daily_stats FK needs before this transaction commits.
+    refreshed = (tb.update_daily_stats_from_messages(conn, params["tid"], touched)
+                 + tb.update_contacts_from_messages(conn, params["tid"], touched)
+                 + tb.update_agents_messages(conn, params["tid"], touched))
+    return {"deleted": len(deleted), "inserted": counts["inserted"],
+            "updated": counts["updated"], "refreshed": refreshed}
+
+
+def reconcile_tenant(tid: str, dry_run: bool) -> dict | None:
+    """Check one tenant and repair its drifted days. Returns repair counts, or None on error."""
+    try:
+        with engine.connect() as conn:
+            params = reconcile_params(conn, tid)
+            if params is None:
+                print(f"  [{tid}] [SKIP] messages never transformed")
+                return {"days": 0}
+            start = time.time()
+            drift = drifted_days(conn, params)
+        print(f"  [{tid}] {len(drift)} drifted day(s) (checked in {time.time() - start:.1f}s)")
+        for day, raw_rows, public_rows in drift[:20]:
+            print(f"    {day}  raw {raw_rows:>7,d}  public {public_rows:>7,d}")
+        if len(drift) > 20:
+            print(f"    ... {len(drift) - 20} more")
+        unlanded = [d[0] for d in drift if d[1] == 0]
+        if unlanded:
+            print(f"  [{tid}] [WARN] {len(unlanded)} day(s) have no raw rows "
+                  f"({unlanded[0]} .. {unlanded[-1]}) — not repaired; "
+                  f"run scripts/land_chat_rows.py if the landing table was never backfilled")
+        repair = [d[0] for d in drift if d[1] > 0]
+        if not repair or dry_run:
+            return {"days": len(drift), "unlanded": len(unlanded)}
+
+        with engine.begin() as conn:
+            result = repair_days(conn, params, repair)
+            tb.update_sync_state(conn, tid, "reconcile_messages",
+                                 result["deleted"] + result["inserted"] + result["updated"])
+        print(f"  [{tid}] Repaired: {result['deleted']} deleted, {result['inserted']} inserted, "
+              f"{result['updated']} updated, {result['refreshed']} aggregate rows refreshed")
+        return {"days": len(repair), "unlanded": len(unlanded), **result}
+    except Exception as exc:
+        print(f"  [{tid}] [ERROR] {exc}")
+        try:
+            with engine.begin() as conn:
+                tb.update_sync_state(conn, tid, "reconcile_messages", 0, f"error: {str(exc)[:200]}")
+        except Exception:
+            pass
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile public.messages against raw chat history")
+    parser.add_argument("--tenants", default="",
+                        help="Comma-separated tenant ids (default: every tenant in sync_state)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only report drifted days, do not repair them")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("  Reconcile — public.messages vs raw chat history, per day")
+    if args.dry_run:
+        print("  Mode: DRY RUN (report only)")
+    print("=" * 60)
+
+    start = time.time()
+    with engine.connect() as conn:
+        tenants = ([t.strip() for t in args.tenants.split(",") if t.strip()]
+                   or tb.discover_tenants(conn))
+
+    results = {tid: reconcile_tenant(tid, args.dry_run) for tid in tenants}
+
+    print(f"\n{'=' * 60}")
+    print(f"  Reconcile Summary ({time.time() - start:.1f}s)")
+    print(f"{'=' * 60}")
+    for tid, result in results.items():
+        if result is None:
+            print(f"    {tid:<20s}  [ERROR]")
+            continue
+        unlanded = f", {result['unlanded']} without raw rows" if result.get("unlanded") else ""
+        if not result["days"]:
+            print(f"    {tid:<20s}  consistent")
+        elif "deleted" not in result:
+            print(f"    {tid:<20s}  {result['days']} drifted day(s){unlanded}")
+        else:
+            print(f"    {tid:<20s}  {result['days']} day(s) repaired{unlanded}")
+    print(f"{'=' * 60}")
+
+    return 0 if all(r is not None for r in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,6 +14,8 @@ Usage:
     python scripts/run_pipeline.py --skip-extract     # skip API extraction
     python scripts/run_pipeline.py --skip-dbt         # skip dbt run/test
     python scripts/run_pipeline.py --transform-only   # only transform step
+    python scripts/run_pipeline.py --tenants visionamos,coovimag
+    python scripts/run_pipeline.py --skip-extract --reconcile   # nightly consistency pass
 """
 
 import argparse
@@ -113,7 +115,14 @@ def main():
     parser.add_argument("--skip-dbt", action="store_true", help="Skip dbt run/test steps")
     parser.add_argument("--transform-only", action="store_true", help="Only run transform step")
     parser.add_argument("--full-refresh", action="store_true",
-                        help="Ignore incremental cursors — re-extract everything")
+                        help="Ignore incremental cursors and transform watermarks — "
+                             "re-extract and re-transform everything")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="After the transform, re-transform message days whose "
+                             "per-day checksum no longer matches raw")
+    parser.add_argument("--tenants", default="",
+                        help="Comma-separated tenant ids to extract and transform "
+                             "(default: every tenant in sync_state)")
     args = parser.parse_args()
 
     print("=" * 60)
@@ -132,6 +141,8 @@ def main():
         extract_cmd = [sys.executable, "-m", "scripts.extractors.orchestrator"]
         if args.full_refresh:
             extract_cmd.append("--full-refresh")
+        if args.tenants:
+            extract_cmd += ["--tenants", args.tenants]
         ok = run_step("extract", extract_cmd)
         if ok:
             steps_ok += 1
@@ -145,9 +156,17 @@ def main():
     print(f"\n{'─' * 60}")
     print("  STEP 2/5: Transform (raw.* → public.*)")
     print(f"{'─' * 60}")
-    ok = run_step("transform", [
-        sys.executable, str(PROJECT_ROOT / "scripts" / "transform_bridge.py")
-    ])
+    transform_cmd = [sys.executable, str(PROJECT_ROOT / "scripts" / "transform_bridge.py")]
+    if args.full_refresh:
+        transform_cmd.append("--full")
+    if args.tenants:
+        transform_cmd += ["--tenants", args.tenants]
+    ok = run_step("transform", transform_cmd)
+    if ok and args.reconcile:
+        reconcile_cmd = [sys.executable, str(PROJECT_ROOT / "scripts" / "reconcile_messages.py")]
+        if args.tenants:
+            reconcile_cmd += ["--tenants", args.tenants]
+        ok = run_step("reconcile", reconcile_cmd)
     if ok:
         steps_ok += 1
     else:
@@ -1,23 +1,51 @@
 """
 Phase 2c — Transform Bridge: raw.* JSONB → public.* structured tables.
 
-Reads flattened data from staging SQL (same logic as dbt stg_raw_* models)
-and UPSERTs into public.* tables matching app/models/schemas.py definitions.
+Each entity is a single server-side INSERT ... SELECT ... ON CONFLICT statement:
+the flatten query (same logic as dbt stg_raw_* models) feeds the UPSERT into
+public.* tables matching app/models/schemas.py definitions, so no rows travel
+through Python. Every DO UPDATE is guarded with IS DISTINCT FROM, so rows
+whose values did not change are not rewritten.
+
+Incremental: each entity keeps a high-watermark on raw loaded_at in
+public.sync_state.last_cursor and only flattens raw pages loaded since then.
+Raw pages are append-only and the newest page wins every dedup window, so
+deduplicating just the new pages gives the same result as a full rebuild.
+
+Chat messages and agent conversations are read from the typed landing tables
+raw.chat_message_rows / raw.chat_conversation_rows, which ChatExtractor upserts
+by id (loaded_at moves forward only when a record changes), so those transforms
+are an indexed range read instead of a JSONB scan. Pages landed before those
+tables existed are copied in by scripts/land_chat_rows.py.
+
+Entity transforms and post-transform steps form a dependency graph
+(TRANSFORM_GRAPH); independent nodes run concurrently on pooled connections.
+
+Tenants: every tenant found in public.sync_state (or --tenants a,b) gets its
+own watermarks, sync_state rows and graph run; tenants run in parallel worker
+processes. Raw rows with a NULL tenant_id belong to the default tenant
+(TENANT_ID).
 
 Usage:
     docker compose exec app python scripts/transform_bridge.py
     python scripts/transform_bridge.py          # local (requires .env)
+    python scripts/transform_bridge.py --full   # ignore watermarks, re-flatten all raw pages
+    python scripts/transform_bridge.py --parallelism 8   # run up to 8 independent nodes at once
+    python scripts/transform_bridge.py --batch-pages 200 # bound each statement to 200 raw pages
+    python scripts/transform_bridge.py --tenants visionamos,coovimag --parallelism 8
 
 Rules:
-    - tenant_id = 'visionamos' for all records
     - All timestamps stored as TIMESTAMPTZ (UTC)
     - NEVER deletes from raw.* tables
     - Idempotent — safe to re-run
 """
 
-import json as _json
+import argparse
 import sys
+import threading
 import time
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed, wait)
 from datetime import datetime, timezone
 from pathlib import Path
 
@@ -27,31 +55,212 @@ sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 from app.models.database import engine
 
+# Default tenant/app: raw rows loaded before extraction was tenant-aware have
+# a NULL tenant_id / application_id and belong to them.
 TENANT_ID = "visionamos"
 APP_ID = "100274"
 
+# Lower bound of the loaded_at window on a full rebuild (or first run)
+FULL_REBUILD_SINCE = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Default --lag-minutes: how far behind now() the run's loaded_at upper bound
+# stays (see main)
+WATERMARK_LAG_MINUTES = 5
+
 
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
 
-def update_sync_state(conn, entity: str, records: int, status: str = "success"):
-    """UPSERT sync_state for the given entity."""
+def update_sync_state(conn, tid: str, entity: str, records: int, status: str = "success",
+                      watermark: datetime | None = None):
+    """UPSERT sync_state for the given tenant and entity.
+
+    A watermark advances last_cursor; without one the stored cursor is kept
+    (errors must not move the watermark past pages that were never applied).
+    """
     conn.execute(text("""
-        INSERT INTO public.sync_state (tenant_id, entity, last_sync_at, records_synced, status)
-        VALUES (:tid, :entity, :ts, :records, :status)
+        INSERT INTO public.sync_state (tenant_id, entity, last_cursor, last_sync_at, records_synced, status)
+        VALUES (:tid, :entity, :cursor, :ts, :records, :status)
         ON CONFLICT (tenant_id, entity) DO UPDATE SET
+            last_cursor    = coalesce(EXCLUDED.last_cursor, sync_state.last_cursor),
             last_sync_at   = EXCLUDED.last_sync_at,
             records_synced = EXCLUDED.records_synced,
             status         = EXCLUDED.status
     """), {
-        "tid": TENANT_ID,
+        "tid": tid,
         "entity": entity,
+        "cursor": watermark.isoformat() if watermark else None,
         "ts": datetime.now(timezone.utc),
         "records": records,
         "status": status,
     })
 
+UPSERT_COUNTS_SQL = """
+WITH src AS (
+{select_sql}
+), upserted AS (
+{upsert_sql}
+RETURNING (xmax = 0) AS inserted{returning}
+)
+SELECT
+    count(*) FILTER (WHERE inserted)     AS inserted,
+    count(*) FILTER (WHERE NOT inserted) AS updated,
+    (SELECT count(*) FROM src) - count(*) AS unchanged{touched}
+FROM upserted
+"""
+
+# New values come from RETURNING; old values of updated rows are read from the
+# target itself, which sibling CTEs still see as of before the upsert.
+TOUCHED_KEYS_SQL = """,
+    ARRAY(
+        SELECT {col} FROM upserted WHERE {col} IS NOT NULL
+        UNION
+        SELECT t.{col} FROM {table} t JOIN upserted u USING ({keys})
+        WHERE NOT u.inserted AND t.{col} IS NOT NULL
+    ) AS {col}"""
+
+
+def run_upsert(conn, select_sql: str, upsert_sql: str, params: dict,
+               track: tuple[str, list[str], list[str]] | None = None) -> dict:
+    """Feed select_sql (as CTE `src`) into upsert_sql.
+
+    Returns {"inserted", "updated", "unchanged", "touched"}. Every DO UPDATE is
+    guarded with IS DISTINCT FROM, so a key whose values are already current is
+    neither rewritten nor returned: it counts as unchanged. xmax = 0 on a
+    returned row means it was freshly inserted.
+
+    track = (table, conflict key columns, columns) collects, per column, every
+    value held by an inserted or updated row before or after the upsert, into
+    touched["<table>.<column>"] — the keys post-transform aggregates must refresh.
+    """
+    returning = touched_sql = ""
+    if track:
+        table, keys, cols = track
+        returning = ", " + ", ".join(keys + [c for c in cols if c not in keys])
+        touched_sql = "".join(
+            TOUCHED_KEYS_SQL.format(col=c, table=table, keys=", ".join(keys)) for c in cols
+        )
+    sql = UPSERT_COUNTS_SQL.format(select_sql=select_sql, upsert_sql=upsert_sql.strip(),
+                                   returning=returning, touched=touched_sql)
+    row = conn.execute(text(sql), params).one()
+    touched = {}
+    if track:
+        name = table.split(".")[-1]
+        touched = {f"{name}.{c}": set(row[3 + i]) for i, c in enumerate(cols)}
+    return {"inserted": row[0], "updated": row[1], "unchanged": row[2], "touched": touched}
+
+
+def merge_counts(*counts: dict) -> dict:
+    """Sum run_upsert results (touched key sets are unioned)."""
+    merged = {"inserted": 0, "updated": 0, "unchanged": 0, "touched": {}}
+    for c in counts:
+        for k in ("inserted", "updated", "unchanged"):
+            merged[k] += c[k]
+        for k, keys in c["touched"].items():
+            merged["touched"].setdefault(k, set()).update(keys)
+    return merged
+
+
+def touched_keys(touched: dict | None, name: str) -> list | None:
+    """Keys a post-transform step must refresh; None means recompute everything."""
+    if touched is None:
+        return None
+    return sorted(touched.get(name, ()))
+
+
+def get_watermark(conn, tid: str, entity: str) -> datetime | None:
+    """Read the raw loaded_at high-watermark stored for a tenant's entity."""
+    row = conn.execute(text("""
+        SELECT last_cursor FROM public.sync_state
+        WHERE tenant_id = :tid AND entity = :entity
+    """), {"tid": tid, "entity": entity}).fetchone()
+    if not row or not row[0]:
+        return None
+    try:
+        return datetime.fromisoformat(row[0])
+    except ValueError:
+        return None  # not a transform watermark — treat as first run
+
+
+def window_params(conn, tid: str, entity: str, until: datetime, full: bool) -> dict:
+    """Bind parameters for one tenant's entity: tenant, app and its (since, until] loaded_at window."""
+    since = None if full else get_watermark(conn, tid, entity)
+    return {
+        "tid": tid,
+        "default_tid": TENANT_ID,
+        "app_id": APP_ID,
+        "since": since or FULL_REBUILD_SINCE,
+        "until": until,
+    }
+
+
+# Raw pages each entity flattens: (table, endpoint LIKE pattern or None, rows
+# per page). Used to cut a loaded_at window into --batch-pages sized batches;
+# the typed landing tables hold one row per record, so a "page" there is the
+# number of records an API page carries.
+ENTITY_SOURCES = {
+    "contacts":           ("raw.raw_contacts_api", None, 1),
+    "daily_stats":        ("raw.raw_push_stats",   "%/dateStats%", 1),
+    "toques_daily":       ("raw.raw_push_stats",   "%/dateStats%", 1),
+    "toques_heatmap":     ("raw.raw_push_stats",   "%/pushHeatmap%", 1),
+    "campaigns":          ("raw.raw_campaigns_api", None, 1),
+    "chat_conversations": ("raw.chat_conversation_rows", None, 100),
+    "chat_channels":      ("raw.raw_chat_stats",   "/v1/chat/channel", 1),
+    "chat_topics":        ("raw.raw_chat_stats",   "/v1/chat/topic", 1),
+    "agent_stubs":        ("raw.chat_message_rows", None, 1000),
+    "messages":           ("raw.chat_message_rows", None, 1000),
+}
+
+
+def batch_bounds(conn, params: dict, entity: str, batch_pages: int) -> list[datetime]:
+    """Upper loaded_at bounds splitting (since, until] into batches of ~batch_pages raw pages.
+
+    The newest page wins every dedup window, so applying the batches oldest
+    first gives the same rows as one statement over the whole window, while
+    each statement only sorts/hashes one batch of pages.
+    """
+    since, until = params["since"], params["until"]
+    source = ENTITY_SOURCES.get(entity)
+    if not batch_pages or not source:
+        return [until]
+    table, endpoint, rows_per_page = source
+    endpoint_filter = "AND endpoint LIKE :endpoint" if endpoint else ""
+    bounds = conn.execute(text(f"""
+        SELECT loaded_at FROM (
+            SELECT loaded_at, row_number() OVER (ORDER BY loaded_at) AS rn
+            FROM {table}
+            WHERE loaded_at > :since AND loaded_at <= :until
+              {endpoint_filter}
+              AND coalesce(tenant_id, :default_tid) = :tid
+        ) pages
+        WHERE mod(rn, :batch) = 0
+        ORDER BY loaded_at
+    """), {**params, "endpoint": endpoint, "batch": batch_pages * rows_per_page}).scalars().all()
+    return [b for b in dict.fromkeys(bounds) if b < until] + [until]
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process (VmHWM), in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+
+def reset_peak_rss():
+    """Reset VmHWM so the next peak_rss_mb() covers only what runs after this (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
 
 # ---------------------------------------------------------------------------
 # Transform: contacts
@@ -66,6 +275,8 @@ WITH raw_rows AS (
     FROM raw.raw_contacts_api
     WHERE source_data->'data' IS NOT NULL
       AND jsonb_typeof(source_data->'data') = 'array'
+      AND loaded_at > :since AND loaded_at <= :until
+      AND coalesce(tenant_id, :default_tid) = :tid
 ),
 flattened AS (
     SELECT
@@ -87,35 +298,28 @@ deduplicated AS (
         ) AS _rn
     FROM flattened
 )
-SELECT tenant_id, contact_id, contact_name, first_contact, last_contact
+SELECT tenant_id, contact_id, contact_name, 0 AS total_messages,
+       first_contact, last_contact, 0 AS total_conversations
 FROM deduplicated WHERE _rn = 1
 """
 
 CONTACTS_UPSERT = """
 INSERT INTO public.contacts
     (tenant_id, contact_id, contact_name, total_messages, first_contact, last_contact, total_conversations)
-VALUES
-    (:tenant_id, :contact_id, :contact_name, 0, :first_contact, :last_contact, 0)
+SELECT * FROM src
 ON CONFLICT (tenant_id, contact_id) DO UPDATE SET
     contact_name  = EXCLUDED.contact_name,
     first_contact = LEAST(contacts.first_contact, EXCLUDED.first_contact),
     last_contact  = GREATEST(contacts.last_contact, EXCLUDED.last_contact)
+WHERE (contacts.contact_name, contacts.first_contact, contacts.last_contact)
+      IS DISTINCT FROM
+      (EXCLUDED.contact_name, LEAST(contacts.first_contact, EXCLUDED.first_contact),
+       GREATEST(contacts.last_contact, EXCLUDED.last_contact))
 """
 
 
-def transform_contacts(conn) -> int:
-    rows = conn.execute(text(CONTACTS_SQL), {"tid": TENANT_ID}).fetchall()
-    count = 0
-    for r in rows:
-        conn.execute(text(CONTACTS_UPSERT), {
-            "tenant_id": r[0],
-            "contact_id": r[1],
-            "contact_name": r[2],
-            "first_contact": r[3],
-            "last_contact": r[4],
-        })
-        count += 1
-    return count
+def transform_contacts(conn, params: dict) -> dict:
+    return run_upsert(conn, CONTACTS_SQL, CONTACTS_UPSERT, params)
 
 
 # ---------------------------------------------------------------------------
@@ -133,6 +337,8 @@ WITH raw_rows AS (
     WHERE endpoint LIKE '%%/dateStats%%'
       AND source_data->'data' IS NOT NULL
       AND jsonb_typeof(source_data->'data') = 'array'
+      AND loaded_at > :since AND loaded_at <= :until
+      AND coalesce(tenant_id, :default_tid) = :tid
 ),
 flattened AS (
     SELECT
@@ -158,7 +364,14 @@ deduplicated AS (
         ) AS _rn
     FROM flattened
 )
-SELECT tenant_id, date, canal, proyecto_cuenta, enviados, entregados, abiertos, clicks
+SELECT
+    tenant_id, date, canal, proyecto_cuenta,
+    enviados, entregados, clicks, 0 AS chunks, 0 AS usuarios_unicos,
+    abiertos, 0 AS rebotes, 0 AS bloqueados, 0 AS spam, 0 AS desuscritos, 0 AS conversiones,
+    CASE WHEN enviados > 0 THEN round(clicks::numeric / enviados * 100, 2) ELSE 0 END     AS ctr,
+    CASE WHEN enviados > 0 THEN round(entregados::numeric / enviados * 100, 2) ELSE 0 END AS tasa_entrega,
+    CASE WHEN entregados > 0 THEN round(abiertos::numeric / entregados * 100, 2) ELSE 0 END AS open_rate,
+    0 AS conversion_rate
 FROM deduplicated WHERE _rn = 1
 """
 
@@ -168,11 +381,7 @@ INSERT INTO public.toques_daily
      enviados, entregados, clicks, chunks, usuarios_unicos,
      abiertos, rebotes, bloqueados, spam, desuscritos, conversiones,
      ctr, tasa_entrega, open_rate, conversion_rate)
-VALUES
-    (:tenant_id, :date, :canal, :proyecto_cuenta,
-     :enviados, :entregados, :clicks, 0, 0,
-     :abiertos, 0, 0, 0, 0, 0,
-     :ctr, :tasa_entrega, :open_rate, 0)
+SELECT * FROM src
 ON CONFLICT (tenant_id, date, canal, proyecto_cuenta) DO UPDATE SET
     enviados     = EXCLUDED.enviados,
     entregados   = EXCLUDED.entregados,
@@ -181,36 +390,22 @@ ON CONFLICT (tenant_id, date, canal, proyecto_cuenta) DO UPDATE SET
     ctr          = EXCLUDED.ctr,
     tasa_entrega = EXCLUDED.tasa_entrega,
     open_rate    = EXCLUDED.open_rate
+WHERE (toques_daily.enviados, toques_daily.entregados, toques_daily.clicks,
+       toques_daily.abiertos, toques_daily.ctr, toques_daily.tasa_entrega,
+       toques_daily.open_rate)
+      IS DISTINCT FROM
+      (EXCLUDED.enviados, EXCLUDED.entregados, EXCLUDED.clicks, EXCLUDED.abiertos,
+       EXCLUDED.ctr, EXCLUDED.tasa_entrega, EXCLUDED.open_rate)
 """
 
 
-def transform_toques_daily(conn) -> int:
-    rows = conn.execute(text(TOQUES_DAILY_SQL), {"tid": TENANT_ID, "app_id": APP_ID}).fetchall()
-    count = 0
-    for r in rows:
-        enviados = r[4]
-        entregados = r[5]
-        abiertos = r[6]
-        clicks = r[7]
-        ctr = round(clicks / enviados * 100, 2) if enviados > 0 else 0
-        tasa_entrega = round(entregados / enviados * 100, 2) if enviados > 0 else 0
-        open_rate = round(abiertos / entregados * 100, 2) if entregados > 0 else 0
-
-        conn.execute(text(TOQUES_DAILY_UPSERT), {
-            "tenant_id": r[0],
-            "date": r[1],
-            "canal": r[2],
-            "proyecto_cuenta": r[3],
-            "enviados": enviados,
-            "entregados": entregados,
-            "clicks": clicks,
-            "abiertos": abiertos,
-            "ctr": ctr,
-            "tasa_entrega": tasa_entrega,
-            "open_rate": open_rate,
-        })
-        count += 1
-    return count
+# Dates refreshed by daily_stats_totals
+TOQUES_DAILY_TRACK = ("public.toques_daily", ["tenant_id", "date", "canal", "proyecto_cuenta"], ["date"])
+
+
+def transform_toques_daily(conn, params: dict) -> dict:
+    return run_upsert(conn, TOQUES_DAILY_SQL, TOQUES_DAILY_UPSERT, params,
+                      track=TOQUES_DAILY_TRACK)
 
 
 # ---------------------------------------------------------------------------
@@ -227,6 +422,8 @@ WITH raw_rows AS (
     WHERE endpoint LIKE '%%/pushHeatmap%%'
       AND source_data->'data' IS NOT NULL
       AND jsonb_typeof(source_data->'data') = 'object'
+      AND loaded_at > :since AND loaded_at <= :until
+      AND coalesce(tenant_id, :default_tid) = :tid
 ),
 latest AS (
     SELECT *,
@@ -263,35 +460,26 @@ flattened AS (
     FROM weekday_entries w,
          jsonb_each(w.weekday_val) AS h(hour_key, hour_val)
 )
-SELECT tenant_id, canal, dia_semana, hora, ctr, dia_orden
+SELECT tenant_id, canal, dia_semana, hora,
+       0 AS enviados, 0 AS clicks, 0 AS abiertos, 0 AS conversiones, ctr, dia_orden
 FROM flattened
 """
 
 HEATMAP_UPSERT = """
 INSERT INTO public.toques_heatmap
     (tenant_id, canal, dia_semana, hora, enviados, clicks, abiertos, conversiones, ctr, dia_orden)
-VALUES
-    (:tenant_id, :canal, :dia_semana, :hora, 0, 0, 0, 0, :ctr, :dia_orden)
+SELECT * FROM src
 ON CONFLICT (tenant_id, canal, dia_semana, hora) DO UPDATE SET
     ctr       = EXCLUDED.ctr,
     dia_orden = EXCLUDED.dia_orden
+WHERE (toques_heatmap.ctr, toques_heatmap.dia_orden)
+      IS DISTINCT FROM
+      (EXCLUDED.ctr, EXCLUDED.dia_orden)
 """
 
 
-def transform_heatmap(conn) -> int:
-    rows = conn.execute(text(HEATMAP_SQL), {"tid": TENANT_ID}).fetchall()
-    count = 0
-    for r in rows:
-        conn.execute(text(HEATMAP_UPSERT), {
-            "tenant_id": r[0],
-            "canal": r[1],
-            "dia_semana": r[2],
-            "hora": int(r[3]),
-            "ctr": float(r[4]),
-            "dia_orden": int(r[5]),
-        })
-        count += 1
-    return count
+def transform_heatmap(conn, params: dict) -> dict:
+    return run_upsert(conn, HEATMAP_SQL, HEATMAP_UPSERT, params)
 
 
 # ---------------------------------------------------------------------------
@@ -307,6 +495,8 @@ WITH raw_rows AS (
     FROM raw.raw_campaigns_api
     WHERE source_data->'data' IS NOT NULL
       AND jsonb_typeof(source_data->'data') = 'array'
+      AND loaded_at > :since AND loaded_at <= :until
+      AND coalesce(tenant_id, :default_tid) = :tid
 ),
 flattened AS (
     SELECT
@@ -340,10 +530,20 @@ deduplicated AS (
     FROM flattened
     WHERE campana_id IS NOT NULL
 )
-SELECT tenant_id, campana_id, campana_nombre, canal, proyecto_cuenta, tipo_campana,
-       total_enviados, total_entregados, total_clicks, fecha_inicio, fecha_fin,
-       total_abiertos, total_rebotes, total_bloqueados, total_spam,
-       total_desuscritos, total_conversiones
+SELECT
+    tenant_id, campana_id, campana_nombre, canal, proyecto_cuenta, tipo_campana,
+    total_enviados, total_entregados, total_clicks, 0 AS total_chunks,
+    fecha_inicio, fecha_fin,
+    total_abiertos, total_rebotes, total_bloqueados, total_spam,
+    total_desuscritos, total_conversiones,
+    CASE WHEN total_enviados > 0
+        THEN round(total_clicks::numeric / total_enviados * 100, 2) ELSE 0 END       AS ctr,
+    CASE WHEN total_enviados > 0
+        THEN round(total_entregados::numeric / total_enviados * 100, 2) ELSE 0 END   AS tasa_entrega,
+    CASE WHEN total_entregados > 0
+        THEN round(total_abiertos::numeric / total_entregados * 100, 2) ELSE 0 END   AS open_rate,
+    CASE WHEN total_clicks > 0
+        THEN round(total_conversiones::numeric / total_clicks * 100, 2) ELSE 0 END   AS conversion_rate
 FROM deduplicated WHERE _rn = 1
 """
 
@@ -355,13 +555,7 @@ INSERT INTO public.campaigns
      total_abiertos, total_rebotes, total_bloqueados, total_spam,
      total_desuscritos, total_conversiones,
      ctr, tasa_entrega, open_rate, conversion_rate)
-VALUES
-    (:tenant_id, :campana_id, :campana_nombre, :canal, :proyecto_cuenta, :tipo_campana,
-     :total_enviados, :total_entregados, :total_clicks, 0,
-     :fecha_inicio, :fecha_fin,
-     :total_abiertos, :total_rebotes, :total_bloqueados, :total_spam,
-     :total_desuscritos, :total_conversiones,
-     :ctr, :tasa_entrega, :open_rate, :conversion_rate)
+SELECT * FROM src
 ON CONFLICT (tenant_id, campana_id) DO UPDATE SET
     campana_nombre    = EXCLUDED.campana_nombre,
     canal             = EXCLUDED.canal,
@@ -382,49 +576,25 @@ ON CONFLICT (tenant_id, campana_id) DO UPDATE SET
     tasa_entrega      = EXCLUDED.tasa_entrega,
     open_rate         = EXCLUDED.open_rate,
     conversion_rate   = EXCLUDED.conversion_rate
+WHERE (campaigns.campana_nombre, campaigns.canal, campaigns.proyecto_cuenta,
+       campaigns.tipo_campana, campaigns.total_enviados, campaigns.total_entregados,
+       campaigns.total_clicks, campaigns.fecha_inicio, campaigns.fecha_fin,
+       campaigns.total_abiertos, campaigns.total_rebotes, campaigns.total_bloqueados,
+       campaigns.total_spam, campaigns.total_desuscritos, campaigns.total_conversiones,
+       campaigns.ctr, campaigns.tasa_entrega, campaigns.open_rate,
+       campaigns.conversion_rate)
+      IS DISTINCT FROM
+      (EXCLUDED.campana_nombre, EXCLUDED.canal, EXCLUDED.proyecto_cuenta,
+       EXCLUDED.tipo_campana, EXCLUDED.total_enviados, EXCLUDED.total_entregados,
+       EXCLUDED.total_clicks, EXCLUDED.fecha_inicio, EXCLUDED.fecha_fin,
+       EXCLUDED.total_abiertos, EXCLUDED.total_rebotes, EXCLUDED.total_bloqueados,
+       EXCLUDED.total_spam, EXCLUDED.total_desuscritos, EXCLUDED.total_conversiones,
+       EXCLUDED.ctr, EXCLUDED.tasa_entrega, EXCLUDED.open_rate, EXCLUDED.conversion_rate)
 """
 
 
-def transform_campaigns(conn) -> int:
-    rows = conn.execute(text(CAMPAIGNS_SQL), {"tid": TENANT_ID, "app_id": APP_ID}).fetchall()
-    count = 0
-    for r in rows:
-        enviados = r[6]
-        entregados = r[7]
-        clicks = r[8]
-        abiertos = r[11]
-        conversiones = r[16]
-
-        ctr = round(clicks / enviados * 100, 2) if enviados > 0 else 0
-        tasa_entrega = round(entregados / enviados * 100, 2) if enviados > 0 else 0
-        open_rate = round(abiertos / entregados * 100, 2) if entregados > 0 else 0
-        conversion_rate = round(conversiones / clicks * 100, 2) if clicks > 0 else 0
-
-        conn.execute(text(CAMPAIGNS_UPSERT), {
-            "tenant_id": r[0],
-            "campana_id": r[1],
-            "campana_nombre": r[2],
-            "canal": r[3],
-            "proyecto_cuenta": r[4],
-            "tipo_campana": r[5],
-            "total_enviados": enviados,
-            "total_entregados": entregados,
-            "total_clicks": clicks,
-            "fecha_inicio": r[9],
-            "fecha_fin": r[10],
-            "total_abiertos": abiertos,
-            "total_rebotes": r[12],
-            "total_bloqueados": r[13],
-            "total_spam": r[14],
-            "total_desuscritos": r[15],
-            "total_conversiones": conversiones,
-            "ctr": ctr,
-            "tasa_entrega": tasa_entrega,
-            "open_rate": open_rate,
-            "conversion_rate": conversion_rate,
-        })
-        count += 1
-    return count
+def transform_campaigns(conn, params: dict) -> dict:
+    return run_upsert(conn, CAMPAIGNS_SQL, CAMPAIGNS_UPSERT, params)
 
 
 # ---------------------------------------------------------------------------
@@ -441,6 +611,8 @@ WITH raw_dates AS (
     WHERE endpoint LIKE '%%/dateStats%%'
       AND source_data->'data' IS NOT NULL
       AND jsonb_typeof(source_data->'data') = 'array'
+      AND loaded_at > :since AND loaded_at <= :until
+      AND coalesce(tenant_id, :default_tid) = :tid
       AND elem->>'statsDate' IS NOT NULL
 )
 SELECT
@@ -454,111 +626,168 @@ FROM raw_dates
 GROUP BY tenant_id, stats_date::date
 """
 
+# The counters are owned by the post-transform steps (daily_stats_totals,
+# daily_stats_from_messages); this entity only registers new dates. Resetting
+# them to 0 here would rewrite every date on each run just to recompute it.
 DAILY_STATS_UPSERT = """
 INSERT INTO public.daily_stats
     (tenant_id, date, total_messages, unique_contacts, conversations, fallback_count)
-VALUES
-    (:tenant_id, :date, :total_messages, :unique_contacts, :conversations, :fallback_count)
-ON CONFLICT (tenant_id, date) DO UPDATE SET
-    total_messages  = EXCLUDED.total_messages,
-    unique_contacts = EXCLUDED.unique_contacts,
-    conversations   = EXCLUDED.conversations,
-    fallback_count  = EXCLUDED.fallback_count
+SELECT * FROM src
+ON CONFLICT (tenant_id, date) DO NOTHING
 """
 
 
-def transform_daily_stats(conn) -> int:
-    rows = conn.execute(text(DAILY_STATS_SQL), {"tid": TENANT_ID}).fetchall()
-    count = 0
-    for r in rows:
-        conn.execute(text(DAILY_STATS_UPSERT), {
-            "tenant_id": r[0],
-            "date": r[1],
-            "total_messages": r[2],
-            "unique_contacts": r[3],
-            "conversations": r[4],
-            "fallback_count": r[5],
-        })
-        count += 1
-    return count
+def transform_daily_stats(conn, params: dict) -> dict:
+    return run_upsert(conn, DAILY_STATS_SQL, DAILY_STATS_UPSERT, params)
 
 
 # ---------------------------------------------------------------------------
 # Post-transform: update daily_stats totals from toques_daily
 # ---------------------------------------------------------------------------
 
+# total_messages = max(toques_daily enviados, chat messages) for the date; both
+# daily_stats steps compute the same value, so each can refresh only its own
+# touched dates in any order.
 DAILY_STATS_UPDATE_TOTALS = """
 UPDATE public.daily_stats ds SET
-    total_messages = sub.total_enviados
+    total_messages = sub.total_messages
 FROM (
-    SELECT tenant_id, date, coalesce(sum(enviados), 0) AS total_enviados
-    FROM public.toques_daily
-    WHERE tenant_id = :tid
-    GROUP BY tenant_id, date
+    SELECT
+        td.tenant_id,
+        td.date,
+        GREATEST(coalesce(sum(td.enviados), 0),
+                 (SELECT count(*) FROM public.messages m
+                  WHERE m.tenant_id = td.tenant_id AND m.date = td.date)) AS total_messages
+    FROM public.toques_daily td
+    WHERE td.tenant_id = :tid
+      AND (CAST(:dates AS date[]) IS NULL OR td.date = ANY(CAST(:dates AS date[])))
+    GROUP BY td.tenant_id, td.date
 ) sub
 WHERE ds.tenant_id = sub.tenant_id AND ds.date = sub.date
+  AND ds.total_messages IS DISTINCT FROM sub.total_messages
 """
 
 
-def update_daily_stats_totals(conn) -> int:
-    result = conn.execute(text(DAILY_STATS_UPDATE_TOTALS), {"tid": TENANT_ID})
+def update_daily_stats_totals(conn, tid: str, touched: dict | None = None) -> int:
+    dates = touched_keys(touched, "toques_daily.date")
+    if dates == []:
+        return 0
+    result = conn.execute(text(DAILY_STATS_UPDATE_TOTALS), {"tid": tid, "dates": dates})
     return result.rowcount
 
 
 # ---------------------------------------------------------------------------
-# Transform: messages (from chat/history/csv stored in raw.raw_chat_stats)
+# Chat history JSONB archive (/v1/chat/history/csv in raw.raw_chat_stats)
 # ---------------------------------------------------------------------------
 
-MESSAGES_SQL = """
-WITH raw_rows AS (
+# The transforms read the typed raw.chat_message_rows; the archived pages are
+# only read to (re)land them (scripts/land_chat_rows.py) and by the columnar
+# migration report. CSV columns, by the alias history_rows gives them.
+HISTORY_FIELDS = {
+    "message_id": "messageId",
+    "message_date": "messageDate",
+    "send_type": "sendType",
+    "content_type": "contentType",
+    "status": "status",
+    "profile_name": "profileName",
+    "contact_id": "contactId",
+    "conversation_id": "agentConversationId",
+    "agent_id": "agentId",
+    "close_reason": "agentCloseReason",
+    "intent": "dfIntentName",
+    "is_fallback": "isFallback",
+    "message_body": "content",
+    "integration": "integration",
+    "channel": "channel",
+}
+
+# One row per message, text columns named as in HISTORY_FIELDS, from both page
+# formats: legacy pages hold one JSON object per message under "data";
+# columnar pages (format "columnar") hold the CSV header under "columns" and
+# one array per message under "rows", read by position. Positions are looked
+# up once per page (raw_history is MATERIALIZED so they are not re-derived
+# per message).
+HISTORY_ROWS_SQL = """
+raw_history AS MATERIALIZED (
     SELECT
-        source_data,
-        coalesce(tenant_id, :tid) AS tenant_id,
-        loaded_at
-    FROM raw.raw_chat_stats
-    WHERE endpoint = '/v1/chat/history/csv'
-      AND source_data->'data' IS NOT NULL
-      AND jsonb_typeof(source_data->'data') = 'array'
+        p.source_data,
+        p.tenant_id,
+        p.application_id,
+        p.loaded_at,
+        {positions}
+    FROM (
+        SELECT
+            source_data,
+            coalesce(tenant_id, :tid) AS tenant_id,
+            application_id,
+            loaded_at,
+            ARRAY(SELECT jsonb_array_elements_text(source_data->'columns')) AS cols
+        FROM raw.raw_chat_stats
+        WHERE endpoint = '/v1/chat/history/csv'
+          AND (jsonb_typeof(source_data->'data') = 'array'
+               OR jsonb_typeof(source_data->'rows') = 'array')
+          AND loaded_at > :since AND loaded_at <= :until
+          AND coalesce(tenant_id, :default_tid) = :tid
+    ) p
 ),
-flattened AS (
-    SELECT
-        r.tenant_id,
-        elem->>'messageId'                              AS message_id,
-        (elem->>'messageDate')::timestamptz             AS msg_timestamp,
-        (elem->>'messageDate')::timestamptz::date       AS msg_date,
-        EXTRACT(HOUR FROM (elem->>'messageDate')::timestamptz)::smallint AS msg_hour,
-        TRIM(TO_CHAR((elem->>'messageDate')::timestamptz, 'Day')) AS day_of_week,
-        elem->>'sendType'                               AS send_type,
-        elem->>'contentType'                            AS content_type,
-        elem->>'status'                                 AS status,
-        elem->>'profileName'                            AS contact_name,
-        elem->>'contactId'                              AS contact_id,
-        elem->>'agentConversationId'                    AS conversation_id,
-        elem->>'agentId'                                AS agent_id,
-        elem->>'agentCloseReason'                       AS close_reason,
-        elem->>'dfIntentName'                           AS intent,
-        CASE WHEN elem->>'isFallback' = 'Yes' THEN TRUE ELSE FALSE END AS is_fallback,
-        elem->>'content'                                AS message_body,
-        elem->>'integration'                            AS integration,
-        elem->>'channel'                                AS channel,
-        r.loaded_at
-    FROM raw_rows r,
+history_rows AS (
+    SELECT r.tenant_id, r.application_id, r.loaded_at,
+        {object_fields}
+    FROM raw_history r,
          jsonb_array_elements(r.source_data->'data') AS elem
-    WHERE elem->>'messageId' IS NOT NULL
-),
-deduplicated AS (
-    SELECT *,
-        row_number() OVER (
-            PARTITION BY tenant_id, message_id
-            ORDER BY loaded_at DESC
-        ) AS _rn
-    FROM flattened
+    WHERE jsonb_typeof(r.source_data->'data') = 'array'
+    UNION ALL
+    SELECT r.tenant_id, r.application_id, r.loaded_at,
+        {array_fields}
+    FROM raw_history r,
+         jsonb_array_elements(r.source_data->'rows') AS msg
+    WHERE jsonb_typeof(r.source_data->'rows') = 'array'
+)""".format(
+    positions=",\n        ".join(f"array_position(p.cols, '{col}') - 1 AS pos_{alias}"
+                                 for alias, col in HISTORY_FIELDS.items()),
+    object_fields=",\n        ".join(f"elem->>'{col}' AS {alias}" for alias, col in HISTORY_FIELDS.items()),
+    array_fields=",\n        ".join(f"msg->>r.pos_{alias} AS {alias}" for alias in HISTORY_FIELDS),
 )
-SELECT tenant_id, message_id, msg_timestamp, msg_date, msg_hour, day_of_week,
-       send_type, content_type, status, contact_name, contact_id,
-       conversation_id, agent_id, close_reason, intent, is_fallback,
-       message_body, integration, channel
-FROM deduplicated WHERE _rn = 1
+
+
+# ---------------------------------------------------------------------------
+# Transform: messages (from raw.chat_message_rows, landed by ChatExtractor)
+# ---------------------------------------------------------------------------
+
+MESSAGES_SQL = """
+SELECT
+    m.tenant_id,
+    m.message_id,
+    m.message_at                                            AS timestamp,
+    m.message_at::date                                      AS date,
+    coalesce(EXTRACT(HOUR FROM m.message_at)::smallint, 0)  AS hour,
+    left(coalesce(nullif(TRIM(TO_CHAR(m.message_at, 'Day')), ''), 'Unknown'), 10) AS day_of_week,
+    left(nullif(m.send_type, ''), 30)                       AS send_type,
+    CASE
+        WHEN m.send_type = 'input'              THEN 'Inbound'
+        WHEN m.send_type = 'operator'           THEN 'Agent'
+        WHEN m.send_type = 'dialogflow'         THEN 'Bot'
+        WHEN m.send_type = 'agent_notification' THEN 'System'
+        WHEN m.integration = 'df'               THEN 'Bot'
+        ELSE 'Outbound'
+    END                                                     AS direction,
+    left(nullif(m.content_type, ''), 30)                    AS content_type,
+    left(nullif(m.status, ''), 20)                          AS status,
+    m.profile_name                                          AS contact_name,
+    m.contact_id,
+    nullif(m.conversation_id, '')                           AS conversation_id,
+    nullif(m.agent_id, '')                                  AS agent_id,
+    m.close_reason,
+    m.intent,
+    m.is_fallback,
+    m.message_body,
+    coalesce(m.integration = 'df' AND m.send_type IS DISTINCT FROM 'input', FALSE) AS is_bot,
+    coalesce(m.send_type = 'operator', FALSE)               AS is_human,
+    NULL::int                                               AS wait_time_seconds,
+    NULL::int                                               AS handle_time_seconds
+FROM raw.chat_message_rows m
+WHERE m.tenant_id = :tid
+  AND m.loaded_at > :since AND m.loaded_at <= :until
 """
 
 MESSAGES_UPSERT = """
@@ -567,11 +796,7 @@ INSERT INTO public.messages
      send_type, direction, content_type, status, contact_name, contact_id,
      conversation_id, agent_id, close_reason, intent, is_fallback,
      message_body, is_bot, is_human, wait_time_seconds, handle_time_seconds)
-VALUES
-    (:tenant_id, :message_id, :timestamp, :date, :hour, :day_of_week,
-     :send_type, :direction, :content_type, :status, :contact_name, :contact_id,
-     :conversation_id, :agent_id, :close_reason, :intent, :is_fallback,
-     :message_body, :is_bot, :is_human, NULL, NULL)
+SELECT * FROM src
 ON CONFLICT (tenant_id, message_id) DO UPDATE SET
     send_type     = EXCLUDED.send_type,
     direction     = EXCLUDED.direction,
@@ -587,105 +812,53 @@ ON CONFLICT (tenant_id, message_id) DO UPDATE SET
     message_body  = EXCLUDED.message_body,
     is_bot        = EXCLUDED.is_bot,
     is_human      = EXCLUDED.is_human
+WHERE (messages.send_type, messages.direction, messages.content_type, messages.status,
+       messages.contact_name, messages.contact_id, messages.conversation_id,
+       messages.agent_id, messages.close_reason, messages.intent, messages.is_fallback,
+       messages.message_body, messages.is_bot, messages.is_human)
+      IS DISTINCT FROM
+      (EXCLUDED.send_type, EXCLUDED.direction, EXCLUDED.content_type, EXCLUDED.status,
+       EXCLUDED.contact_name, EXCLUDED.contact_id, EXCLUDED.conversation_id,
+       EXCLUDED.agent_id, EXCLUDED.close_reason, EXCLUDED.intent, EXCLUDED.is_fallback,
+       EXCLUDED.message_body, EXCLUDED.is_bot, EXCLUDED.is_human)
 """
 
 
-def _derive_direction(send_type: str, integration: str, channel: str) -> str:
-    """Derive message direction from sendType + integration fields."""
-    if send_type == "input":
-        return "Inbound"
-    elif send_type == "operator":
-        return "Agent"
-    elif send_type == "dialogflow":
-        return "Bot"
-    elif send_type == "agent_notification":
-        return "System"
-    elif integration == "df":
-        return "Bot"
-    return "Outbound"
-
-
-def transform_messages(conn) -> int:
-    rows = conn.execute(text(MESSAGES_SQL), {"tid": TENANT_ID}).fetchall()
-    count = 0
-    for r in rows:
-        send_type = r[6] or ""
-        integration = r[17] or ""
-        channel = r[18] or ""
-        direction = _derive_direction(send_type, integration, channel)
-        is_bot = integration == "df" and send_type != "input"
-        is_human = send_type == "operator"
-
-        conn.execute(text(MESSAGES_UPSERT), {
-            "tenant_id": r[0],
-            "message_id": str(r[1]),
-            "timestamp": r[2],
-            "date": r[3],
-            "hour": int(r[4]) if r[4] is not None else 0,
-            "day_of_week": (r[5] or "Unknown")[:10],
-            "send_type": send_type[:30] if send_type else None,
-            "direction": direction,
-            "content_type": (r[7] or "")[:30] if r[7] else None,
-            "status": (r[8] or "")[:20] if r[8] else None,
-            "contact_name": r[9],
-            "contact_id": r[10],
-            "conversation_id": str(r[11]) if r[11] else None,
-            "agent_id": str(r[12]) if r[12] else None,
-            "close_reason": r[13],
-            "intent": r[14],
-            "is_fallback": r[15],
-            "message_body": r[16],
-            "is_bot": is_bot,
-            "is_human": is_human,
-        })
-        count += 1
-    return count
+# Keys refreshed by daily_stats_from_messages, contacts_enrichment, agents_total_messages
+MESSAGES_TRACK = ("public.messages", ["tenant_id", "message_id"], ["date", "contact_id", "agent_id"])
+
+
+def transform_messages(conn, params: dict) -> dict:
+    """direction / is_bot / is_human are derived in SQL from sendType + integration."""
+    return run_upsert(conn, MESSAGES_SQL, MESSAGES_UPSERT, params, track=MESSAGES_TRACK)
 
 
 # ---------------------------------------------------------------------------
-# Transform: chat_conversations (from agent/conversations in raw.raw_chat_stats)
+# Transform: chat_conversations (from raw.chat_conversation_rows, landed by ChatExtractor)
 # ---------------------------------------------------------------------------
 
 CONVERSATIONS_SQL = """
-WITH raw_rows AS (
-    SELECT
-        source_data,
-        coalesce(tenant_id, :tid) AS tenant_id,
-        loaded_at
-    FROM raw.raw_chat_stats
-    WHERE endpoint = '/v1/chat/agent/conversations'
-      AND source_data->'data' IS NOT NULL
-      AND jsonb_typeof(source_data->'data') = 'array'
-),
-flattened AS (
-    SELECT
-        r.tenant_id,
-        (elem->>'agentSessionId')::text                 AS session_id,
-        (elem->>'conversationSessionId')::text          AS conversation_session_id,
-        elem->>'contactId'                              AS contact_id,
-        (elem->>'agentId')::text                        AS agent_id,
-        elem->>'email'                                  AS agent_email,
-        elem->>'channel'                                AS channel,
-        (elem->>'queuedAt')::timestamptz                AS queued_at,
-        (elem->>'assignedAt')::timestamptz              AS assigned_at,
-        (elem->>'closedAt')::timestamptz                AS closed_at,
-        (elem->>'initialAgentSession')::text            AS initial_session_id,
-        r.loaded_at
-    FROM raw_rows r,
-         jsonb_array_elements(r.source_data->'data') AS elem
-    WHERE elem->>'agentSessionId' IS NOT NULL
-),
-deduplicated AS (
-    SELECT *,
-        row_number() OVER (
-            PARTITION BY tenant_id, session_id
-            ORDER BY loaded_at DESC
-        ) AS _rn
-    FROM flattened
-)
-SELECT tenant_id, session_id, conversation_session_id, contact_id, agent_id,
-       agent_email, channel, queued_at, assigned_at, closed_at, initial_session_id
-FROM deduplicated WHERE _rn = 1
+SELECT
+    tenant_id,
+    session_id,
+    nullif(conversation_session_id, '')  AS conversation_session_id,
+    contact_id,
+    nullif(agent_id, '')                 AS agent_id,
+    agent_email,
+    channel,
+    queued_at,
+    assigned_at,
+    closed_at,
+    nullif(initial_session_id, '')       AS initial_session_id,
+    CASE WHEN queued_at IS NOT NULL AND assigned_at IS NOT NULL
+        THEN GREATEST(0, floor(EXTRACT(EPOCH FROM assigned_at - queued_at)))::int
+    END                                  AS wait_time_seconds,
+    CASE WHEN assigned_at IS NOT NULL AND closed_at IS NOT NULL
+        THEN GREATEST(0, floor(EXTRACT(EPOCH FROM closed_at - assigned_at)))::int
+    END                                  AS handle_time_seconds
+FROM raw.chat_conversation_rows
+WHERE tenant_id = :tid
+  AND loaded_at > :since AND loaded_at <= :until
 """
 
 CONVERSATIONS_UPSERT = """
@@ -693,10 +866,7 @@ INSERT INTO public.chat_conversations
     (tenant_id, session_id, conversation_session_id, contact_id, agent_id,
      agent_email, channel, queued_at, assigned_at, closed_at,
      initial_session_id, wait_time_seconds, handle_time_seconds)
-VALUES
-    (:tenant_id, :session_id, :conversation_session_id, :contact_id, :agent_id,
-     :agent_email, :channel, :queued_at, :assigned_at, :closed_at,
-     :initial_session_id, :wait_time_seconds, :handle_time_seconds)
+SELECT * FROM src
 ON CONFLICT (tenant_id, session_id) DO UPDATE SET
     conversation_session_id = EXCLUDED.conversation_session_id,
     contact_id       = EXCLUDED.contact_id,
@@ -709,42 +879,27 @@ ON CONFLICT (tenant_id, session_id) DO UPDATE SET
     initial_session_id = EXCLUDED.initial_session_id,
     wait_time_seconds  = EXCLUDED.wait_time_seconds,
     handle_time_seconds = EXCLUDED.handle_time_seconds
+WHERE (chat_conversations.conversation_session_id, chat_conversations.contact_id,
+       chat_conversations.agent_id, chat_conversations.agent_email,
+       chat_conversations.channel, chat_conversations.queued_at,
+       chat_conversations.assigned_at, chat_conversations.closed_at,
+       chat_conversations.initial_session_id, chat_conversations.wait_time_seconds,
+       chat_conversations.handle_time_seconds)
+      IS DISTINCT FROM
+      (EXCLUDED.conversation_session_id, EXCLUDED.contact_id, EXCLUDED.agent_id,
+       EXCLUDED.agent_email, EXCLUDED.channel, EXCLUDED.queued_at, EXCLUDED.assigned_at,
+       EXCLUDED.closed_at, EXCLUDED.initial_session_id, EXCLUDED.wait_time_seconds,
+       EXCLUDED.handle_time_seconds)
 """
 
 
-def transform_conversations(conn) -> int:
-    rows = conn.execute(text(CONVERSATIONS_SQL), {"tid": TENANT_ID}).fetchall()
-    count = 0
-    for r in rows:
-        queued_at = r[7]
-        assigned_at = r[8]
-        closed_at = r[9]
-
-        wait_secs = None
-        if queued_at and assigned_at:
-            wait_secs = max(0, int((assigned_at - queued_at).total_seconds()))
-
-        handle_secs = None
-        if assigned_at and closed_at:
-            handle_secs = max(0, int((closed_at - assigned_at).total_seconds()))
-
-        conn.execute(text(CONVERSATIONS_UPSERT), {
-            "tenant_id": r[0],
-            "session_id": str(r[1]),
-            "conversation_session_id": str(r[2]) if r[2] else None,
-            "contact_id": r[3],
-            "agent_id": str(r[4]) if r[4] else None,
-            "agent_email": r[5],
-            "channel": r[6],
-            "queued_at": queued_at,
-            "assigned_at": assigned_at,
-            "closed_at": closed_at,
-            "initial_session_id": str(r[10]) if r[10] else None,
-            "wait_time_seconds": wait_secs,
-            "handle_time_seconds": handle_secs,
-        })
-        count += 1
-    return count
+# Agents refreshed by agents_from_conversations / agents_refresh
+CONVERSATIONS_TRACK = ("public.chat_conversations", ["tenant_id", "session_id"], ["agent_id"])
+
+
+def transform_conversations(conn, params: dict) -> dict:
+    return run_upsert(conn, CONVERSATIONS_SQL, CONVERSATIONS_UPSERT, params,
+                      track=CONVERSATIONS_TRACK)
 
 
 # ---------------------------------------------------------------------------
@@ -761,6 +916,8 @@ WITH raw_rows AS (
     WHERE endpoint = '/v1/chat/channel'
       AND source_data->'data' IS NOT NULL
       AND jsonb_typeof(source_data->'data') = 'array'
+      AND loaded_at > :since AND loaded_at <= :until
+      AND coalesce(tenant_id, :default_tid) = :tid
 ),
 flattened AS (
     SELECT
@@ -791,36 +948,23 @@ FROM deduplicated WHERE _rn = 1
 CHANNELS_UPSERT = """
 INSERT INTO public.chat_channels
     (tenant_id, channel_id, channel_type, channel_name, phone_number, status, config)
-VALUES
-    (:tenant_id, :channel_id, :channel_type, :channel_name, :phone_number, :status, :config)
+SELECT * FROM src
 ON CONFLICT (tenant_id, channel_id) DO UPDATE SET
     channel_type = EXCLUDED.channel_type,
     channel_name = EXCLUDED.channel_name,
     phone_number = EXCLUDED.phone_number,
     status       = EXCLUDED.status,
     config       = EXCLUDED.config
+WHERE (chat_channels.channel_type, chat_channels.channel_name,
+       chat_channels.phone_number, chat_channels.status, chat_channels.config)
+      IS DISTINCT FROM
+      (EXCLUDED.channel_type, EXCLUDED.channel_name, EXCLUDED.phone_number,
+       EXCLUDED.status, EXCLUDED.config)
 """
 
 
-def transform_channels(conn) -> int:
-    rows = conn.execute(text(CHANNELS_SQL), {"tid": TENANT_ID}).fetchall()
-    count = 0
-    for r in rows:
-        config_val = r[6]
-        if config_val and not isinstance(config_val, str):
-            config_val = _json.dumps(config_val)
-
-        conn.execute(text(CHANNELS_UPSERT), {
-            "tenant_id": r[0],
-            "channel_id": str(r[1]),
-            "channel_type": r[2],
-            "channel_name": r[3],
-            "phone_number": r[4],
-            "status": r[5],
-            "config": config_val,
-        })
-        count += 1
-    return count
+def transform_channels(conn, params: dict) -> dict:
+    return run_upsert(conn, CHANNELS_SQL, CHANNELS_UPSERT, params)
 
 
 # ---------------------------------------------------------------------------
@@ -837,6 +981,8 @@ WITH raw_rows AS (
     WHERE endpoint = '/v1/chat/topic'
       AND source_data->'data' IS NOT NULL
       AND jsonb_typeof(source_data->'data') = 'array'
+      AND loaded_at > :since AND loaded_at <= :until
+      AND coalesce(tenant_id, :default_tid) = :tid
 ),
 flattened AS (
     SELECT
@@ -865,28 +1011,19 @@ FROM deduplicated WHERE _rn = 1
 TOPICS_UPSERT = """
 INSERT INTO public.chat_topics
     (tenant_id, topic_id, topic_name, description, is_active)
-VALUES
-    (:tenant_id, :topic_id, :topic_name, :description, :is_active)
+SELECT * FROM src
 ON CONFLICT (tenant_id, topic_id) DO UPDATE SET
     topic_name  = EXCLUDED.topic_name,
     description = EXCLUDED.description,
     is_active   = EXCLUDED.is_active
+WHERE (chat_topics.topic_name, chat_topics.description, chat_topics.is_active)
+      IS DISTINCT FROM
+      (EXCLUDED.topic_name, EXCLUDED.description, EXCLUDED.is_active)
 """
 
 
-def transform_topics(conn) -> int:
-    rows = conn.execute(text(TOPICS_SQL), {"tid": TENANT_ID}).fetchall()
-    count = 0
-    for r in rows:
-        conn.execute(text(TOPICS_UPSERT), {
-            "tenant_id": r[0],
-            "topic_id": str(r[1]),
-            "topic_name": r[2],
-            "description": r[3],
-            "is_active": r[4],
-        })
-        count += 1
-    return count
+def transform_topics(conn, params: dict) -> dict:
+    return run_upsert(conn, TOPICS_SQL, TOPICS_UPSERT, params)
 
 
 # ---------------------------------------------------------------------------
@@ -904,22 +1041,36 @@ WITH msg_stats AS (
         count(*) FILTER (WHERE is_fallback = TRUE) AS fallback_count
     FROM public.messages
     WHERE tenant_id = :tid
+      AND (CAST(:dates AS date[]) IS NULL OR date = ANY(CAST(:dates AS date[])))
     GROUP BY tenant_id, date
 )
 INSERT INTO public.daily_stats
     (tenant_id, date, total_messages, unique_contacts, conversations, fallback_count)
-SELECT tenant_id, date, total_messages, unique_contacts, conversations, fallback_count
-FROM msg_stats
+SELECT
+    ms.tenant_id, ms.date,
+    GREATEST(ms.total_messages,
+             (SELECT coalesce(sum(td.enviados), 0) FROM public.toques_daily td
+              WHERE td.tenant_id = ms.tenant_id AND td.date = ms.date)),
+    ms.unique_contacts, ms.conversations, ms.fallback_count
+FROM msg_stats ms
 ON CONFLICT (tenant_id, date) DO UPDATE SET
-    total_messages  = GREATEST(daily_stats.total_messages, EXCLUDED.total_messages),
-    unique_contacts = GREATEST(daily_stats.unique_contacts, EXCLUDED.unique_contacts),
-    conversations   = GREATEST(daily_stats.conversations, EXCLUDED.conversations),
-    fallback_count  = GREATEST(daily_stats.fallback_count, EXCLUDED.fallback_count)
+    total_messages  = EXCLUDED.total_messages,
+    unique_contacts = EXCLUDED.unique_contacts,
+    conversations   = EXCLUDED.conversations,
+    fallback_count  = EXCLUDED.fallback_count
+WHERE (daily_stats.total_messages, daily_stats.unique_contacts,
+       daily_stats.conversations, daily_stats.fallback_count)
+      IS DISTINCT FROM
+      (EXCLUDED.total_messages, EXCLUDED.unique_contacts,
+       EXCLUDED.conversations, EXCLUDED.fallback_count)
 """
 
 
-def update_daily_stats_from_messages(conn) -> int:
-    result = conn.execute(text(DAILY_STATS_FROM_MESSAGES), {"tid": TENANT_ID})
+def update_daily_stats_from_messages(conn, tid: str, touched: dict | None = None) -> int:
+    dates = touched_keys(touched, "messages.date")
+    if dates == []:
+        return 0
+    result = conn.execute(text(DAILY_STATS_FROM_MESSAGES), {"tid": tid, "dates": dates})
     return result.rowcount
 
 
@@ -927,29 +1078,29 @@ def update_daily_stats_from_messages(conn) -> int:
 # Pre-messages: ensure all agent_ids from raw messages exist in agents table
 # ---------------------------------------------------------------------------
 
-AGENTS_STUBS_FROM_RAW_MESSAGES = """
-WITH raw_agents AS (
-    SELECT DISTINCT
-        coalesce(r.tenant_id, :tid) AS tenant_id,
-        elem->>'agentId' AS agent_id
-    FROM raw.raw_chat_stats r,
-         jsonb_array_elements(r.source_data->'data') AS elem
-    WHERE r.endpoint = '/v1/chat/history/csv'
-      AND r.source_data->'data' IS NOT NULL
-      AND jsonb_typeof(r.source_data->'data') = 'array'
-      AND elem->>'agentId' IS NOT NULL
-      AND elem->>'agentId' != ''
-)
+AGENT_STUBS_SQL = """
+SELECT DISTINCT tenant_id, agent_id, 0 AS total_messages, 0 AS conversations_handled
+FROM raw.chat_message_rows
+WHERE tenant_id = :tid
+  AND loaded_at > :since AND loaded_at <= :until
+  AND agent_id IS NOT NULL
+  AND agent_id != ''
+"""
+
+AGENT_STUBS_UPSERT = """
 INSERT INTO public.agents (tenant_id, agent_id, total_messages, conversations_handled)
-SELECT tenant_id, agent_id, 0, 0
-FROM raw_agents
+SELECT * FROM src
 ON CONFLICT (tenant_id, agent_id) DO NOTHING
 """
 
 
-def ensure_agents_from_raw_messages(conn) -> int:
-    result = conn.execute(text(AGENTS_STUBS_FROM_RAW_MESSAGES), {"tid": TENANT_ID})
-    return result.rowcount
+def ensure_agents_from_raw_messages(conn, params: dict) -> dict:
+    """Stub agents for raw message pages loaded since the agent_stubs watermark.
+
+    Runs as its own graph entity before messages, so every agent_id a new
+    message page references exists when the messages FK is checked.
+    """
+    return run_upsert(conn, AGENT_STUBS_SQL, AGENT_STUBS_UPSERT, params)
 
 
 # ---------------------------------------------------------------------------
@@ -965,6 +1116,7 @@ WITH agent_stats AS (
         avg(handle_time_seconds) FILTER (WHERE handle_time_seconds IS NOT NULL) AS avg_handle
     FROM public.chat_conversations
     WHERE tenant_id = :tid AND agent_id IS NOT NULL
+      AND (CAST(:agent_ids AS text[]) IS NULL OR agent_id = ANY(CAST(:agent_ids AS text[])))
     GROUP BY tenant_id, agent_id
 )
 INSERT INTO public.agents
@@ -974,11 +1126,17 @@ FROM agent_stats
 ON CONFLICT (tenant_id, agent_id) DO UPDATE SET
     conversations_handled    = EXCLUDED.conversations_handled,
     avg_handle_time_seconds  = EXCLUDED.avg_handle_time_seconds
+WHERE (agents.conversations_handled, agents.avg_handle_time_seconds)
+      IS DISTINCT FROM
+      (EXCLUDED.conversations_handled, EXCLUDED.avg_handle_time_seconds)
 """
 
 
-def update_agents_from_conversations(conn) -> int:
-    result = conn.execute(text(AGENTS_FROM_CONVERSATIONS), {"tid": TENANT_ID})
+def update_agents_from_conversations(conn, tid: str, touched: dict | None = None) -> int:
+    agent_ids = touched_keys(touched, "chat_conversations.agent_id")
+    if agent_ids == []:
+        return 0
+    result = conn.execute(text(AGENTS_FROM_CONVERSATIONS), {"tid": tid, "agent_ids": agent_ids})
     return result.rowcount
 
 
@@ -995,6 +1153,7 @@ WITH contact_stats AS (
         count(DISTINCT conversation_id) FILTER (WHERE conversation_id IS NOT NULL) AS total_conversations
     FROM public.messages
     WHERE tenant_id = :tid AND contact_id IS NOT NULL
+      AND (CAST(:contact_ids AS text[]) IS NULL OR contact_id = ANY(CAST(:contact_ids AS text[])))
     GROUP BY tenant_id, contact_id
 )
 UPDATE public.contacts c SET
@@ -1002,11 +1161,16 @@ UPDATE public.contacts c SET
     total_conversations = cs.total_conversations
 FROM contact_stats cs
 WHERE c.tenant_id = cs.tenant_id AND c.contact_id = cs.contact_id
+  AND (c.total_messages, c.total_conversations)
+      IS DISTINCT FROM (cs.total_messages, cs.total_conversations)
 """
 
 
-def update_contacts_from_messages(conn) -> int:
-    result = conn.execute(text(CONTACTS_FROM_MESSAGES), {"tid": TENANT_ID})
+def update_contacts_from_messages(conn, tid: str, touched: dict | None = None) -> int:
+    contact_ids = touched_keys(touched, "messages.contact_id")
+    if contact_ids == []:
+        return 0
+    result = conn.execute(text(CONTACTS_FROM_MESSAGES), {"tid": tid, "contact_ids": contact_ids})
     return result.rowcount
 
 
@@ -1022,17 +1186,22 @@ WITH agent_msg_stats AS (
         count(*) AS total_messages
     FROM public.messages
     WHERE tenant_id = :tid AND agent_id IS NOT NULL
+      AND (CAST(:agent_ids AS text[]) IS NULL OR agent_id = ANY(CAST(:agent_ids AS text[])))
     GROUP BY tenant_id, agent_id
 )
 UPDATE public.agents a SET
     total_messages = ams.total_messages
 FROM agent_msg_stats ams
 WHERE a.tenant_id = ams.tenant_id AND a.agent_id = ams.agent_id
+  AND a.total_messages IS DISTINCT FROM ams.total_messages
 """
 
 
-def update_agents_messages(conn) -> int:
-    result = conn.execute(text(AGENTS_MESSAGES), {"tid": TENANT_ID})
+def update_agents_messages(conn, tid: str, touched: dict | None = None) -> int:
+    agent_ids = touched_keys(touched, "messages.agent_id")
+    if agent_ids == []:
+        return 0
+    result = conn.execute(text(AGENTS_MESSAGES), {"tid": tid, "agent_ids": agent_ids})
     return result.rowcount
 
 
@@ -1040,11 +1209,12 @@ def update_agents_messages(conn) -> int:
 # Main
 # ---------------------------------------------------------------------------
 
-def transform_sms_aggregates(conn) -> int:
+def transform_sms_aggregates(conn, params: dict) -> dict:
     """Re-aggregate sms_envios into toques_daily, toques_usuario, campaigns, heatmap.
 
     Only runs if sms_envios table exists and has data.
     The actual SMS records are loaded by scripts/import_sms_csv.py.
+    Reads public.sms_envios, not raw.*, so the loaded_at window does not apply.
     """
     has_table = conn.execute(text("""
         SELECT EXISTS (
@@ -1053,23 +1223,18 @@ def transform_sms_aggregates(conn) -> int:
         )
     """)).scalar()
     if not has_table:
-        return 0
+        return merge_counts()
 
     row_count = conn.execute(text(
         "SELECT count(*) FROM public.sms_envios WHERE tenant_id = :tid"
-    ), {"tid": TENANT_ID}).scalar()
+    ), params).scalar()
     if not row_count:
-        return 0
+        return merge_counts()
 
-    total = 0
+    counts = []
 
     # toques_daily (canal='sms')
-    result = conn.execute(text("""
-        INSERT INTO public.toques_daily
-            (tenant_id, date, canal, proyecto_cuenta,
-             enviados, entregados, clicks, chunks, usuarios_unicos,
-             abiertos, rebotes, bloqueados, spam, desuscritos, conversiones,
-             ctr, tasa_entrega, open_rate, conversion_rate)
+    counts.append(run_upsert(conn, """
         SELECT
             :tid, sent_at::date, 'sms', application_id,
             count(*),
@@ -1088,19 +1253,29 @@ def transform_sms_aggregates(conn) -> int:
         FROM public.sms_envios
         WHERE tenant_id = :tid AND sent_at IS NOT NULL
         GROUP BY sent_at::date, application_id
+    """, """
+        INSERT INTO public.toques_daily
+            (tenant_id, date, canal, proyecto_cuenta,
+             enviados, entregados, clicks, chunks, usuarios_unicos,
+             abiertos, rebotes, bloqueados, spam, desuscritos, conversiones,
+             ctr, tasa_entrega, open_rate, conversion_rate)
+        SELECT * FROM src
         ON CONFLICT (tenant_id, date, canal, proyecto_cuenta) DO UPDATE SET
             enviados = EXCLUDED.enviados, entregados = EXCLUDED.entregados,
             clicks = EXCLUDED.clicks, chunks = EXCLUDED.chunks,
             usuarios_unicos = EXCLUDED.usuarios_unicos, rebotes = EXCLUDED.rebotes,
             ctr = EXCLUDED.ctr, tasa_entrega = EXCLUDED.tasa_entrega
-    """), {"tid": TENANT_ID})
-    total += result.rowcount
+        WHERE (toques_daily.enviados, toques_daily.entregados, toques_daily.clicks,
+               toques_daily.chunks, toques_daily.usuarios_unicos, toques_daily.rebotes,
+               toques_daily.ctr, toques_daily.tasa_entrega)
+              IS DISTINCT FROM
+              (EXCLUDED.enviados, EXCLUDED.entregados, EXCLUDED.clicks,
+               EXCLUDED.chunks, EXCLUDED.usuarios_unicos, EXCLUDED.rebotes,
+               EXCLUDED.ctr, EXCLUDED.tasa_entrega)
+    """, params, track=TOQUES_DAILY_TRACK))
 
     # toques_usuario
-    result = conn.execute(text("""
-        INSERT INTO public.toques_usuario
-            (tenant_id, telefono, canal, proyecto_cuenta,
-             total_toques, total_clicks, primer_toque, ultimo_toque, dias_activos)
+    counts.append(run_upsert(conn, """
         SELECT
             :tid, phone, 'sms', application_id,
             count(*), coalesce(sum(clicks), 0),
@@ -1109,24 +1284,29 @@ def transform_sms_aggregates(conn) -> int:
         FROM public.sms_envios
         WHERE tenant_id = :tid AND sent_at IS NOT NULL
         GROUP BY phone, application_id
+    """, """
+        INSERT INTO public.toques_usuario
+            (tenant_id, telefono, canal, proyecto_cuenta,
+             total_toques, total_clicks, primer_toque, ultimo_toque, dias_activos)
+        SELECT * FROM src
         ON CONFLICT (tenant_id, telefono, canal, proyecto_cuenta) DO UPDATE SET
             total_toques = EXCLUDED.total_toques,
             total_clicks = EXCLUDED.total_clicks,
             primer_toque = LEAST(toques_usuario.primer_toque, EXCLUDED.primer_toque),
             ultimo_toque = GREATEST(toques_usuario.ultimo_toque, EXCLUDED.ultimo_toque),
             dias_activos = EXCLUDED.dias_activos
-    """), {"tid": TENANT_ID})
-    total += result.rowcount
+        WHERE (toques_usuario.total_toques, toques_usuario.total_clicks,
+               toques_usuario.primer_toque, toques_usuario.ultimo_toque,
+               toques_usuario.dias_activos)
+              IS DISTINCT FROM
+              (EXCLUDED.total_toques, EXCLUDED.total_clicks,
+               LEAST(toques_usuario.primer_toque, EXCLUDED.primer_toque),
+               GREATEST(toques_usuario.ultimo_toque, EXCLUDED.ultimo_toque),
+               EXCLUDED.dias_activos)
+    """, params))
 
     # campaigns
-    result = conn.execute(text("""
-        INSERT INTO public.campaigns
-            (tenant_id, campana_id, campana_nombre, canal, proyecto_cuenta, tipo_campana,
-             total_enviados, total_entregados, total_clicks, total_chunks,
-             fecha_inicio, fecha_fin,
-             total_abiertos, total_rebotes, total_bloqueados, total_spam,
-             total_desuscritos, total_conversiones,
-             ctr, tasa_entrega, open_rate, conversion_rate)
+    counts.append(run_upsert(conn, """
         SELECT
             :tid, campaign_id, campaign_name, 'sms', application_id,
             max(sending_type),
@@ -1144,6 +1324,15 @@ def transform_sms_aggregates(conn) -> int:
         FROM public.sms_envios
         WHERE tenant_id = :tid
         GROUP BY campaign_id, campaign_name, application_id
+    """, """
+        INSERT INTO public.campaigns
+            (tenant_id, campana_id, campana_nombre, canal, proyecto_cuenta, tipo_campana,
+             total_enviados, total_entregados, total_clicks, total_chunks,
+             fecha_inicio, fecha_fin,
+             total_abiertos, total_rebotes, total_bloqueados, total_spam,
+             total_desuscritos, total_conversiones,
+             ctr, tasa_entrega, open_rate, conversion_rate)
+        SELECT * FROM src
         ON CONFLICT (tenant_id, campana_id) DO UPDATE SET
             campana_nombre = EXCLUDED.campana_nombre,
             total_enviados = EXCLUDED.total_enviados,
@@ -1152,142 +1341,389 @@ def transform_sms_aggregates(conn) -> int:
             fecha_inicio = EXCLUDED.fecha_inicio, fecha_fin = EXCLUDED.fecha_fin,
             total_rebotes = EXCLUDED.total_rebotes,
             ctr = EXCLUDED.ctr, tasa_entrega = EXCLUDED.tasa_entrega
-    """), {"tid": TENANT_ID})
-    total += result.rowcount
-
-    return total
-
-
-TRANSFORMS_PHASE1 = [
-    ("contacts",            transform_contacts),
-    ("daily_stats",         transform_daily_stats),    # must run BEFORE toques_daily (FK dependency)
-    ("toques_daily",        transform_toques_daily),
-    ("toques_heatmap",      transform_heatmap),
-    ("campaigns",           transform_campaigns),
-    ("sms_aggregates",      transform_sms_aggregates), # SMS from CSV import
-    ("chat_conversations",  transform_conversations),  # must run BEFORE messages (agents FK)
-    ("chat_channels",       transform_channels),
-    ("chat_topics",         transform_topics),
+        WHERE (campaigns.campana_nombre, campaigns.total_enviados, campaigns.total_entregados,
+               campaigns.total_clicks, campaigns.total_chunks, campaigns.fecha_inicio,
+               campaigns.fecha_fin, campaigns.total_rebotes, campaigns.ctr,
+               campaigns.tasa_entrega)
+              IS DISTINCT FROM
+              (EXCLUDED.campana_nombre, EXCLUDED.total_enviados, EXCLUDED.total_entregados,
+               EXCLUDED.total_clicks, EXCLUDED.total_chunks, EXCLUDED.fecha_inicio,
+               EXCLUDED.fecha_fin, EXCLUDED.total_rebotes, EXCLUDED.ctr,
+               EXCLUDED.tasa_entrega)
+    """, params))
+
+    return merge_counts(*counts)
+
+
+# Transform DAG — (node, kind, fn, depends_on).
+#   kind "entity": fn(conn, params) over its raw loaded_at window, tracked in sync_state
+#   kind "step":   fn(conn, tid, touched) post-processing over public.* tables, scoped
+#                  to the keys its upstream entities touched (None = all keys)
+# Nodes run as soon as their dependencies have finished (successfully or not),
+# up to --parallelism at a time, each on its own pooled connection.
+TRANSFORM_GRAPH = [
+    ("contacts",                  "entity", transform_contacts,               []),
+    ("daily_stats",               "entity", transform_daily_stats,            []),
+    ("toques_daily",              "entity", transform_toques_daily,           ["daily_stats"]),  # FK
+    ("toques_heatmap",            "entity", transform_heatmap,                []),
+    ("campaigns",                 "entity", transform_campaigns,              []),
+    # SMS rows land in toques_daily + campaigns too; keep them writing last
+    ("sms_aggregates",            "entity", transform_sms_aggregates,         ["toques_daily", "campaigns"]),
+    ("chat_conversations",        "entity", transform_conversations,          []),
+    ("chat_channels",             "entity", transform_channels,               []),
+    ("chat_topics",               "entity", transform_topics,                 []),
+    ("agents_from_conversations", "step",   update_agents_from_conversations, ["chat_conversations"]),
+    ("agent_stubs",               "entity", ensure_agents_from_raw_messages,  ["agents_from_conversations"]),
+    # FKs → contacts, agents, daily_stats
+    ("messages",                  "entity", transform_messages,               ["contacts", "daily_stats",
+                                                                               "agents_from_conversations",
+                                                                               "agent_stubs"]),
+    ("daily_stats_totals",        "step",   update_daily_stats_totals,        ["toques_daily", "sms_aggregates"]),
+    ("daily_stats_from_messages", "step",   update_daily_stats_from_messages, ["messages", "daily_stats_totals"]),
+    ("agents_refresh",            "step",   update_agents_from_conversations, ["agent_stubs"]),
+    ("contacts_enrichment",       "step",   update_contacts_from_messages,    ["messages", "contacts"]),
+    ("agents_total_messages",     "step",   update_agents_messages,           ["messages", "agents_refresh"]),
 ]
 
-TRANSFORMS_PHASE2 = [
-    ("messages",            transform_messages),        # needs agents populated first
-]
 
+# A step whose upstream entity committed keys it has not refreshed yet. Only a
+# 'success' step is marked: an error or older 'pending' already means all keys.
+MARK_STEPS_PENDING_SQL = """
+UPDATE public.sync_state SET status = 'pending'
+WHERE tenant_id = :tid AND entity = ANY(CAST(:steps AS varchar[])) AND status = 'success'
+"""
 
-def _run_transforms(transforms, results):
-    """Run a list of (name, fn) transforms, updating results dict."""
-    for entity, transform_fn in transforms:
-        print(f"\n  [{entity}] Transforming...")
-        try:
-            with engine.begin() as conn:
-                count = transform_fn(conn)
-                update_sync_state(conn, entity, count, "success")
-            results[entity] = count
-            print(f"    {count} rows upserted")
-        except Exception as exc:
-            results[entity] = -1
-            print(f"    [ERROR] {exc}")
-            try:
-                with engine.begin() as conn:
-                    update_sync_state(conn, entity, 0, f"error: {str(exc)[:200]}")
-            except Exception:
-                pass
+STEP_STATUS_SQL = """
+SELECT entity, status FROM public.sync_state
+WHERE tenant_id = :tid AND entity = ANY(CAST(:steps AS varchar[]))
+"""
 
 
-def main():
-    print("=" * 60)
-    print("  Transform Bridge — raw.* JSONB → public.* tables")
-    print("=" * 60)
+_log_lock = threading.Lock()
+_log_tag = ""  # "[tenant] " inside tenant worker processes
 
-    start = time.time()
-    results = {}
 
-    # Phase 1: all tables except messages (conversations must load first)
-    print("\n--- Phase 1: base tables + conversations ---")
-    _run_transforms(TRANSFORMS_PHASE1, results)
+def _log(message: str):
+    """print() for graph nodes — one whole line at a time across worker threads."""
+    with _log_lock:
+        print(f"  {_log_tag}{message.lstrip()}" if _log_tag else message, flush=True)
 
-    # Mid-pipeline: populate agents from conversations (messages FK depends on this)
-    print(f"\n  [agents] Populating from chat conversations (pre-messages)...")
-    try:
-        with engine.begin() as conn:
-            updated = update_agents_from_conversations(conn)
-        print(f"    {updated} agents from conversations")
-    except Exception as exc:
-        print(f"    [ERROR] {exc}")
 
-    # Mid-pipeline: ensure stub agents exist for any agent_id in raw messages
-    print(f"\n  [agents] Ensuring stubs from raw messages...")
-    try:
-        with engine.begin() as conn:
-            updated = ensure_agents_from_raw_messages(conn)
-        print(f"    {updated} additional agent stubs created")
-    except Exception as exc:
-        print(f"    [ERROR] {exc}")
+def _check_graph(graph):
+    """Reject unknown dependencies and cycles before anything runs."""
+    deps = {node: set(depends_on) for node, _, _, depends_on in graph}
+    for node, depends_on in deps.items():
+        unknown = depends_on - deps.keys()
+        if unknown:
+            raise ValueError(f"{node} depends on unknown node(s): {', '.join(sorted(unknown))}")
+    ordered = set()
+    while len(ordered) < len(deps):
+        ready = [n for n, d in deps.items() if n not in ordered and d <= ordered]
+        if not ready:
+            raise ValueError(f"Dependency cycle among: {', '.join(sorted(deps.keys() - ordered))}")
+        ordered.update(ready)
 
-    # Phase 2: messages (now agents exist for FK constraint)
-    print("\n--- Phase 2: messages ---")
-    _run_transforms(TRANSFORMS_PHASE2, results)
 
-    # Post-transform: update daily_stats with aggregated totals from toques_daily
-    print(f"\n  [daily_stats] Updating totals from toques_daily...")
-    try:
-        with engine.begin() as conn:
-            updated = update_daily_stats_totals(conn)
-        print(f"    {updated} rows updated")
-    except Exception as exc:
-        print(f"    [ERROR] {exc}")
+def _run_entity(tid: str, entity: str, transform_fn, until: datetime, full: bool,
+                batch_pages: int = 0, steps: list[str] | None = None) -> dict | None:
+    """Run one windowed transform. Returns its run_upsert counts, or None on error.
 
-    # Post-transform: update daily_stats from messages (chat)
-    print(f"\n  [daily_stats] Updating from chat messages...")
+    Each batch's rows and the watermark advanced to the batch's upper bound
+    commit in one transaction, so an interrupted run resumes after the last
+    committed batch. The same transaction marks the downstream `steps`
+    'pending': the keys it touched live only in memory until they run, so a
+    process killed in between leaves them to recompute all keys next run. The keys those batches touched are not returned on error;
+    run_graph has the steps downstream recompute all keys instead.
+    """
+    committed = 0
     try:
-        with engine.begin() as conn:
-            updated = update_daily_stats_from_messages(conn)
-        print(f"    {updated} rows upserted")
+        with engine.connect() as conn:
+            params = window_params(conn, tid, entity, until, full)
+            bounds = batch_bounds(conn, params, entity, batch_pages)
+        since = params["since"]
+        window = "full rebuild" if since == FULL_REBUILD_SINCE else f"raw loaded_at > {since:%Y-%m-%d %H:%M:%S}"
+        batches = f", {len(bounds)} batches" if len(bounds) > 1 else ""
+        _log(f"  [{entity}] Transforming ({window}{batches})...")
+        batch_counts = []
+        for upper in bounds:
+            with engine.begin() as conn:
+                batch_counts.append(transform_fn(conn, {**params, "since": since, "until": upper}))
+                counts = merge_counts(*batch_counts)
+                update_sync_state(conn, tid, entity, counts["inserted"] + counts["updated"], "success",
+                                  watermark=upper)
+                if steps:
+                    conn.execute(text(MARK_STEPS_PENDING_SQL), {"tid": tid, "steps": steps})
+            since = upper
+            committed += 1
+        _log(f"  [{entity}] {counts['inserted']} inserted, {counts['updated']} updated, "
+             f"{counts['unchanged']} unchanged")
+        return counts
     except Exception as exc:
-        print(f"    [ERROR] {exc}")
+        partial = f" (after {committed} committed batches)" if committed else ""
+        _log(f"  [{entity}] [ERROR] {exc}{partial}")
+        try:
+            with engine.begin() as conn:
+                update_sync_state(conn, tid, entity, 0, f"error: {str(exc)[:200]}")
+        except Exception:
+            pass
+        return None
 
-    # Post-transform: update agents from conversations (refresh with full data)
-    print(f"\n  [agents] Refreshing from chat conversations...")
-    try:
-        with engine.begin() as conn:
-            updated = update_agents_from_conversations(conn)
-        print(f"    {updated} rows upserted")
-    except Exception as exc:
-        print(f"    [ERROR] {exc}")
 
-    # Post-transform: update contacts.total_messages + total_conversations
-    print(f"\n  [contacts] Enriching from messages...")
-    try:
-        with engine.begin() as conn:
-            updated = update_contacts_from_messages(conn)
-        print(f"    {updated} contacts enriched")
-    except Exception as exc:
-        print(f"    [ERROR] {exc}")
+def _run_step(tid: str, node: str, step_fn, touched: dict | None, full: bool,
+              last: str | None) -> int | None:
+    """Run one post-transform step. Returns rows changed, or None on error.
 
-    # Post-transform: update agents.total_messages
-    print(f"\n  [agents] Enriching total_messages from messages...")
+    Incremental runs refresh only the keys the entity transforms touched. The
+    step recomputes everything on --full, on its first run, when its status
+    before this run (`last`) was not 'success' — a failed run, or one killed
+    after its entities committed (left 'pending') — and when touched is None:
+    an upstream node failed, possibly after committing batches whose keys are lost.
+    """
     try:
         with engine.begin() as conn:
-            updated = update_agents_messages(conn)
-        print(f"    {updated} agents enriched")
+            scoped = not full and last == "success" and touched is not None
+            _log(f"  [{node}] Running ({'touched keys' if scoped else 'all keys'})...")
+            count = step_fn(conn, tid, touched if scoped else None)
+            update_sync_state(conn, tid, node, count, "success")
+        _log(f"  [{node}] {count} rows changed")
+        return count
     except Exception as exc:
-        print(f"    [ERROR] {exc}")
+        _log(f"  [{node}] [ERROR] {exc}")
+        try:
+            with engine.begin() as conn:
+                update_sync_state(conn, tid, node, 0, f"error: {str(exc)[:200]}")
+        except Exception:
+            pass
+        return None
+
+
+def _downstream_steps(graph, node: str) -> list[str]:
+    """Step nodes that depend on node, directly or through other nodes."""
+    found, frontier = set(), {node}
+    while frontier:
+        frontier = {n for n, _, _, depends_on in graph if set(depends_on) & frontier} - found
+        found |= frontier
+    return sorted(n for n, kind, _, _ in graph if kind == "step" and n in found)
+
+
+def run_graph(graph, tid: str, until: datetime, full: bool, parallelism: int,
+              batch_pages: int = 0) -> dict:
+    """Execute the transform DAG for one tenant. Returns {node: (result, start_s, elapsed_s, peak_rss_mb)}.
+
+    result is the node's counts, or None if it failed. Keys touched by entity
+    nodes are collected as they finish and handed to the steps that depend on them;
+    steps downstream of a failed node get None and recompute all keys.
+    Peak RSS is per node with parallelism 1; otherwise it is the process-wide
+    high-water mark when the node finished.
+    """
+    _check_graph(graph)
+    deps = {node: set(depends_on) for node, _, _, depends_on in graph}
+    steps = [node for node, kind, _, _ in graph if kind == "step"]
+    downstream = {node: _downstream_steps(graph, node) for node in deps}
+    # Step statuses as this run found them, before its entities mark them pending
+    with engine.connect() as conn:
+        last_status = dict(conn.execute(text(STEP_STATUS_SQL), {"tid": tid, "steps": steps}).all())
+    t0 = time.perf_counter()
+
+    def run_node(node, kind, fn, touched):
+        if parallelism == 1:
+            reset_peak_rss()
+        node_start = time.perf_counter()
+        if kind == "entity":
+            result = _run_entity(tid, node, fn, until, full, batch_pages, downstream[node])
+        else:
+            result = _run_step(tid, node, fn, touched, full, last_status.get(node))
+        return result, node_start - t0, time.perf_counter() - node_start, peak_rss_mb()
+
+    timings = {}
+    touched = {}
+    failed = set()  # failed nodes and everything downstream of them
+    pending = list(graph)
+    running = {}
+    with ThreadPoolExecutor(max_workers=parallelism) as pool:
+        while pending or running:
+            for spec in [s for s in pending if deps[s[0]] <= timings.keys()]:
+                node, kind, fn, _ = spec
+                pending.remove(spec)
+                if deps[node] & failed:
+                    failed.add(node)
+                    snapshot = None
+                else:
+                    snapshot = {k: set(v) for k, v in touched.items()}
+                running[pool.submit(run_node, node, kind, fn, snapshot)] = node
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                node = running.pop(future)
+                timings[node] = future.result()
+                result = timings[node][0]
+                if result is None:
+                    failed.add(node)
+                elif isinstance(result, dict):
+                    for k, keys in result["touched"].items():
+                        touched.setdefault(k, set()).update(keys)
+    return timings
+
+
+def discover_tenants(conn) -> list[str]:
+    """Tenants with sync_state rows (extraction cursors or transform watermarks), plus the default."""
+    tenants = conn.execute(text("SELECT DISTINCT tenant_id FROM public.sync_state")).scalars().all()
+    return sorted(set(tenants) | {TENANT_ID})
+
+
+def _init_tenant_worker():
+    """Drop pooled connections inherited from the parent — they must not cross a fork."""
+    engine.dispose(close=False)
+
+
+def run_tenant(tid: str, until: datetime, full: bool, parallelism: int,
+               batch_pages: int = 0, tag: bool = False) -> dict:
+    """run_graph for one tenant, in a worker process or inline.
+
+    Touched keys are dropped from the returned counts: they only matter inside
+    the tenant's graph and would otherwise be pickled back to the parent.
+    """
+    global _log_tag
+    if tag:
+        _log_tag = f"[{tid}] "
+    timings = run_graph(TRANSFORM_GRAPH, tid, until, full, parallelism, batch_pages)
+    return {
+        node: ({**result, "touched": {}} if isinstance(result, dict) else result, *rest)
+        for node, (result, *rest) in timings.items()
+    }
+
+
+def print_graph(graph, timings: dict, parallelism: int, tid: str = TENANT_ID):
+    """Per-node dependencies, start offset and duration, plus the critical path."""
+    print(f"\n{'=' * 60}")
+    print(f"  Transform Graph — {tid} (parallelism={parallelism})")
+    print(f"{'=' * 60}")
+    print(f"  {'Node':<26s} {'Start':>7s} {'Time':>7s} {'PeakRSS':>8s}  Depends on")
+    for node, _, _, depends_on in graph:
+        result, started, elapsed, rss = timings[node]
+        flag = "" if result is not None else "  [ERROR]"
+        print(f"  {node:<26s} {started:>6.1f}s {elapsed:>6.1f}s {rss:>6.0f}MB  "
+              f"{', '.join(depends_on) or '-'}{flag}")
+
+    # Walk back from the last node to finish through the dependency that
+    # finished last — the chain that bounded the wall-clock time.
+    deps = {node: depends_on for node, _, _, depends_on in graph}
+    end = {node: started + elapsed for node, (_, started, elapsed, _) in timings.items()}
+    node = max(end, key=end.get)
+    path = [node]
+    while deps[node]:
+        node = max(deps[node], key=end.get)
+        path.append(node)
+    print(f"\n  Critical path ({max(end.values()):.1f}s): {' → '.join(reversed(path))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transform raw.* JSONB into public.* tables")
+    parser.add_argument("--full", action="store_true",
+                        help="Ignore loaded_at watermarks — re-flatten every raw page")
+    parser.add_argument("--tenants", default="",
+                        help="Comma-separated tenant ids (default: every tenant in sync_state)")
+    parser.add_argument("--parallelism", type=int, default=4,
+                        help="Max transform nodes running at once across all tenants (default: 4)")
+    parser.add_argument("--tenant-workers", type=int, default=0,
+                        help="Tenants transformed at once, each in its own process "
+                             "(default: as many as --parallelism allows)")
+    parser.add_argument("--batch-pages", type=int, default=0,
+                        help="Flatten each entity window in batches of N raw pages, "
+                             "committing after each batch (default: whole window at once)")
+    parser.add_argument("--lag-minutes", type=int, default=WATERMARK_LAG_MINUTES,
+                        help="Leave raw rows loaded in the last N minutes to the next run, so "
+                             "flushes still in flight are not skipped (default: "
+                             f"{WATERMARK_LAG_MINUTES})")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("  Transform Bridge — raw.* JSONB → public.* tables")
+    if args.full:
+        print("  Mode: FULL REBUILD (ignoring watermarks)")
+    print("=" * 60)
+
+    start = time.time()
+
+    # Upper bound of this run's loaded_at window, shared by every tenant.
+    # loaded_at is the now() of the transaction that wrote the row, and an
+    # extraction or backfill flush (a batch of pages plus landing upserts) can
+    # still be running while we transform: a transaction that started before
+    # now() and commits after it would land behind the watermark for good.
+    # Staying --lag-minutes behind leaves such rows to the next run.
+    with engine.connect() as conn:
+        until = conn.execute(text("SELECT now() - make_interval(mins => :lag)"),
+                             {"lag": max(0, args.lag_minutes)}).scalar()
+        tenants = ([t.strip() for t in args.tenants.split(",") if t.strip()]
+                   or discover_tenants(conn))
+
+    # --parallelism caps graph nodes (and so pooled connections) across all
+    # tenant processes: workers × per-tenant parallelism <= --parallelism.
+    parallelism = max(1, args.parallelism)
+    workers = min(len(tenants), args.tenant_workers or parallelism, parallelism)
+    per_tenant = max(1, parallelism // workers)
+    batch_pages = max(0, args.batch_pages)
+    print(f"\n  Tenants: {', '.join(tenants)} ({workers} at a time, "
+          f"parallelism {per_tenant} each)\n")
+
+    tenant_timings = {}
+    if workers == 1:
+        for tid in tenants:
+            tenant_timings[tid] = run_tenant(tid, until, args.full, per_tenant, batch_pages,
+                                             tag=len(tenants) > 1)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_tenant_worker) as pool:
+            futures = {
+                pool.submit(run_tenant, tid, until, args.full, per_tenant, batch_pages, True): tid
+                for tid in tenants
+            }
+            for future in as_completed(futures):
+                tid = futures[future]
+                try:
+                    tenant_timings[tid] = future.result()
+                except Exception as exc:
+                    print(f"[{tid}] [ERROR] tenant worker failed: {exc}", flush=True)
+                    tenant_timings[tid] = None
+
+    for tid in tenants:
+        if tenant_timings[tid] is not None:
+            print_graph(TRANSFORM_GRAPH, tenant_timings[tid], per_tenant, tid)
 
     elapsed = time.time() - start
 
     print(f"\n{'=' * 60}")
     print(f"  Transform Summary")
     print(f"{'=' * 60}")
-    print(f"  Elapsed: {elapsed:.1f}s\n")
-    for entity, count in results.items():
-        status = "OK" if count >= 0 else "ERROR"
-        count_str = str(count) if count >= 0 else "FAILED"
-        print(f"    {entity:<20s}  {count_str:>6s} rows  [{status}]")
-
-    total_ok = sum(v for v in results.values() if v >= 0)
-    total_err = sum(1 for v in results.values() if v < 0)
-    print(f"\n  Total: {total_ok} rows upserted, {total_err} errors")
+    print(f"  Elapsed: {elapsed:.1f}s")
+
+    all_ok = []
+    total_err = 0
+    step_errors = 0
+    for tid in tenants:
+        timings = tenant_timings[tid]
+        print(f"\n  Tenant: {tid}")
+        if timings is None:
+            print("    [ERROR] tenant worker failed — see log above")
+            total_err += 1
+            continue
+        results = {node: timings[node][0] for node, kind, _, _ in TRANSFORM_GRAPH if kind == "entity"}
+        step_errors += sum(1 for node, kind, _, _ in TRANSFORM_GRAPH
+                           if kind == "step" and timings[node][0] is None)
+        print(f"    {'Entity':<20s}  {'Inserted':>8s}  {'Updated':>8s}  {'Unchanged':>9s}")
+        for entity, counts in results.items():
+            if counts is None:
+                print(f"    {entity:<20s}  {'FAILED':>8s}  {'':>8s}  {'':>9s}  [ERROR]")
+                continue
+            print(f"    {entity:<20s}  {counts['inserted']:>8d}  {counts['updated']:>8d}  "
+                  f"{counts['unchanged']:>9d}  [OK]")
+        ok = [v for v in results.values() if v is not None]
+        total_err += len(results) - len(ok)
+        all_ok.extend(ok)
+
+    totals = merge_counts(*all_ok)
+    print(f"\n  Total: {totals['inserted']} inserted, {totals['updated']} updated, "
+          f"{totals['unchanged']} unchanged, {total_err} errors")
+    if step_errors:
+        print(f"  Post-transform steps failed: {step_errors}")
     print(f"{'=' * 60}")
 
     return 0 if total_err == 0 else 1